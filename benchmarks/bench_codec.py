@@ -0,0 +1,81 @@
+"""
+Encode/decode time of a synthetic Syncthing config for every installed
+JSON backend, against the stdlib json module the codec falls back to.
+
+The config has <folders> folders shared with 100 devices, roughly what
+a busy KodeDrive server accumulates.
+
+  $ python benchmarks/bench_codec.py [folders]
+"""
+import os, sys, time, tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from kodrive.py_syncthing_adapter import codec
+
+def make_config(folders, devices=100):
+  device_ids = ['%07d-AAAAAAA-BBBBBBB-CCCCCCC-DDDDDDD-EEEEEEE-FFFFFFF-GGGGGGG' % n
+    for n in range(devices)]
+
+  return {
+    'version' : 12,
+    'devices' : [{
+      'deviceID' : d,
+      'name' : 'device-%d' % n,
+      'addresses' : ['dynamic'],
+      'compression' : 'metadata',
+      'introducer' : False
+    } for n, d in enumerate(device_ids)],
+    'folders' : [{
+      'id' : 'folder-%d' % n,
+      'label' : 'my-sync-%d' % n,
+      'path' : '/home/kodrive/sync/%d/' % n,
+      'type' : 'readwrite',
+      'rescanIntervalS' : 30,
+      'devices' : [{'deviceID' : d} for d in device_ids[n % devices:n % devices + 3]],
+      'ignorePerms' : False,
+      'autoNormalize' : True
+    } for n in range(folders)],
+    'gui' : {'enabled' : True, 'address' : '127.0.0.1:8384', 'apiKey' : 'bench'},
+    'options' : {'listenAddresses' : ['default'], 'globalAnnounceEnabled' : True}
+  }
+
+def best_of(fn, runs=5):
+  best = None
+  for i in range(runs):
+    start = time.time()
+    fn()
+    elapsed = time.time() - start
+    best = elapsed if best is None or elapsed < best else best
+  return best * 1000.0
+
+def main(folders):
+  config = make_config(folders)
+  path = os.path.join(tempfile.mkdtemp(), 'config.json')
+
+  print('folders: %d, encoded size: %d bytes' % (folders, len(codec.dumps(config))))
+  print('%-12s %10s %10s %10s %10s' % (
+    'backend', 'dumps ms', 'loads ms', 'dump ms', 'stream ms'))
+
+  for name in codec.BACKENDS:
+    if codec._load(name) is None:
+      continue
+
+    c = codec.Codec(name)
+    encoded = c.dumps(config)
+
+    def to_file(stream):
+      with open(path, 'w') as f:
+        c.dump(config, f, stream=stream)
+
+    print('%-12s %10.2f %10.2f %10.2f %10.2f' % (name,
+      best_of(lambda: c.dumps(config)),
+      best_of(lambda: c.loads(encoded)),
+      best_of(lambda: to_file(False)),
+      best_of(lambda: to_file(True))))
+
+  print('default: %s' % codec.default.name)
+  os.remove(path)
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
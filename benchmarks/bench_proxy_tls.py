@@ -0,0 +1,124 @@
+"""
+Latency of remote (SyncthingProxy) operations over HTTPS.
+
+Runs a local keep-alive HTTPS server with a throwaway self-signed
+certificate (generated with the openssl command line tool) and replays
+the calls a `kodrive link` makes against a remote: get config, set
+config, restart. Compares a fresh connection (and full TLS handshake)
+per call with the pooled, fingerprint-pinned session SyncthingProxy
+now uses.
+
+  $ python benchmarks/bench_proxy_tls.py [rounds]
+"""
+import os, sys, ssl, time, json, shutil, threading, tempfile, subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import requests
+from kodrive.py_syncthing_adapter import Syncthing, pinning
+
+try:
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  from SocketServer import ThreadingMixIn
+except ImportError:
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+  from socketserver import ThreadingMixIn
+
+CONFIG = json.dumps({
+  'folders' : [{'id' : 'folder-%d' % n, 'path' : '/sync/%d' % n} for n in range(50)],
+  'devices' : [{'deviceID' : 'DEVICE-%d' % n} for n in range(10)]
+}).encode('utf-8')
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  # Send the response in one segment, unbuffered header writes stall on Nagle
+  wbufsize = -1
+
+  def respond(self, body):
+    # Interface always sends a JSON body, drain it to keep the connection usable
+    self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  def do_GET(self):
+    self.respond(CONFIG)
+
+  def do_POST(self):
+    self.respond(b'{}')
+
+  def log_message(self, *args):
+    pass
+
+class Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+  # Clients dropping unused connections abruptly is expected here
+  def handle_error(self, request, client_address):
+    pass
+
+def make_cert(directory):
+  cert = os.path.join(directory, 'cert.pem')
+  key = os.path.join(directory, 'key.pem')
+  subprocess.check_call([
+    'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+    '-subj', '/CN=syncthing', '-keyout', key, '-out', cert
+  ], stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+  return cert, key
+
+def timed(fn, rounds):
+  start = time.time()
+  for i in range(rounds):
+    fn()
+  return (time.time() - start) / rounds * 1000.0
+
+def main(rounds):
+  directory = tempfile.mkdtemp()
+  cert, key = make_cert(directory)
+
+  server = Server(('127.0.0.1', 0), Handler)
+  context = ssl.SSLContext(getattr(ssl, 'PROTOCOL_TLS_SERVER', ssl.PROTOCOL_SSLv23))
+  context.load_cert_chain(cert, key)
+  server.socket = context.wrap_socket(server.socket, server_side=True)
+  port = server.server_address[1]
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+
+  base = 'https://127.0.0.1:%d/rest' % port
+  headers = {'X-API-Key' : 'bench'}
+
+  # A new connection, and so a full handshake, for every call
+  def handshake_per_call():
+    requests.get(base + '/system/config', data='{}', headers=headers, verify=False)
+    requests.post(base + '/system/config', data=CONFIG, headers=headers, verify=False)
+    requests.post(base + '/system/restart', data='{}', headers=headers, verify=False)
+
+  sync = Syncthing(api_key='bench', host='127.0.0.1', port=port, is_https=True,
+    fingerprint=pinning.file_fingerprint(cert), cache=False)
+
+  def pinned_session():
+    sync.sys.set.config(json.loads(CONFIG.decode('utf-8')))
+    sync.sys.config()
+    sync.sys.set.restart()
+
+  import warnings
+  with warnings.catch_warnings():
+    warnings.simplefilter('ignore')
+    before = timed(handshake_per_call, rounds)
+
+  after = timed(pinned_session, rounds)
+
+  print('rounds (get config, set config, restart): %d' % rounds)
+  print('handshake per call: %.3f ms/round' % before)
+  print('pinned session:     %.3f ms/round' % after)
+  print('speedup:            %.2fx' % (before / after))
+
+  server.shutdown()
+  shutil.rmtree(directory)
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
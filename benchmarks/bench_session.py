@@ -0,0 +1,77 @@
+"""
+Per-call latency of Interface REST calls with and without a pooled session.
+
+Runs a local keep-alive HTTP server that mimics /rest/system/ping and
+compares the old module-level ``requests.request`` path against the
+persistent ``requests.Session`` now used by ``Interface``.
+
+  $ python benchmarks/bench_session.py [calls]
+"""
+import os, sys, time, json, threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import requests
+from kodrive.py_syncthing_adapter import Syncthing
+
+try:
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+  from SocketServer import ThreadingMixIn
+except ImportError:
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+  from socketserver import ThreadingMixIn
+
+PONG = json.dumps({'ping' : 'pong'}).encode('utf-8')
+
+class Handler(BaseHTTPRequestHandler):
+  protocol_version = 'HTTP/1.1'
+
+  # Send the response in one segment, unbuffered header writes stall on Nagle
+  wbufsize = -1
+
+  def do_GET(self):
+    # Interface always sends a JSON body, drain it to keep the connection usable
+    self.rfile.read(int(self.headers.get('Content-Length', 0)))
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Content-Length', str(len(PONG)))
+    self.end_headers()
+    self.wfile.write(PONG)
+
+  def log_message(self, *args):
+    pass
+
+class Server(ThreadingMixIn, HTTPServer):
+  daemon_threads = True
+
+def timed(fn, calls):
+  start = time.time()
+  for i in range(calls):
+    fn()
+  return (time.time() - start) / calls * 1000.0
+
+def main(calls):
+  server = Server(('127.0.0.1', 0), Handler)
+  port = server.server_address[1]
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+
+  url = 'http://127.0.0.1:%d/rest/system/ping' % port
+  sync = Syncthing(api_key='bench', host='127.0.0.1', port=port)
+
+  # Same request the old Interface.__req issued
+  headers = {'X-API-Key' : 'bench'}
+  before = timed(lambda: requests.request(
+    'GET', url, data=json.dumps({}), timeout=3.5, headers=headers), calls)
+  after = timed(lambda: sync.sys.ping(), calls)
+
+  print('calls:            %d' % calls)
+  print('requests.request: %.3f ms/call' % before)
+  print('pooled session:   %.3f ms/call' % after)
+  print('speedup:          %.2fx' % (before / after))
+
+  server.shutdown()
+
+if __name__ == '__main__':
+  main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
@@ -1,7 +1,12 @@
 import click
-import os, time, math, pdb
+import os, math, pdb
+import atexit, sys as _sys
 
 from . import cli_syncthing_adapter
+from .py_syncthing_adapter import instrument
+from .py_syncthing_adapter import codec
+from .utils import auth_report
+from .data import custom_errors
 
 CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 @click.version_option()
@@ -12,7 +17,25 @@ CONTEXT_SETTINGS = dict(help_option_names=['-h', '--help'])
 @click.pass_context
 def main(ctx):
   ''' A tool to synchronize remote/local directories. '''
-  pass
+
+  # KODRIVE_METRICS=<file> (or '-' for stderr) dumps per-endpoint
+  # latency and payload stats for this command when it exits
+  target = os.environ.get('KODRIVE_METRICS')
+  if target:
+    enable_metrics(target)
+
+def enable_metrics(target):
+  aggregator = instrument.Aggregator()
+  instrument.add_hook(aggregator)
+
+  def dump():
+    if target == '-':
+      _sys.stderr.write(aggregator.dump() + '\n')
+    else:
+      with open(target, 'w') as f:
+        aggregator.dump(f)
+
+  atexit.register(dump)
 
 # 
 # Subcommands start
@@ -42,16 +65,26 @@ def sys(**kwargs):
 
 ### Ls
 @main.command()
-def ls():
+@click.option(
+  '-l', '--long', is_flag=True,
+  help="Also show state, bytes needed and last scan."
+)
+@click.option(
+  '-j', '--json', 'fmt', flag_value='json',
+  help="Print a JSON array."
+)
+@click.option(
+  '--ndjson', 'fmt', flag_value='ndjson',
+  help="Print one JSON object per line."
+)
+def ls(long, fmt):
   ''' List all synchronized directories. '''
 
-  heading, body = cli_syncthing_adapter.ls()
-
-  if heading:
-    click.echo(heading)
-
-  if body:
-    click.echo(body.strip())
+  try:
+    for line in cli_syncthing_adapter.ls(long, fmt):
+      click.echo(line)
+  except custom_errors.KodeDriveError as e:
+    click.echo("%s" % e, err=True)
 
 ### Link
 @main.command()
@@ -173,9 +206,17 @@ def dir(ctx):
 
 ### Mv
 @dir.command()
+@click.option(
+  '-j', '--jobs', type=int, default=None,
+  metavar="<INTEGER>", help="Files copied at once between filesystems."
+)
+@click.option(
+  '--new-id', is_flag=True,
+  help="Give moved folders new ids; devices must be linked again."
+)
 @click.argument('source', nargs=-1, required=True)
 @click.argument('target', nargs=1)
-def mv(source, target):
+def mv(source, target, jobs, new_id):
   ''' Move synchronized directory. '''
 
   if os.path.isfile(target) and len(source) == 1:
@@ -194,7 +235,21 @@ def mv(source, target):
     return
 
   else:
-    err_msg, err = cli_syncthing_adapter.mv(source, target)
+    # Only shown when data has to be copied between filesystems
+    bars = []
+
+    def progress(done, total):
+      if not bars:
+        bars.append(click.progressbar(length=total, label='Copying'))
+        bars[0].__enter__()
+
+      bars[0].update(done - bars[0].pos)
+
+    try:
+      err_msg, err = cli_syncthing_adapter.mv(source, target, jobs, progress, not new_id)
+    finally:
+      if bars:
+        bars[0].__exit__(None, None, None)
 
     if err_msg:
       click.echo(err_msg, err)
@@ -212,38 +267,35 @@ def mv(source, target):
 def push(**kwargs):
   ''' Force synchronization of directory. '''
 
-  output, err = cli_syncthing_adapter.refresh(**kwargs)
+  if not kwargs['verbose']:
+    output, err = cli_syncthing_adapter.refresh(**kwargs)
 
-  if output:
-    click.echo("%s" % output, err=err)
+    if output:
+      click.echo("%s" % output, err=err)
+    return
 
-  if kwargs['verbose'] and not err:
-    with click.progressbar(
-      iterable=None,
-      length=100,
-      label='Synchronizing') as bar:
+  # Scans once, then follows the daemon's events
+  progress, err = cli_syncthing_adapter.push_progress(kwargs['path'])
 
-      device_num = 0
-      max_devices = 1
-      prev_percent = 0
+  if err:
+    click.echo("%s" % progress, err=err)
+    return
 
-      while True:
-        kwargs['progress'] = True
-        kwargs['device_num'] = device_num
-        data, err = cli_syncthing_adapter.refresh(**kwargs)
+  with click.progressbar(
+    iterable=None,
+    length=100,
+    label='Synchronizing') as bar:
 
-        device_num = data['device_num']
-        max_devices = data['max_devices']
+    prev_percent = 0
 
-        cur_percent = math.floor(data['percent']) - prev_percent
-        if cur_percent > 0:
-          bar.update(cur_percent)
-          prev_percent = math.floor(data['percent'])
+    for data in progress:
+      cur_percent = math.floor(data['percent']) - prev_percent
+      if cur_percent > 0:
+        bar.update(cur_percent)
+        prev_percent = math.floor(data['percent'])
 
-        if device_num < max_devices:
-          time.sleep(0.5)
-        else:
-          break
+  if prev_percent < 100:
+    click.echo("Gave up waiting for %s to synchronize." % kwargs['path'], err=True)
 
 ### Tag
 @dir.command()
@@ -297,17 +349,51 @@ def add(**kwargs):
 
 ### Info 
 @dir.command()
+@click.option(
+  '-l', '--limit', type=int, default=None,
+  metavar="<INTEGER>", help="List at most this many needed files."
+)
+@click.option(
+  '-s', '--summary', is_flag=True,
+  help="Only show totals, do not list needed files."
+)
+@click.option(
+  '-j', '--json', 'as_json', is_flag=True,
+  help="Print the information as JSON."
+)
 @click.argument(
   'path', nargs=1, 
   type=click.Path(exists=True, writable=True, resolve_path=True), 
 )
-def info(path):
+def info(path, limit, summary, as_json):
   ''' Display synchronization information. '''
 
   output, err = cli_syncthing_adapter.info(folder=path)
 
   if err:
     click.echo(output, err=err)
+  elif as_json:
+    # files_needed comes last, its names are written as pages arrive
+    click.echo('{"status": %s, "devices": %s, "files_needed": ' % (
+      codec.dumps(output['status']), codec.dumps(output['auth_report'])), nl=False)
+
+    sep = '['
+
+    if not summary and limit != 0:
+      shown = 0
+
+      try:
+        for section, f in output['files_needed']:
+          click.echo(sep + codec.dumps(f['name']))
+          sep = ','
+          shown += 1
+
+          if limit and shown >= limit:
+            break
+      except Exception as e:
+        click.echo("Could not list needed files: %s" % e, err=True)
+
+    click.echo('[]}' if sep == '[' else ']}')
   else:
     stat = output['status']
     click.echo("State: %s" % stat['state'])
@@ -316,23 +402,28 @@ def info(path):
     click.echo("\nTotal Bytes: %s" % stat['localBytes'])
     click.echo("Bytes Needed: %s" % stat['needBytes'])
 
-    progress = output['files_needed']['progress']
-    queued = output['files_needed']['queued']
-    rest = output['files_needed']['rest']
+    if not summary and limit != 0:
+      # Files are streamed a page at a time, never held in memory at once
+      shown = 0
 
-    if len(progress) or len(queued) or len(rest):
-      click.echo("\nFiles Needed:")
+      try:
+        for section, f in output['files_needed']:
+          if shown == 0:
+            click.echo("\nFiles Needed:")
 
-    for f in progress:
-      click.echo("  " + f['name'])
+          click.echo("  " + f['name'])
+          shown += 1
 
-    for f in queued:
-      click.echo("  " + f['name'])
+          if limit and shown >= limit:
+            break
+      except Exception as e:
+        click.echo("Could not list needed files: %s" % e, err=True)
 
-    for f in rest:
-      click.echo("  " + f['name'])
+      remaining = stat['needFiles'] - shown
+      if shown and remaining > 0:
+        click.echo("  ... and %s more" % remaining)
 
-    click.echo("\nDevices Authorized:\n%s" % output['auth_ls'])
+    click.echo("\nDevices Authorized:\n%s" % auth_report.format_table(output['auth_report']))
 
 ### Key
 @dir.command()
@@ -403,6 +494,11 @@ def info(**kwargs):
     type=click.Path(exists=True, writable=True, resolve_path=True), 
     help="Set where config files are stored."
 )
+@click.option(
+    '-u', '--unix-socket', nargs=1, metavar="<PATH>",
+    type=click.Path(resolve_path=True),
+    help="Serve the local API on a unix socket instead of a TCP port."
+)
 def start(**kwargs):
   ''' Start KodeDrive daemon. '''
 
@@ -1,7 +1,10 @@
 from .data import custom_errors
 from .data import config
 from .utils import config_rollbacker as rb
+from .utils import copy_engine
 from . import syncthing_factory as factory
+from .py_syncthing_adapter import retry
+from .py_syncthing_adapter import codec
 
 import click, time
 import json, os, traceback
@@ -19,18 +22,22 @@ class SystemFactory:
     if not handler.ping():
       raise custom_errors.CannotConnect()
 
-    handler.restart()
+    handler.restart(wait=True)
     
     click.echo("KodeDrive is now restarting.")
 
-    count = 0
-    limit = 10
-    while not handler.ping() and count < limit:
-      click.echo("Attempting to detect Kodedrive...") 
-      count += 1
-      time.sleep(1)
+    started = time.time()
+    ticks = [0]
 
-    if count >= limit:
+    # Report once per second while probing with backoff
+    def on_retry(attempt, delay):
+      while ticks[0] < int(time.time() - started):
+        click.echo("Attempting to detect Kodedrive...") 
+        ticks[0] += 1
+
+    policy = retry.RetryPolicy(cap=1.0)
+
+    if not policy.wait_until(handler.probe, 10, on_retry):
       return "Could not restart KodeDrive :("
     else:
       return "KodeDrive has successfully restarted!"
@@ -75,6 +82,15 @@ class SystemFactory:
 
     self.handler.autostart()
 
+def restart_note(handler, message):
+  '''
+    Tell the user when their change did not need a restart
+  '''
+  if handler.skipped_restarts:
+    message += '\nApplied without restarting KodeDrive.'
+
+  return message
+
 def link(**kwargs):
   handler = factory.get_handler()
 
@@ -104,7 +120,8 @@ def link(**kwargs):
         local_path=kwargs['path'],
         remote_path=remote_path,
         interval=kwargs['interval'],
-        remote_port=md['port'] if 'port' in md else None
+        remote_port=md['port'] if 'port' in md else None,
+        remote_fingerprint=md['fingerprint'] if 'fingerprint' in md else None
       )
     # Client - client
     elif 'label' in md and 'folder_id' in md and 'hostname' in md:
@@ -124,7 +141,8 @@ def link(**kwargs):
     else:
       return 'Invalid Key.', True
     
-    return ("%s (%s) is now being synchronized." % (kwargs['path'], tag)), False
+    return restart_note(handler,
+      "%s (%s) is now being synchronized." % (kwargs['path'], tag)), False
   except ValueError as e:
     return e.message, True
   except KeyError as e:
@@ -181,11 +199,7 @@ def refresh(**kwargs):
       raise custom_errors.CannotConnect()
 
     success = handler.scan(path)
-
-    if 'progress' in kwargs:
-      return handler.completion(path, kwargs['device_num']), False
-    else:
-      return (None, False) if success else ('Failed to refresh ' + path, True)
+    return (None, False) if success else ('Failed to refresh ' + path, True)
     
   except Exception as e:
 
@@ -194,6 +208,26 @@ def refresh(**kwargs):
 
     return e.message, True
 
+def push_progress(path):
+  '''
+    Scan path and return an iterator of its synchronization progress,
+    ending after factory.PUSH_TIMEOUT if a device never catches up
+  '''
+  handler = factory.get_handler()
+
+  try:
+    if not handler.wait_start(0.5, 10, verbose=True):
+      raise custom_errors.CannotConnect()
+
+    return handler.push_progress(path, timeout=factory.PUSH_TIMEOUT), False
+
+  except Exception as e:
+
+    if not config.Flags['production']:
+      traceback.print_exc()
+
+    return e.message, True
+
 def free(path):
   handler = factory.get_handler()
   app_rb = None
@@ -208,7 +242,7 @@ def free(path):
     st_rb = rb.SyncthingRollbacker(handler)
 
     handler.free(path)
-    return "%s is no longer being synchronized." % path, False
+    return restart_note(handler, "%s is no longer being synchronized." % path), False
 
   except Exception as e:
 
@@ -239,56 +273,67 @@ def tag(path, name):
 
     return e.message, True
 
-def ls(): 
+# Header, row key and width of the columns ls --long adds
+LS_LONG_COLUMNS = [
+  ('State', 'state', 12),
+  ('Need', 'need_bytes', 14),
+  ('Last Scan', 'last_scan', 19)
+]
+
+def ls_cell(row, key):
+  value = row[key]
+
+  if value is None:
+    return '-'
+
+  if key == 'last_scan':
+    return value[:19].replace('T', ' ')
+
+  return "%s" % value
+
+def ls(long=False, fmt=None): 
+  '''
+    Yield the listing a line at a time: a table, a JSON array
+    (fmt 'json') or one JSON object per line (fmt 'ndjson'); raises
+    CannotConnect before the first line if long needs a daemon that is
+    not running
+  '''
   handler = factory.get_handler()
 
-  metadata = handler.ls()
+  if long and not handler.ping():
+    raise custom_errors.CannotConnect()
 
-  if not metadata:
-    return None, None
+  entries = handler.ls_entries()
+  rows = handler.ls(long, entries)
 
-  headers = []
-  lengths = []
+  if fmt == 'ndjson':
+    for row in rows:
+      yield codec.dumps(row)
 
-  # Preprocess
+  elif fmt == 'json':
+    sep = '['
+    for row in rows:
+      yield sep + codec.dumps(row)
+      sep = ','
 
-  # Iterate through list
-  for i, record in enumerate(metadata):
-    lengths.append(0)
+    yield '[]' if sep == '[' else ']'
 
-    # Iterate through dictionary
-    for header in record:
-      headers.append(header)
-      num_data = len(record[header])
+  elif entries:
+    columns = [
+      ('Tag', 'tag', max(len(e['tag']) for e in entries)),
+      ('Path', 'path', max(len(e['path']) for e in entries))
+    ]
 
-      for data in record[header]:
-        cur = len(data)
-        prev = lengths[i] 
+    if long:
+      columns += LS_LONG_COLUMNS
 
-        lengths[i] = cur if cur > prev else prev
-  
-  # Process
-  body = str()
-  for i in range(0, num_data):
-    for n in range(0, len(metadata)):
-      value = metadata[n][headers[n]][i]
-      s = "{:<%i}" % (lengths[n] + 5)
-      body += s.format(value.strip())
-
-    body += "\n"
-  
-  if len(body) == 0:
-    return None, None
+    # Widths are known before the first row, so rows are written as they come
+    line = "".join("{:<%i}" % (max(width, len(title)) + 5) for title, key, width in columns)
 
-  heading = str()
-  # Iterate through list
-  for i, record in enumerate(metadata):
-    # Iterate through dictionary
-    for header in record:
-      s = "{:<%i}" % (lengths[i] + 5)
-      heading += s.format(header)
+    yield line.format(*[title for title, key, width in columns]).rstrip()
 
-  return heading, body
+    for row in rows:
+      yield line.format(*[ls_cell(row, key) for title, key, width in columns]).rstrip()
 
 def key(**kwargs):
     
@@ -334,10 +379,11 @@ def add(**kwargs):
   try:
     if not handler.wait_start(0.5, 10, verbose=True):
       raise custom_errors.CannotConnect()
-    
+
+    # A new folder is applied live, dir add never restarts the daemon
     kwargs['wait'] = True
     handler.add(**kwargs)
-    return ("You can now share %s" % kwargs['path']), False
+    return restart_note(handler, "You can now share %s" % kwargs['path']), False
   except Exception as e:
 
     if not config.Flags['production']:
@@ -345,19 +391,22 @@ def add(**kwargs):
 
     return e.message, True
 
-def mv(source, target):
+def mv(source, target, workers=None, progress=None, keep_id=True):
   handler = factory.get_handler()
 
   try:
     if not handler.wait_start(0.5, 10, verbose=True):
       raise custom_errors.CannotConnect()
 
-    if os.path.isdir(target) or os.path.islink(target):
-      return handler.move(source, target), False
+    # An interrupted rename between filesystems leaves target behind
+    resume = len(source) == 1 and copy_engine.interrupted(source[0], target)
+
+    if (os.path.isdir(target) or os.path.islink(target)) and not resume:
+      return handler.move(source, target, workers, progress, keep_id), False
       # if target is an existing directory or symbolic link then move()
 
     else:
-      return handler.rename(source, target), False
+      return handler.rename(source, target, workers, progress, keep_id), False
 
   except Exception as e:
     if not config.Flags['production']:
@@ -386,7 +435,7 @@ def auth(option, key, path):
       handler.auth(key, path)
       hostname = handler.decode_device_key(key)['hostname']
 
-      return "%s can now access %s." % (hostname, path), False
+      return restart_note(handler, "%s can now access %s." % (hostname, path)), False
     elif option == 'remove':
       handler.deauth(key, path)
       hostname = handler.decode_device_key(key)['hostname']
@@ -79,3 +79,21 @@ class StartOnLoginFailure(KodeDriveError):
       "KodeDrive autostart configuration has failed."
     )
 
+
+class RestartFailed(KodeDriveError):
+  def __init__(self, reason):
+    super(KodeDriveError, self).__init__(
+      "KodeDrive could not restart Syncthing: %s" % reason
+    )
+
+class GuiCertMissing(KodeDriveError):
+  def __init__(self):
+    super(KodeDriveError, self).__init__(
+      "KodeDrive serves its API over TLS but has no certificate yet. Start KodeDrive in server mode and try again."
+    )
+
+class UnpinnedKey(KodeDriveError):
+  def __init__(self):
+    super(KodeDriveError, self).__init__(
+      "This key does not pin the server's certificate. Ask for a new key from the server."
+    )
@@ -1,5 +1,9 @@
 import click 
 from .py_syncthing_adapter import Syncthing 
+from .py_syncthing_adapter import instrument
+from .py_syncthing_adapter import codec
+from .py_syncthing_adapter import unix_socket
+from .py_syncthing_adapter import pinning
 
 from .data import custom_errors 
 from .data import mac_plist_adt
@@ -10,12 +14,19 @@ from xml.etree.ElementTree import Element
 
 import os, subprocess, socket
 import json, hashlib, plistlib
-import urllib, copy, errno, time
+import urllib, copy, errno
+
+# config.json above this many bytes is streamed to disk
+STREAM_THRESHOLD = 16 * 1024 * 1024
+
+def file_signature(st):
+  return (st.st_size, st.st_mtime, st.st_ino)
 
 class PlatformBase(object):
 
   app_config = 'config.json'
   st_config = 'config.xml'
+  st_gui_cert = 'https-cert.pem'
   st_binary = 'syncthing'
   st_inotify_binary = 'syncthing-inotify'
   stfolder = '.stfolder'
@@ -28,7 +39,11 @@ class PlatformBase(object):
     'directories' : {},
     'system' : {
       'server' : False,
-      'sync-speed' : 0
+      'sync-speed' : 0,
+
+      # Seconds without restart requests before the daemon is restarted,
+      # 0 restarts at once (see utils/restart_coalescer.py)
+      'restart-delay' : 0
     }
   }
   
@@ -60,33 +75,108 @@ class PlatformBase(object):
 	
         return folder
 
+  def platform_get_folder_map(self, config_path):
+    '''
+      Normalized path -> folder attributes and 'devices', for every
+      folder, from one parse of config.xml
+    '''
+    tree = ET.parse(config_path)
+    folders = {}
+
+    for f in tree.findall('folder'):
+      folder = dict(f.attrib)
+      folder['devices'] = [d.attrib for d in f.findall('device')]
+      folders[folder['path'].rstrip('/')] = folder
+
+    return folders
+
   def platform_set_folder(self, config_path, folder):
+    return self.platform_set_folders(config_path, [folder])
+
+  def platform_set_folders(self, config_path, folders):
+    '''
+      Set the devices of each of folders with one parse and at most
+      one write of config.xml; returns whether anything changed
+    '''
     tree = ET.parse(config_path)
+    by_path = dict((folder['path'], folder) for folder in folders)
+    changed = False
+
     for f in tree.findall('folder'):
-      
-      path = f.attrib['path']
-      if path == folder['path']:
+      folder = by_path.get(f.attrib['path'])
 
-      	for d in f.findall('device'):
-      		f.remove(d)
+      if folder is None:
+        continue
 
-      	for d in folder['devices']:
-      		device = Element('device')
-      		device.text=' '
-      		device.set('id', d['id'])
-      		f.insert(0, device)
+      # Devices are inserted at the front, so they end up reversed
+      current = [d.get('id') for d in reversed(f.findall('device'))]
+      if current == [d['id'] for d in folder['devices']]:
+        continue
 
-    tree.write(config_path)
+      changed = True
+
+      for d in f.findall('device'):
+        f.remove(d)
+
+      for d in folder['devices']:
+        device = Element('device')
+        device.text=' '
+        device.set('id', d['id'])
+        f.insert(0, device)
+
+    if changed:
+      tree.write(config_path)
+
+    return changed
 
   def get_gui_address(self, config_path):   
     tree = ET.parse(config_path)
     return tree.find('gui').find('address').text
 
   def set_gui_address(self, config_path, address):
+    '''
+      Returns whether the address changed
+    '''
     tree = ET.parse(config_path)
-    tree.find('gui').find('address').text = str(address)
+    node = tree.find('gui').find('address')
+
+    if node.text == str(address):
+      return False
+
+    node.text = str(address)
     tree.write(config_path)
+    return True
   
+  def get_gui_tls(self, config_path):
+    tree = ET.parse(config_path)
+    return tree.find('gui').get('tls', 'false').lower() == 'true'
+
+  def set_gui_tls(self, config_path, enabled):
+    '''
+      Returns whether the setting changed
+    '''
+    tree = ET.parse(config_path)
+    gui = tree.find('gui')
+
+    if (gui.get('tls', 'false').lower() == 'true') == enabled:
+      return False
+
+    gui.set('tls', 'true' if enabled else 'false')
+    tree.write(config_path)
+    return True
+
+  def get_gui_fingerprint(self, config_path):
+    '''
+      SHA-256 fingerprint of the GUI certificate Syncthing keeps next to
+      config.xml, or None before it has been generated
+    '''
+    cert_path = os.path.join(os.path.dirname(config_path), self.st_gui_cert)
+
+    if not os.path.exists(cert_path):
+      return None
+
+    return pinning.file_fingerprint(cert_path)
+
   def get_listen_address(self, config_path):
     tree = ET.parse(config_path)
     addresses = tree.find('options').findall('listenAddress')
@@ -104,11 +194,22 @@ class PlatformBase(object):
     options = tree.find('options')
 
     # Set syncthing options
-    options.find('relayReconnectIntervalM').text = '1'
-    options.find('reconnectionIntervalS').text = '30' if kwargs['server'] else '5'
-    options.find('overwriteRemoteDeviceNamesOnConnect').text = 'false' if kwargs['server'] else 'true'
-    options.find('localAnnounceEnabled').text = 'true' if kwargs['lcast'] else 'false'
-    tree.write(st_conf)
+    values = {
+      'relayReconnectIntervalM' : '1',
+      'reconnectionIntervalS' : '30' if kwargs['server'] else '5',
+      'overwriteRemoteDeviceNamesOnConnect' : 'false' if kwargs['server'] else 'true',
+      'localAnnounceEnabled' : 'true' if kwargs['lcast'] else 'false'
+    }
+    changed = False
+
+    for key in values:
+      node = options.find(key)
+      if node.text != values[key]:
+        node.text = values[key]
+        changed = True
+
+    if changed:
+      tree.write(st_conf)
     
     # Save device id to kodrive config
     if 'is_new' in kwargs:
@@ -117,6 +218,8 @@ class PlatformBase(object):
       kodrive_config['system']['devid'] = devid
       self.set_platform_config(app_conf, kodrive_config)
 
+    return changed
+
   def start_platform_syncthing(self, folder_path, **kwargs):
     st_conf_dir = kwargs['st_conf_dir']
     st_conf_file = kwargs['st_conf_file']
@@ -134,28 +237,7 @@ class PlatformBase(object):
     if not os.path.exists(st_conf_file):
       new_flag = True
     else:
-      gui_address = self.get_gui_address(st_conf_file)
-      toks = gui_address.split(':')
-      host = toks[0]
-      port = int(toks[1])
-        
-      # Check if port is available, if it isn't try another port
-      p = self.get_available_port(host, port) 
-      
-      if p != port:
-        gui_address = host + ':' + str(p)
-        self.set_gui_address(st_conf_file, gui_address)
-      
-      # Check listen address port is available  
-      listen_address = self.get_listen_address(st_conf_file)
-      toks = listen_address.split(':')
-      
-      port = int(toks[2]) if len(toks) == 3 else None
-      p = self.get_available_port(host, port)
-
-      if p != port:
-        listen_address = ':'.join(['tcp://' + host, str(p)])
-        self.set_listen_address(st_conf_file, listen_address)
+      self.check_ports(st_conf_file)
         
     #opts.append('-gui-address')
     #opts.append(gui_address)
@@ -179,6 +261,43 @@ class PlatformBase(object):
 
     return new_flag
 
+  def check_ports(self, st_conf_file):
+    '''
+      Move the GUI and listen addresses off ports already in use. A GUI
+      on a unix socket needs no port, only a stale socket file removed.
+    '''
+    gui_address = self.get_gui_address(st_conf_file)
+    socket_path = unix_socket.parse_address(gui_address)
+
+    if socket_path:
+      host = '0.0.0.0'
+
+      # Left behind by a daemon that did not shut down cleanly
+      if os.path.exists(socket_path) and not unix_socket.reachable(socket_path):
+        os.remove(socket_path)
+    else:
+      toks = gui_address.split(':')
+      host = toks[0]
+      port = int(toks[1])
+        
+      # Check if port is available, if it isn't try another port
+      p = self.get_available_port(host, port) 
+      
+      if p != port:
+        gui_address = host + ':' + str(p)
+        self.set_gui_address(st_conf_file, gui_address)
+      
+    # Check listen address port is available  
+    listen_address = self.get_listen_address(st_conf_file)
+    toks = listen_address.split(':')
+    
+    port = int(toks[2]) if len(toks) == 3 else None
+    p = self.get_available_port(host, port)
+
+    if p != port:
+      listen_address = ':'.join(['tcp://' + host, str(p)])
+      self.set_listen_address(st_conf_file, listen_address)
+
   def set_platform_dir_config(self, folder_path, object):
 
     config_path = os.path.join(folder_path, self.app_config) 
@@ -197,17 +316,52 @@ class PlatformBase(object):
     else:
       self.append_dir_metadata(config_path, object)
 
+  @property
+  def on_disk(self):
+    '''
+      config_path -> (file signature, text) as last read or written
+    '''
+    return self.__dict__.setdefault('_on_disk', {})
+
   def get_platform_config(self, config_path):
     try:
       with open(config_path, "r") as f:
+        signature = file_signature(os.fstat(f.fileno()))
         raw = f.read()
-        return json.loads(raw)
+        config = codec.loads(raw)
     except Exception as e:
       return None
 
+    self.on_disk[config_path] = (signature, raw)
+    return config
+
   def set_platform_config(self, config_path, raw):
-    with open(config_path, "w") as f:
-      f.write(json.dumps(raw))
+    try:
+      signature = file_signature(os.stat(config_path))
+    except OSError:
+      signature = None
+
+    # Huge configs are encoded straight into the file, never held as one
+    # string; the one-shot encoder is several times faster below that
+    if signature and signature[0] > STREAM_THRESHOLD:
+      with open(config_path, "w") as f:
+        codec.dump(raw, f, stream=True)
+
+      self.on_disk.pop(config_path, None)
+      return True
+
+    text = codec.dumps(raw)
+
+    # Most commits leave config.json as it was, skip those writes; what
+    # it holds is known from the last read or write, unless it changed
+    if signature and self.on_disk.get(config_path) == (signature, text):
+      return False
+
+    with open(config_path, "wb") as f:
+      f.write(text if isinstance(text, bytes) else text.encode('utf-8'))
+
+    self.on_disk[config_path] = (file_signature(os.stat(config_path)), text)
+    return True
 
   def get_platform_dir_config(self, config_path, local_path):
     config = self.get_platform_config(config_path)
@@ -227,11 +381,30 @@ class PlatformBase(object):
     tree = ET.parse(config_path)
     api_key = tree.find('gui').find('apikey').text
     address = tree.find('gui').find('address').text
+
+    # Share the connection pool so that re-hooking (e.g. after a mode
+    # change) keeps talking over the same keep-alive connections
+    socket_path = unix_socket.parse_address(address)
+    if socket_path:
+      return Syncthing(api_key=api_key, socket_path=socket_path, share_pool=True)
+
     toks = address.split(':')
     host = toks[0]
     port = toks[1]
 
-    return Syncthing(api_key=api_key, port=int(port), host=host)
+    # Served over TLS in server mode, pinned to our own certificate;
+    # never downgraded to plain HTTP if there is nothing to pin
+    fingerprint = None
+    if self.get_gui_tls(config_path):
+      fingerprint = self.get_gui_fingerprint(config_path)
+
+      if not fingerprint:
+        raise custom_errors.GuiCertMissing()
+
+    return Syncthing(
+      api_key=api_key, port=int(port), host=host, share_pool=True,
+      is_https=bool(fingerprint), fingerprint=fingerprint
+    )
 
   def get_platform_device_id(self, config_path):
     kodrive_config = self.get_platform_config(config_path)
@@ -249,9 +422,8 @@ class PlatformBase(object):
     for key in kwargs:
       config[key] = kwargs[key]
 
-    fp = open(config_path, 'w')
-    fp.write(json.dumps(config))
-    fp.close
+    with open(config_path, 'w') as fp:
+      codec.dump(config, fp)
 
     # What happens if write fails?
 
@@ -267,6 +439,7 @@ class PlatformBase(object):
       'remote_path' : object['remote_path'] if 'remote_path' in object else '',
       'host' : object['host'] if 'host' in object else '',
       'port' : object['port'] if 'port' in object else '',
+      'fingerprint' : object['fingerprint'] if 'fingerprint' in object else None,
       
       # Tag provided by user to identify the dir
       'label' : object['label'],
@@ -302,6 +475,10 @@ class PlatformBase(object):
             raise IOError("Corrupted config.json file in %s" % folder_path)
 
         name = self.get_dir_id(object['local_path'])
+
+        if config['directories'].get(name) == metadata:
+          return
+
         config['directories'][name] = metadata
 
         f.write(json.dumps(config))
@@ -346,28 +523,28 @@ class PlatformBase(object):
   
   # Creates a .kodrive folder 
   def broadcast_folder_info(self, folder_path, **kwargs):
-  	dir_path = os.path.join(folder_path, '.kodrive')
+    dir_path = os.path.join(folder_path, '.kodrive')
+
+    if not os.path.exists(dir_path):
+      os.makedirs(dir_path)
+
+    conf_path = os.path.join(dir_path, 'config.json')
+    config = {}
+
+    if os.path.exists(conf_path):
+      try:
+        with open(conf_path, 'r') as f:
+          config = json.loads(f.read())
+      except ValueError:
+        pass
+
+    if 'devices' in kwargs:
+      config['devices'] = kwargs['devices']
+
+    # Rewritten whole, earlier contents must not survive past the end
+    with open(conf_path, 'w') as f:
+      f.write(json.dumps(config))
 
-  	if not os.path.exists(dir_path):
-  		os.makedirs(dir_path)
-  		
-  	conf_path = os.path.join(dir_path, 'config.json')
-  	
-  	if os.path.exists(conf_path):
-			fp = open(conf_path, 'r+')
-			config = json.loads(fp.read())
-			config['devices'] = kwargs['devices']
-
-			fp.write(json.dumps(config))
-  	else:
-			config = {}
-			if 'devices' in kwargs: 
-				config['devices'] = kwargs['devices']
-			
-			# Create config.json
-			with open(conf_path, 'w') as f:
-				f.write(json.dumps(config))
-	
 	# Utility to find an available port
   def get_available_port(self, host='0.0.0.0', port=1025):
     base_port = 1025
@@ -387,7 +564,7 @@ class PlatformBase(object):
       iterations += 1
     
     # Wait a bit to see if port is still available 
-    time.sleep(0.25)
+    instrument.sleep(0.25, 'port_probe')
     if(sock.connect_ex((host, port)) == 0):
       return self.get_available_port(host, port)
 
@@ -461,6 +638,12 @@ class SyncthingLinux64(PlatformBase):
   def set_folder(self, folder):
   	return self.platform_set_folder(self.st_conf_file, folder)
 
+  def get_folder_map(self):
+    return self.platform_get_folder_map(self.st_conf_file)
+
+  def set_folders(self, folders):
+    return self.platform_set_folders(self.st_conf_file, folders)
+
   def get_dir_config(self, local_path):
     '''
       Return dir object specified by local path from config.json
@@ -634,6 +817,12 @@ class SyncthingMac64(PlatformBase):
   def set_config(self, config):
     return self.set_platform_config(self.app_conf_file, config)
 
+  def get_folder_map(self):
+    return self.platform_get_folder_map(self.st_conf_file)
+
+  def set_folders(self, folders):
+    return self.platform_set_folders(self.st_conf_file, folders)
+
   def get_dir_config(self, local_path):
     '''
       Return dir object specified by local path from config.json
@@ -692,25 +881,7 @@ class SyncthingMac64(PlatformBase):
     if not os.path.exists(self.st_conf_file):
       new_flag = True
     else:  
-      gui_address = self.get_gui_address(self.st_conf_file)
-      toks = gui_address.split(':')
-      host = toks[0]
-      port = int(toks[1])
-      
-      p = self.get_available_port(host, port)
-      
-      if p != port:
-        gui_address = host + ':' + str(p)
-        self.set_gui_address(self.st_conf_file, gui_address)
-        
-      # Check listen address port is available  
-      listen_address = self.get_listen_address(st_conf_file)
-      toks = listen_address.split(':')
-      port = int(toks[2]) if len(toks) == 3 else None
-      p = self.get_available_port(host, port)
-      if p != port:
-        listen_address = ':'.join(['tcp://' + host, str(p)])
-        self.set_listen_address(st_conf_file, listen_address)
+      self.check_ports(self.st_conf_file)
       
     #opts.append('-gui-address')
     #opts.append(gui_address)
@@ -35,17 +35,32 @@ version = vstr(VERSION)
 syncthing_version = vstr(SYNCTHING_VERSION)
 docstr = 'python-syncthing v%s targetting v%s' % (version, syncthing_version)
 
+import os
+import re
 import sys
-import json
 import time
+import socket
 import logging
 import warnings
+import threading
 from collections import namedtuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from requests.packages.urllib3 import exceptions
 from requests.exceptions import ConnectionError, ConnectTimeout
 
+from .async_client import AsyncSyncthing  # noqa: F401
+from .batch import run_batch, BatchResult  # noqa: F401
+from .cache import ResponseCache
+from .paging import iter_need, iter_browse, DEFAULT_PER_PAGE
+from .retry import RetryPolicy, CircuitBreaker, CircuitOpen  # noqa: F401
+from .events import EventStream
+from . import instrument
+from . import codec
+from . import unix_socket
+from . import pinning
+
 try:
     py_2 = sys.version_info.major == 2
 except AttributeError:
@@ -53,20 +68,88 @@ except AttributeError:
 
 if py_2:
     import urlparse as uparse
+    from urllib import quote
 else:
     import urllib.parse as uparse
+    from urllib.parse import quote
 
 logger = logging.getLogger(__name__)
 
 MIN_TIMEOUT_SECONDS = 1.0
 REST_ENDPOINT = '/rest'
 
+# Per-endpoint request timeouts in seconds, overriding options['timeout'].
+# Liveness checks should answer fast; config and index dumps can be huge.
+DEFAULT_TIMEOUTS = {
+    REST_ENDPOINT + '/system/ping': 1.0,
+    REST_ENDPOINT + '/system/status': 2.0,
+    REST_ENDPOINT + '/system/config': 15.0,
+    REST_ENDPOINT + '/db/need': 30.0,
+    REST_ENDPOINT + '/db/browse': 30.0,
+}
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 8
+
+# sessions shared between interfaces talking to the same daemon,
+# keyed by (protocol, host, port)
+_shared_sessions = {}
+_shared_lock = threading.Lock()
+
+
+def make_session(pool_connections=DEFAULT_POOL_CONNECTIONS,
+                 pool_maxsize=DEFAULT_POOL_MAXSIZE, socket_path=None,
+                 fingerprint=None):
+    """
+    Return a keep-alive session backed by a bounded connection pool;
+    with ``socket_path`` every request goes through that unix socket,
+    with ``fingerprint`` HTTPS peers must present that certificate.
+    """
+    session = requests.Session()
+    if socket_path:
+        adapter = unix_socket.UnixAdapter(socket_path, pool_maxsize=pool_maxsize)
+    elif fingerprint:
+        adapter = pinning.FingerprintAdapter(fingerprint,
+                                             pool_connections=pool_connections,
+                                             pool_maxsize=pool_maxsize)
+    else:
+        adapter = HTTPAdapter(pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def shared_session(key, pool_connections=DEFAULT_POOL_CONNECTIONS,
+                   pool_maxsize=DEFAULT_POOL_MAXSIZE, socket_path=None,
+                   fingerprint=None):
+    """ Return the session shared by every interface using ``key``. """
+    with _shared_lock:
+        session = _shared_sessions.get(key)
+        if session is None:
+            session = make_session(pool_connections, pool_maxsize, socket_path,
+                                   fingerprint)
+            _shared_sessions[key] = session
+        return session
+
+
+def close_shared_sessions():
+    with _shared_lock:
+        for session in _shared_sessions.values():
+            session.close()
+        _shared_sessions.clear()
+
+def _fail_fast(error):
+    return isinstance(error, CircuitOpen)
+
 class C(object):
     ommand = namedtuple('Command', 'verb endpoint')
 
     def __init__(self, iface, verb, endpoint):
         self.command = C.ommand(verb, REST_ENDPOINT + endpoint)
         self.iface = iface
+        # names of {placeholders} in the endpoint, filled from params
+        self.fields = re.findall(r'{(\w+)}', endpoint)
 
     def __call__(self, data_obj=None, **params):
         if data_obj is not None:
@@ -78,7 +161,14 @@ class C(object):
         if not self.iface:
             return None
 
-        return self.iface.do_req(self.command.verb, self.command.endpoint, \
+        endpoint = self.command.endpoint
+        for field in self.fields:
+            if field not in params:
+                raise ValueError('%s requires %s' % (self, field))
+            endpoint = endpoint.replace('{%s}' % field,
+                                        quote(str(params.pop(field)), safe=''))
+
+        return self.iface.do_req(self.command.verb, endpoint, \
                                 data_obj, **params)
 
     def __str__(self):
@@ -147,6 +237,26 @@ class Commands(object):
                 scan =    ('POST', '/db/scan')
             )
         )
+        # per-object config, Syncthing 1.12 and later
+        self.config = GetDict(interface,
+            folders =   ('GET', '/config/folders'),
+            folder =    ('GET', '/config/folders/{id}'),
+            devices =   ('GET', '/config/devices'),
+            device =    ('GET', '/config/devices/{id}'),
+            restart_required = ('GET', '/config/restart-required'),
+            set = GetDict(interface,
+                folder =    ('PUT', '/config/folders/{id}'),
+                device =    ('PUT', '/config/devices/{id}'),
+            ),
+            patch = GetDict(interface,
+                folder =    ('PATCH', '/config/folders/{id}'),
+                device =    ('PATCH', '/config/devices/{id}'),
+            ),
+            delete = GetDict(interface,
+                folder =    ('DELETE', '/config/folders/{id}'),
+                device =    ('DELETE', '/config/devices/{id}'),
+            )
+        )
         self.stats = GetDict(interface,
             device =    ('GET', '/stats/device'),
             folder =    ('GET', '/stats/folder')
@@ -176,18 +286,34 @@ class Interface(object):
             'port': 8080,
             'timeout': 3.5,
             'is_https': False,
-            'ssl_cert_file': None
+            'ssl_cert_file': None,
+            'socket_path': None,
+            'fingerprint': None,
+            'pool_connections': DEFAULT_POOL_CONNECTIONS,
+            'pool_maxsize': DEFAULT_POOL_MAXSIZE,
+            'share_pool': False,
+            'session': None,
+            'cache': True,
+            'cache_ttls': None,
+            'timeouts': None,
+            'retry': None,
+            'breaker': True,
+            'breaker_threshold': 5,
+            'breaker_reset': 1.0
         }
 
         self.options.update(options)
         self.options = GetDict(self, **self.options)
 
-        if self.options.is_https and self.options.ssl_cert_file is None:
+        if self.options.is_https and self.options.ssl_cert_file is None \
+                and not self.options.fingerprint:
             warnings.warn('using https without specified ssl_cert_file')
 
         self.verify = True if self.options.ssl_cert_file else False
         self.protocol = 'https' if self.options.is_https else 'http'
         self.timeout = max(MIN_TIMEOUT_SECONDS, self.options.timeout)
+        self.timeouts = dict(DEFAULT_TIMEOUTS)
+        self.timeouts.update(self.options.timeouts or {})
         self.req_headers = {
             'X-API-Key': api_key
         }
@@ -196,25 +322,170 @@ class Interface(object):
         self.last_req = None
         self.last_req_time = 0
 
+        self.session = self.options.session or self._make_session()
+        self.cache = ResponseCache(self.options.cache_ttls) if self.options.cache else None
+
+        # retry policy for idempotent GETs, off unless asked for
+        self.retry = self.options.retry
+        self.breaker = None
+        if self.options.breaker:
+            self.breaker = CircuitBreaker(self.options.breaker_threshold,
+                                          self.options.breaker_reset)
+
+    def _make_session(self):
+        socket_path = self.options.socket_path
+        fingerprint = self.options.fingerprint if self.options.is_https else None
+
+        if self.options.share_pool:
+            if socket_path:
+                key = ('unix', socket_path)
+            else:
+                key = (self.protocol, self.options.host, int(self.options.port),
+                       fingerprint)
+            return shared_session(key, self.options.pool_connections,
+                                  self.options.pool_maxsize, socket_path,
+                                  fingerprint)
+
+        return make_session(self.options.pool_connections,
+                            self.options.pool_maxsize, socket_path, fingerprint)
+
+    def close(self):
+        # shared sessions outlive the interface, see close_shared_sessions
+        if not self.options.share_pool and not self.options.session:
+            self.session.close()
+
     def host(self):
+        if self.options.socket_path:
+            # the adapter ignores the host, the socket decides where it goes
+            return 'http://' + unix_socket.SOCKET_HOST
+
         return '%s://%s:%d' % (
-            self.protocol, self.options.host, self.options.port)
+            self.protocol, self.options.host, int(self.options.port))
+
+    def reachable(self, timeout=0.25):
+        """ Whether the daemon's socket accepts connections; no HTTP is spoken. """
+        if self.options.socket_path:
+            return unix_socket.reachable(self.options.socket_path, timeout)
+
+        try:
+            socket.create_connection(
+                (self.options.host, int(self.options.port)), timeout).close()
+            return True
+        except socket.error:
+            return False
 
     def connected(self):
-        if not self.last_req or self.last_req_time < (time.time() - 60):
-            self.__req('GET', '/')
-        return self.last_req
+        if self.breaker is not None and self.breaker.is_open:
+            return False
+
+        if self.last_req is None or self.last_req_time < (time.time() - 60):
+            self.probe()
+        return bool(self.last_req)
+
+    def timeout_for(self, endpoint):
+        return self.timeouts.get(endpoint, self.timeout)
+
+    def probe(self, endpoint=REST_ENDPOINT + '/system/ping'):
+        """
+        Liveness check that bypasses an open circuit breaker (its outcome
+        still closes or re-opens it). Returns True if the daemon answered.
+        """
+        # no socket file yet, the daemon has not bound it
+        if self.options.socket_path and not os.path.exists(self.options.socket_path):
+            return False
+
+        url = uparse.urljoin(self.host(), endpoint)
+        try:
+            resp = self.__req('GET', url, None, None,
+                              timeout=self.timeout_for(endpoint), probe=True)
+        except requests.RequestException:
+            return False
+        return isinstance(resp, dict)
 
     def do_req(self, verb, endpoint, data=None, **params):
         url = uparse.urljoin(self.host(), endpoint)
-        return self.__req(verb, url, data, params)
+        timeout = self.timeout_for(endpoint)
+        req = lambda: self.__req(verb, url, data, params, timeout=timeout)
+
+        if self.retry is not None and verb.upper() == 'GET':
+            # retries so far, reported with each attempt
+            attempts = [0]
+
+            def on_retry(attempt, delay):
+                attempts[0] = attempt
+
+            fetch = lambda: self.__req(verb, url, data, params, timeout=timeout,
+                                       retries=attempts[0])
+            req = lambda: self.retry.call(fetch, on_retry=on_retry, giveup=_fail_fast)
+
+        if self.cache is None:
+            return req()
+
+        if verb.upper() == 'GET':
+            return self.cache.get(endpoint, params, req)
+
+        # Any write may change what the GET endpoints return; drop the
+        # cache on both sides so reads racing the write are not kept
+        self.cache.invalidate()
+        try:
+            return req()
+        finally:
+            self.cache.invalidate()
+
+    def invalidate(self):
+        if self.cache is not None:
+            self.cache.invalidate()
+
+    def long_poll(self, endpoint, read_timeout, **params):
+        """ GET ``endpoint`` allowing it to block for up to ``read_timeout`` seconds. """
+        url = uparse.urljoin(self.host(), endpoint)
+        return self.__req('GET', url, None, params, timeout=read_timeout)
+
+    def _send(self, verb, url, body, params, timeout, retries=0):
+        """ Issue the HTTP request, reporting it to instrument hooks if any. """
+        send = lambda: self.session.request(
+            verb,
+            url,
+            data=body,
+            params=params,
+            timeout=timeout,
+            verify=self.verify,
+            cert=self.options.ssl_cert_file,
+            headers=self.req_headers
+        )
 
-    def __req(self, verb, url, data=None, params=None):
+        if not instrument.hooks:
+            return send()
+
+        endpoint = uparse.urlparse(url).path
+        started = time.time()
+        try:
+            resp = send()
+            # read the body now so transfer time is part of elapsed
+            size = len(resp.content)
+        except Exception as e:
+            instrument.emit(instrument.CallRecord(
+                verb, endpoint, None, time.time() - started,
+                len(body), 0, retries, type(e).__name__))
+            raise
+
+        instrument.emit(instrument.CallRecord(
+            verb, endpoint, resp.status_code, time.time() - started,
+            len(body), size, retries, None))
+        return resp
+
+    def __req(self, verb, url, data=None, params=None, timeout=None, probe=False,
+              retries=0):
         verb = verb.upper()
 
-        if verb not in ['GET', 'POST', 'PUT', 'DELETE']:
+        if verb not in ['GET', 'POST', 'PUT', 'PATCH', 'DELETE']:
             raise UserWarning('unsupported http verb in rest request')
 
+        breaker = self.breaker
+        if breaker is not None and not probe and not breaker.allow():
+            raise CircuitOpen('%s refused %d connections in a row' % (
+                self.host(), breaker.failures))
+
         if data is None:
             data = {}
 
@@ -223,19 +494,15 @@ class Interface(object):
                 if not self.options.ssl_cert_file:
                     warnings.simplefilter('ignore', exceptions.InsecureRequestWarning)
             
-            resp = requests.request(
-                verb,
-                url,
-                data=json.dumps(data),
-                params=params,
-                timeout=self.timeout,
-                verify=self.verify,
-                cert=self.options.ssl_cert_file,
-                headers=self.req_headers
-            )
+            resp = self._send(verb, url, codec.dumps(data), params,
+                              timeout or self.timeout, retries)
 
         except ConnectionError as e:
             #logger.error('could not connect to ' + self.host())
+            self.last_req = False
+            self.last_req_time = time.time()
+            if breaker is not None:
+                breaker.record_failure()
             raise e
 
         except ConnectTimeout as e:
@@ -244,10 +511,14 @@ class Interface(object):
 
         except requests.RequestException as e:
             self.last_req = None
+            if breaker is not None:
+                breaker.record_error()
             raise e
         else:
             self.last_req = resp.status_code == requests.codes.ok
-            self.last_req = time.time()
+            self.last_req_time = time.time()
+            if breaker is not None:
+                breaker.record_success()
             
             if resp.status_code != requests.codes.ok:
                 #logger.error('%s %s (%s): %s' % (
@@ -256,12 +527,12 @@ class Interface(object):
 
             if 'json' in resp.headers.get('Content-Type', 'text/plain').lower():
 
-                return resp.json()
+                return codec.loads(resp.content)
             else:
                 if len(resp.content):
                     c = resp.content.decode("utf-8")
                     if c.startswith('{') and c.endswith('}'):
-                        return json.loads(c)
+                        return codec.loads(c)
                     return c
                 else:
                     return True
@@ -281,7 +552,50 @@ class Syncthing(object):
             self._interface = Interface(api_key, **kwargs)
             self._commands = Commands(self._interface)
 
+    def close(self):
+        if self._interface is not None:
+            self._interface.close()
+
+    def batch(self, calls, max_workers=None):
+        """
+        Issue independent calls concurrently, see run_batch. The worker
+        count defaults to the connection pool size so no call has to
+        open a connection outside the pool.
+        """
+        if self._interface is None:
+            raise AttributeError('must call Syncthing.init before performing operations')
+        if max_workers is None:
+            max_workers = self._interface.options.pool_maxsize
+        return run_batch(calls, max_workers)
+
+    def iter_need(self, folder, perpage=DEFAULT_PER_PAGE):
+        """ Stream the files ``folder`` needs page by page, see paging.iter_need. """
+        return iter_need(self.db.need, folder, perpage)
+
+    def iter_browse(self, folder, prefix=None):
+        """ Walk the folder index one level per request, see paging.iter_browse. """
+        return iter_browse(self.db.browse, folder, prefix)
+
+    def reachable(self):
+        """ Whether the daemon accepts connections, without an HTTP round trip. """
+        if self._interface is None:
+            raise AttributeError('must call Syncthing.init before performing operations')
+        return self._interface.reachable()
+
+    def probe(self):
+        """ Cheap liveness check that is not short-circuited by the breaker. """
+        if self._interface is None:
+            raise AttributeError('must call Syncthing.init before performing operations')
+        return self._interface.probe()
+
+    def events(self, types=None, since=None, **kwargs):
+        """ Return an EventStream subscribed to /rest/events. """
+        if self._interface is None:
+            raise AttributeError('must call Syncthing.init before performing operations')
+        return EventStream(self._interface, types=types, since=since, **kwargs)
+
     def __getattr__(self, item):
         if self._interface is None:
             raise AttributeError('must call Syncthing.init before performing operations')
         return self._commands.__dict__.get(item)
+
@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+Non-blocking Syncthing client.
+
+AsyncSyncthing mirrors the command surface of Syncthing/Commands, but
+every command returns a Future immediately; the HTTP request runs on a
+bounded executor shared by every client in the process. Polling loops
+are driven by a single timer thread rather than sleeping workers, so one
+process can supervise many daemons at once.
+
+The futures are concurrent.futures.Future objects whenever that module
+is available (Python 3, or the ``futures`` backport on Python 2), so
+asyncio code can await them through ``to_asyncio``.
+"""
+
+import time
+import heapq
+import itertools
+import threading
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+try:
+    from concurrent.futures import Future, ThreadPoolExecutor
+except ImportError:
+    Future = ThreadPoolExecutor = None
+
+DEFAULT_MAX_WORKERS = 32
+
+
+if Future is None:
+    class Future(object):
+        """ Subset of concurrent.futures.Future used by this module. """
+
+        def __init__(self):
+            self._done = threading.Event()
+            self._lock = threading.Lock()
+            self._result = None
+            self._exception = None
+            self._callbacks = []
+
+        def done(self):
+            return self._done.is_set()
+
+        def result(self, timeout=None):
+            if not self._done.wait(timeout):
+                raise RuntimeError('future did not complete in %s seconds' % timeout)
+            if self._exception is not None:
+                raise self._exception
+            return self._result
+
+        def exception(self, timeout=None):
+            if not self._done.wait(timeout):
+                raise RuntimeError('future did not complete in %s seconds' % timeout)
+            return self._exception
+
+        def add_done_callback(self, fn):
+            with self._lock:
+                if not self._done.is_set():
+                    self._callbacks.append(fn)
+                    return
+            fn(self)
+
+        def set_result(self, result):
+            self._result = result
+            self._finish()
+
+        def set_exception(self, exception):
+            self._exception = exception
+            self._finish()
+
+        def _finish(self):
+            with self._lock:
+                self._done.set()
+                callbacks, self._callbacks = self._callbacks, []
+            for fn in callbacks:
+                fn(self)
+
+
+if ThreadPoolExecutor is None:
+    class ThreadPoolExecutor(object):
+        """ Minimal fixed-size executor for interpreters without concurrent.futures. """
+
+        def __init__(self, max_workers):
+            self._queue = Queue()
+            for n in range(max_workers):
+                t = threading.Thread(target=self._work)
+                t.daemon = True
+                t.start()
+
+        def submit(self, fn, *args, **kwargs):
+            future = Future()
+            self._queue.put((future, fn, args, kwargs))
+            return future
+
+        def _work(self):
+            while True:
+                future, fn, args, kwargs = self._queue.get()
+                try:
+                    future.set_result(fn(*args, **kwargs))
+                except Exception as e:
+                    future.set_exception(e)
+
+
+class Scheduler(object):
+    """ Runs callbacks after a delay from one shared daemon thread. """
+
+    def __init__(self):
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def call_later(self, delay, fn):
+        with self._cond:
+            heapq.heappush(self._heap, (time.time() + delay, next(self._seq), fn))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run)
+                self._thread.daemon = True
+                self._thread.start()
+            self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+
+                when, seq, fn = self._heap[0]
+                delay = when - time.time()
+                if delay > 0:
+                    self._cond.wait(delay)
+                    continue
+
+                heapq.heappop(self._heap)
+
+            try:
+                fn()
+            except Exception:
+                pass
+
+
+_executor = None
+_scheduler = None
+_lock = threading.Lock()
+
+
+def default_executor():
+    global _executor
+    with _lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS)
+        return _executor
+
+
+def default_scheduler():
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler
+
+
+def to_asyncio(future, loop=None):
+    """ Wrap a future returned by this module so asyncio code can await it. """
+    import asyncio
+    return asyncio.wrap_future(future, loop=loop)
+
+
+def chain(future, fn):
+    """ Return a future resolved with ``fn(future.result())``. """
+    out = Future()
+
+    def done(f):
+        try:
+            out.set_result(fn(f.result()))
+        except Exception as e:
+            out.set_exception(e)
+
+    future.add_done_callback(done)
+    return out
+
+
+def poll_until(attempt, check, interval, deadline, scheduler=None):
+    """
+    Call ``attempt()`` (which returns a future) until ``check(result)`` is
+    true or ``deadline`` passes, waiting ``interval`` seconds in between on
+    the scheduler. Resolves to True on success, False on deadline.
+    """
+    scheduler = scheduler or default_scheduler()
+    out = Future()
+
+    def run():
+        try:
+            attempt().add_done_callback(done)
+        except Exception:
+            retry()
+
+    def done(f):
+        try:
+            ok = f.exception() is None and check(f.result())
+        except Exception:
+            ok = False
+
+        if ok:
+            out.set_result(True)
+        else:
+            retry()
+
+    def retry():
+        if time.time() + interval > deadline:
+            out.set_result(False)
+        else:
+            scheduler.call_later(interval, run)
+
+    run()
+    return out
+
+
+class AsyncCommand(object):
+    def __init__(self, command, executor):
+        self.command = command
+        self.executor = executor
+
+    def __call__(self, data_obj=None, **params):
+        return self.executor.submit(self.command, data_obj, **params)
+
+    def __repr__(self):
+        return '<Async%r>' % (self.command,)
+
+
+class AsyncGetDict(dict):
+    def __init__(self, commands, executor):
+        super(AsyncGetDict, self).__init__()
+        for k, v in commands.items():
+            if isinstance(v, dict):
+                v = AsyncGetDict(v, executor)
+            elif callable(v):
+                v = AsyncCommand(v, executor)
+            self[k] = v
+
+    def __getattr__(self, item):
+        return self.get(item)
+
+
+class AsyncSyncthing(object):
+    """ Syncthing client whose commands return futures. """
+
+    def __init__(self, executor=None, scheduler=None, **kwargs):
+        from . import Syncthing
+
+        self.executor = executor or default_executor()
+        self.scheduler = scheduler or default_scheduler()
+        self._sync = Syncthing(**kwargs)
+
+        commands = self._sync._commands
+        if commands is None:
+            raise AttributeError('AsyncSyncthing requires an api_key')
+
+        self._commands = {}
+        for name, group in commands.__dict__.items():
+            self._commands[name] = AsyncGetDict(group, self.executor)
+
+    @property
+    def sync(self):
+        """ The underlying blocking client. """
+        return self._sync
+
+    def submit(self, fn, *args, **kwargs):
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def batch(self, calls, max_workers=None):
+        return self.executor.submit(self._sync.batch, calls, max_workers)
+
+    def close(self):
+        self._sync.close()
+
+    def __getattr__(self, item):
+        commands = self.__dict__.get('_commands')
+        if commands is None or item not in commands:
+            raise AttributeError(item)
+        return commands[item]
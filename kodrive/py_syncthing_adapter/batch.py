@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Fan-out of independent REST calls over a bounded set of worker threads.
+
+Results come back in the order the calls were given; a failing call
+does not abort the batch, its exception is reported on its own
+BatchResult instead.
+"""
+
+import threading
+from collections import namedtuple
+
+import requests
+
+try:
+    from Queue import Queue, Empty
+except ImportError:
+    from queue import Queue, Empty
+
+DEFAULT_MAX_WORKERS = 8
+
+BatchResult = namedtuple('BatchResult', 'value error')
+
+
+def run_batch(calls, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Run ``calls`` concurrently and return a list of BatchResult.
+
+    Each call is either a callable taking no arguments or a
+    ``(command, params)`` tuple, e.g. ``(sync.db.status, {'folder': fid})``.
+    """
+    calls = [_as_callable(c) for c in calls]
+    results = [None] * len(calls)
+
+    if max_workers <= 1 or len(calls) <= 1:
+        for i, fn in enumerate(calls):
+            results[i] = _run(fn)
+        return results
+
+    queue = Queue()
+    for item in enumerate(calls):
+        queue.put(item)
+
+    def worker():
+        while True:
+            try:
+                i, fn = queue.get_nowait()
+            except Empty:
+                return
+            results[i] = _run(fn)
+
+    threads = []
+    for n in range(min(max_workers, len(calls))):
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        threads.append(t)
+
+    for t in threads:
+        t.join()
+
+    return results
+
+
+def _as_callable(call):
+    if callable(call):
+        return call
+
+    command, params = call
+    return lambda: command(**(params or {}))
+
+
+def _run(fn):
+    try:
+        value = fn()
+    except Exception as e:
+        return BatchResult(None, e)
+
+    # Interface hands back the raw response for non-200 statuses
+    if isinstance(value, requests.Response):
+        error = requests.HTTPError(
+            '%s %s' % (value.status_code, value.reason), response=value)
+        return BatchResult(None, error)
+
+    return BatchResult(value, None)
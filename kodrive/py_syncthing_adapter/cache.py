@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Response cache for idempotent GET endpoints.
+
+Entries expire after a per-endpoint TTL, concurrent identical GETs are
+collapsed into a single request (single-flight), and any write through
+the same Interface drops every entry. Cached values are handed out as
+deep copies because callers routinely mutate the config they fetched
+before posting it back.
+"""
+
+import copy
+import time
+import threading
+
+REST_ENDPOINT = '/rest'
+
+# Seconds a response stays fresh; endpoints not listed are never cached.
+# Liveness, sync state and random strings must always hit the daemon.
+DEFAULT_TTLS = {
+    REST_ENDPOINT + '/system/config': 5.0,
+    REST_ENDPOINT + '/system/status': 2.0,
+    REST_ENDPOINT + '/system/version': 300.0,
+    REST_ENDPOINT + '/svc/deviceid': 300.0,
+    REST_ENDPOINT + '/stats/folder': 2.0,
+    REST_ENDPOINT + '/stats/device': 2.0,
+}
+
+
+class _Flight(object):
+    def __init__(self, generation):
+        self.generation = generation
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ResponseCache(object):
+    def __init__(self, ttls=None):
+        self.ttls = dict(DEFAULT_TTLS)
+        if ttls:
+            self.ttls.update(ttls)
+
+        self.generation = 0
+        self._entries = {}
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def ttl(self, endpoint):
+        return self.ttls.get(endpoint)
+
+    def get(self, endpoint, params, loader):
+        """ Return the cached response for ``endpoint``, calling ``loader`` on a miss. """
+        ttl = self.ttl(endpoint)
+        if not ttl:
+            return loader()
+
+        key = (endpoint, tuple(sorted((params or {}).items())))
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.time():
+                return _copy(entry[1])
+
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight(self.generation)
+                self._flights[key] = flight
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return _copy(flight.value)
+
+        try:
+            flight.value = loader()
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+
+                # A write that landed while we were fetching makes this stale
+                fresh = flight.generation == self.generation
+                if flight.error is None and fresh and _cacheable(flight.value):
+                    self._entries[key] = (time.time() + ttl, flight.value)
+
+            flight.done.set()
+
+        return _copy(flight.value)
+
+    def invalidate(self):
+        with self._lock:
+            self.generation += 1
+            self._entries.clear()
+            self._flights.clear()
+
+
+def _cacheable(value):
+    # Non-200 responses come back as requests.Response objects
+    return isinstance(value, (dict, list))
+
+
+def _copy(value):
+    if isinstance(value, (dict, list)):
+        return copy.deepcopy(value)
+    return value
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+JSON codec used for REST bodies and the KodeDrive app config.
+
+The fastest installed backend is picked at import time, in the order
+of BACKENDS; the stdlib json module is always available as a fallback.
+Set KODRIVE_JSON=<name> to force a backend (e.g. 'json' when debugging
+an encoding difference).
+
+``iterencode`` (and ``dump(..., stream=True)``) encode incrementally,
+so a config with thousands of folders can be written to a file without
+first building the whole document in memory. REST bodies are encoded
+in one piece.
+"""
+
+import os
+import json
+import itertools
+
+BACKENDS = ('orjson', 'rapidjson', 'ujson', 'simplejson', 'json')
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+
+# encoder pieces joined per chunk by iterencode
+ITER_BATCH = 4096
+
+
+def _load(name):
+    if name == 'json':
+        return json
+    try:
+        return __import__(name)
+    except ImportError:
+        return None
+
+
+class Codec(object):
+    def __init__(self, name):
+        module = _load(name)
+        if module is None:
+            raise ImportError('json backend %s is not installed' % name)
+
+        self.name = name
+        self.module = module
+
+    def dumps(self, obj):
+        s = self.module.dumps(obj)
+        # orjson returns bytes
+        if isinstance(s, bytes) and not isinstance(s, str):
+            s = s.decode('utf-8')
+        return s
+
+    def loads(self, s):
+        if self.name in ('json', 'simplejson') and isinstance(s, bytes) \
+                and not isinstance(s, str):
+            s = s.decode('utf-8')
+        return self.module.loads(s)
+
+    def iterencode(self, obj, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Yield the UTF-8 encoding of ``obj`` in chunks of about chunk_size
+        bytes.
+        """
+        if self.name not in ('json', 'simplejson'):
+            # C encoders only work in one shot; just chunk the output
+            encoded = self.dumps(obj).encode('utf-8')
+            for n in range(0, len(encoded), chunk_size):
+                yield encoded[n:n + chunk_size]
+            return
+
+        pieces = self.module.JSONEncoder().iterencode(obj)
+        buf = []
+        size = 0
+        while True:
+            # the encoder yields tiny pieces, join them in batches
+            block = ''.join(itertools.islice(pieces, ITER_BATCH)).encode('utf-8')
+            buf.append(block)
+            size += len(block)
+
+            if size >= chunk_size or not block:
+                if size:
+                    yield b''.join(buf)
+                if not block:
+                    return
+                buf = []
+                size = 0
+
+    def dump(self, obj, fp, stream=False):
+        """
+        Write ``obj`` to the file object ``fp``. With ``stream`` the
+        document is never held in memory as a whole, at the price of
+        the stdlib's much slower incremental encoder.
+        """
+        # Python 2 text files take byte strings as they are
+        binary = bytes is str or 'b' in getattr(fp, 'mode', 'b')
+
+        if not stream:
+            s = self.dumps(obj)
+            fp.write(s.encode('utf-8') if binary and not isinstance(s, bytes) else s)
+            return
+
+        for chunk in self.iterencode(obj):
+            fp.write(chunk if binary else chunk.decode('utf-8'))
+
+    def __repr__(self):
+        return '<Codec(%s)>' % self.name
+
+
+def select(name=None):
+    """ Return the codec for ``name``, or the fastest one installed. """
+    if name and _load(name) is not None:
+        return Codec(name)
+
+    for name in BACKENDS:
+        if _load(name) is not None:
+            return Codec(name)
+
+
+default = select(os.environ.get('KODRIVE_JSON'))
+
+dumps = default.dumps
+loads = default.loads
+dump = default.dump
+iterencode = default.iterencode
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""
+Subscription to Syncthing's long-poll /rest/events endpoint.
+
+Syncthing numbers events with an id that restarts from 1 whenever the
+daemon restarts; EventStream keeps a ``since`` cursor and notices that
+reset (either through a dropped connection or an idle poll) so callers
+can keep iterating across restarts without missing or replaying state.
+"""
+
+import math
+import time
+import logging
+
+from requests.exceptions import ConnectionError, ReadTimeout
+
+logger = logging.getLogger(__name__)
+
+EVENTS_ENDPOINT = '/rest/events'
+
+# Seconds the daemon may hold a poll open (older daemons ignore the
+# parameter and always use 60), plus slack for the HTTP read timeout.
+DEFAULT_POLL_TIMEOUT = 60
+READ_TIMEOUT_SLACK = 5
+
+
+class EventStream(object):
+    def __init__(self, iface, types=None, since=None, timeout=DEFAULT_POLL_TIMEOUT,
+                 limit=None, reconnect=True, retry_interval=0.25):
+        self.iface = iface
+        self.types = set(types) if types else None
+        self.timeout = timeout
+        self.limit = limit
+        self.reconnect = reconnect
+        self.retry_interval = retry_interval
+
+        # None means "only events that happen from now on"
+        self.since = since
+
+    def __iter__(self):
+        return self.iter_events()
+
+    def latest_id(self):
+        """ Return the id of the newest event the daemon has buffered. """
+        events = self._fetch(since=0, limit=1, timeout=0, filtered=False)
+        if events:
+            return events[-1]['id']
+        return 0
+
+    def resync(self):
+        """ Reset the cursor if the daemon restarted since the last poll. """
+        latest = self.latest_id()
+
+        if self.since is None:
+            self.since = latest
+        elif latest < self.since:
+            logger.debug('event ids went back (%s < %s), daemon restarted'
+                         % (latest, self.since))
+            self.since = 0
+
+    def poll(self, timeout=None):
+        """ Block for at most one long-poll and return the matching events. """
+        if self.since is None:
+            self.resync()
+
+        if timeout is None:
+            timeout = self.timeout
+
+        events = self._fetch(since=self.since, limit=self.limit, timeout=timeout)
+
+        if not events:
+            # An idle poll is also how a quick restart shows up: the
+            # cursor is ahead of every id the new process will issue
+            self.resync()
+            return []
+
+        self.since = events[-1]['id']
+        return [e for e in events if self._wanted(e)]
+
+    def iter_events(self, deadline=None):
+        """ Yield events until ``deadline`` (a time.time() value) passes. """
+        while deadline is None or time.time() < deadline:
+            timeout = self.timeout
+            if deadline is not None:
+                remaining = int(math.ceil(deadline - time.time()))
+                timeout = max(1, min(timeout, remaining))
+
+            try:
+                events = self.poll(timeout)
+            except ConnectionError:
+                if not self.reconnect:
+                    raise
+
+                time.sleep(self.retry_interval)
+                self._resync_quietly()
+                continue
+
+            for e in events:
+                yield e
+
+    def subscribe(self, callback, deadline=None):
+        """
+        Call ``callback(event)`` for every event; stop as soon as it returns
+        a true value, which is then returned. Returns None on deadline.
+        """
+        for e in self.iter_events(deadline):
+            result = callback(e)
+            if result:
+                return result
+
+    def wait_for(self, predicate=None, timeout=None):
+        """ Return the first event satisfying ``predicate`` or None. """
+        deadline = time.time() + timeout if timeout is not None else None
+
+        for e in self.iter_events(deadline):
+            if predicate is None or predicate(e):
+                return e
+
+    def _resync_quietly(self):
+        try:
+            self.resync()
+        except ConnectionError:
+            pass
+
+    def _wanted(self, event):
+        return self.types is None or event.get('type') in self.types
+
+    def _fetch(self, since, limit=None, timeout=DEFAULT_POLL_TIMEOUT, filtered=True):
+        params = {'since': since, 'timeout': timeout}
+
+        if limit:
+            params['limit'] = limit
+
+        if filtered and self.types:
+            params['events'] = ','.join(sorted(self.types))
+
+        try:
+            events = self.iface.long_poll(
+                EVENTS_ENDPOINT, timeout + READ_TIMEOUT_SLACK, **params)
+        except ReadTimeout:
+            return []
+
+        # non-200 responses come back as the raw response object
+        if not isinstance(events, list):
+            return []
+
+        return events
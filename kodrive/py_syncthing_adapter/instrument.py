@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+"""
+Instrumentation hooks for daemon calls.
+
+Every request made by an Interface is reported to the installed hooks as
+a CallRecord. Time spent outside of REST (sleeps, restarts, waits) can
+be reported the same way with ``span``. With no hook installed the cost
+is a single truthiness check per call.
+
+    agg = instrument.Aggregator()
+    instrument.add_hook(agg)
+    ...
+    print(agg.dump())
+"""
+
+import json
+import math
+import time
+import random
+import threading
+from collections import namedtuple
+from contextlib import contextmanager
+
+CallRecord = namedtuple('CallRecord', [
+    'verb',         # HTTP verb, or 'SPAN' for span()
+    'endpoint',     # URL path, or the span name
+    'status',       # HTTP status code, None if no response arrived
+    'elapsed',      # wall time in seconds
+    'req_bytes',
+    'resp_bytes',
+    'retries',      # retries spent before this attempt
+    'error',        # exception class name, None on success
+])
+
+hooks = []
+
+
+def add_hook(fn):
+    """ Call ``fn(record)`` for every CallRecord emitted. """
+    if fn not in hooks:
+        hooks.append(fn)
+
+
+def remove_hook(fn):
+    if fn in hooks:
+        hooks.remove(fn)
+
+
+def emit(record):
+    for fn in list(hooks):
+        try:
+            fn(record)
+        except Exception:
+            pass
+
+
+@contextmanager
+def span(name):
+    """ Report the time spent in the with-block as a 'SPAN' record. """
+    if not hooks:
+        yield
+        return
+
+    started = time.time()
+    error = None
+    try:
+        yield
+    except BaseException as e:
+        error = type(e).__name__
+        raise
+    finally:
+        emit(CallRecord('SPAN', name, None, time.time() - started,
+                        0, 0, 0, error))
+
+
+def sleep(seconds, name='sleep'):
+    """ time.sleep that shows up as a span. """
+    with span(name):
+        time.sleep(seconds)
+
+
+class Aggregator(object):
+    """
+    In-process hook keeping per (verb, endpoint) counts, byte totals and
+    latency percentiles. Latencies are kept in a reservoir of at most
+    ``max_samples`` per key so long-running processes stay bounded.
+    """
+
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, max_samples=2048):
+        self.max_samples = max_samples
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, record):
+        key = '%s %s' % (record.verb, record.endpoint)
+
+        with self._lock:
+            s = self._stats.get(key)
+            if s is None:
+                s = self._stats[key] = {
+                    'count': 0, 'errors': 0, 'retries': 0,
+                    'req_bytes': 0, 'resp_bytes': 0,
+                    'total': 0.0, 'max': 0.0, 'samples': [],
+                }
+
+            s['count'] += 1
+            s['retries'] += record.retries
+            s['req_bytes'] += record.req_bytes
+            s['resp_bytes'] += record.resp_bytes
+            s['total'] += record.elapsed
+            s['max'] = max(s['max'], record.elapsed)
+
+            if record.error is not None or (record.status or 200) >= 400:
+                s['errors'] += 1
+
+            samples = s['samples']
+            if len(samples) < self.max_samples:
+                samples.append(record.elapsed)
+            else:
+                n = random.randrange(s['count'])
+                if n < self.max_samples:
+                    samples[n] = record.elapsed
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
+
+    def snapshot(self):
+        """ Return {'VERB endpoint': {count, errors, ..., p50, p95, p99}}. """
+        out = {}
+
+        with self._lock:
+            for key, s in self._stats.items():
+                row = dict((k, v) for k, v in s.items() if k != 'samples')
+                samples = sorted(s['samples'])
+                for p in self.PERCENTILES:
+                    row['p%d' % p] = percentile(samples, p)
+                out[key] = row
+
+        return out
+
+    def dump(self, fp=None, indent=2):
+        """ Serialize snapshot() as JSON; written to ``fp`` if given. """
+        data = self.snapshot()
+        if fp is None:
+            return json.dumps(data, indent=indent, sort_keys=True)
+        json.dump(data, fp, indent=indent, sort_keys=True)
+
+
+def percentile(ordered, p):
+    """ Nearest-rank percentile of an already sorted list. """
+    if not ordered:
+        return None
+    rank = int(math.ceil(p / 100.0 * len(ordered))) - 1
+    return ordered[max(0, min(rank, len(ordered) - 1))]
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+Generators over large folder listings.
+
+/rest/db/need is walked page by page and /rest/db/browse one directory
+level at a time, so memory stays bounded by a page (or one directory)
+no matter how many files the folder holds.
+"""
+
+import requests
+
+DEFAULT_PER_PAGE = 500
+
+NEED_SECTIONS = ('progress', 'queued', 'rest')
+
+
+def iter_need(need, folder, perpage=DEFAULT_PER_PAGE):
+    """
+    Yield ``(section, file)`` for every file ``folder`` still needs, where
+    section is one of 'progress', 'queued' or 'rest'. ``need`` is the
+    db.need command.
+    """
+    page = 1
+
+    while True:
+        res = _check(need(folder=folder, page=page, perpage=perpage))
+        count = 0
+
+        for section in NEED_SECTIONS:
+            for f in res.get(section) or []:
+                count += 1
+                yield section, f
+
+        # Daemons without pagination ignore the parameters and return
+        # everything at once, without echoing the page back
+        if 'page' not in res or count < perpage:
+            return
+
+        page += 1
+
+
+def iter_browse(browse, folder, prefix=None):
+    """
+    Yield ``(path, entry)`` for every file and directory below ``prefix``,
+    depth first. entry is a dict with at least 'name' and 'type'
+    ('file' or 'directory'), plus 'modTime' and 'size' for files.
+    ``browse`` is the db.browse command.
+    """
+    stack = [prefix or '']
+
+    while stack:
+        current = stack.pop()
+        params = {'folder': folder, 'levels': 0}
+        if current:
+            params['prefix'] = current
+
+        children = list(_entries(_check(browse(**params))))
+
+        for entry in children:
+            path = current + '/' + entry['name'] if current else entry['name']
+            yield path, entry
+
+            if entry['type'] == 'directory':
+                stack.append(path)
+
+
+def _entries(res):
+    # Syncthing >= 1.0 returns a list of objects
+    if isinstance(res, list):
+        for e in res:
+            kind = e.get('type', '')
+            yield {
+                'name': e['name'],
+                'type': 'directory' if 'DIRECTORY' in kind else 'file',
+                'modTime': e.get('modTime'),
+                'size': e.get('size'),
+            }
+        return
+
+    # Older daemons map names to {} for directories, [mtime, size] for files
+    for name, value in res.items():
+        if isinstance(value, dict):
+            yield {'name': name, 'type': 'directory'}
+        else:
+            yield {
+                'name': name,
+                'type': 'file',
+                'modTime': value[0] if value else None,
+                'size': value[1] if len(value) > 1 else None,
+            }
+
+
+def _check(res):
+    if isinstance(res, requests.Response):
+        raise requests.HTTPError(
+            '%s %s' % (res.status_code, res.reason), response=res)
+    return res
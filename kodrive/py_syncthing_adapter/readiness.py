@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Waiting for a daemon to become ready.
+
+Readiness is checked in stages of increasing cost, each only once the
+previous one passed:
+
+``socket``   the REST port (or unix socket) accepts connections
+``rest``     /rest/system/ping answers
+``startup``  optional: the daemon finished starting up, i.e. it emitted
+             StartupComplete or has been up for longer than its event
+             buffer can be trusted to still hold that event
+
+A stopped daemon is recognized by a refused connect, without an HTTP
+request or its timeout; a running one costs one connect and one ping.
+Failed checks are retried with exponential backoff. Each wait is
+reported to instrument hooks as a 'readiness' span.
+"""
+
+import time
+
+from . import instrument
+from .retry import RetryPolicy
+
+STARTUP_EVENT = 'StartupComplete'
+
+# Seconds of uptime after which startup is taken as complete even
+# without the event, which a busy daemon may have dropped by then
+STARTUP_GRACE = 30
+
+
+class Readiness(object):
+    def __init__(self, sync, policy=None):
+        self.sync = sync
+        self.policy = policy or RetryPolicy()
+
+        # outcome of the last wait: the stage that still failed (None if
+        # ready) and the seconds it took
+        self.failed_stage = None
+        self.latency = None
+
+    def check(self, startup=False):
+        """ Return the first stage that fails, None if the daemon is ready. """
+        if not self._passes(lambda: self.sync.reachable()):
+            return 'socket'
+
+        if not self._passes(lambda: self.sync.probe()):
+            return 'rest'
+
+        if startup and not self._passes(self.started):
+            return 'startup'
+
+        return None
+
+    def started(self):
+        """ Whether the daemon is done starting up. """
+        status = self.sync.sys.status()
+
+        if isinstance(status, dict) and status.get('uptime', 0) >= STARTUP_GRACE:
+            return True
+
+        stream = self.sync.events(types=[STARTUP_EVENT], since=0, reconnect=False)
+        return bool(stream.poll(timeout=0))
+
+    def wait(self, timeout, startup=False, on_retry=None):
+        """ Poll check() with backoff until it passes (True) or timeout passes. """
+        started = time.time()
+
+        def ready():
+            self.failed_stage = self.check(startup)
+            return self.failed_stage is None
+
+        with instrument.span('readiness'):
+            ok = self.policy.wait_until(ready, timeout, on_retry)
+
+        self.latency = time.time() - started
+        return ok
+
+    @staticmethod
+    def _passes(check):
+        try:
+            return bool(check())
+        except Exception:
+            return False
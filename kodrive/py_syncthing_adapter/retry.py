@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+Retry and fail-fast policies for daemon calls.
+
+RetryPolicy produces jittered exponential delays, starting in the tens
+of milliseconds so a daemon that is already up (or comes up quickly) is
+noticed almost immediately, and capping so a slow one is not hammered.
+CircuitBreaker stops an Interface from dialling a daemon that has
+refused a run of connections, until a probe shows it is back.
+"""
+
+import time
+import random
+import threading
+
+from requests.exceptions import ConnectionError
+
+from . import instrument
+
+
+class CircuitOpen(ConnectionError):
+    """ Raised instead of connecting while the breaker is open. """
+
+
+class RetryPolicy(object):
+    def __init__(self, base=0.02, cap=1.0, factor=2.0, jitter=0.5,
+                 max_attempts=None, retry_on=(ConnectionError,)):
+        self.base = base
+        self.cap = cap
+        self.factor = factor
+        self.jitter = jitter
+        self.max_attempts = max_attempts
+        self.retry_on = retry_on
+
+    def delays(self):
+        """ Yield the delay before each retry, forever or up to max_attempts - 1. """
+        n = 0
+        while self.max_attempts is None or n < self.max_attempts - 1:
+            delay = min(self.cap, self.base * (self.factor ** n))
+            # keep at least (1 - jitter) of the delay so retries still back off
+            yield delay * (1 - self.jitter * random.random())
+            n += 1
+
+    def call(self, fn, timeout=None, on_retry=None, giveup=None):
+        """
+        Return ``fn()``, retrying on ``retry_on`` errors until max_attempts
+        or ``timeout`` seconds are used up; the last error is re-raised.
+        Errors for which ``giveup(error)`` is true are re-raised at once.
+        """
+        deadline = time.time() + timeout if timeout is not None else None
+        delays = self.delays()
+        attempt = 0
+
+        while True:
+            try:
+                return fn()
+            except self.retry_on as e:
+                if giveup is not None and giveup(e):
+                    raise
+
+                delay = next(delays, None)
+                if delay is None or _past(deadline, delay):
+                    raise
+
+            attempt += 1
+            if on_retry:
+                on_retry(attempt, delay)
+            instrument.sleep(delay, 'backoff')
+
+    def wait_until(self, predicate, timeout, on_retry=None):
+        """ Poll ``predicate()`` until it is true (True) or timeout passes (False). """
+        deadline = time.time() + timeout
+        delays = self.delays()
+        attempt = 0
+
+        while True:
+            if predicate():
+                return True
+
+            delay = next(delays, None)
+            if delay is None or _past(deadline, delay):
+                return False
+
+            attempt += 1
+            if on_retry:
+                on_retry(attempt, delay)
+            instrument.sleep(delay, 'backoff')
+
+
+def _past(deadline, delay):
+    return deadline is not None and time.time() + delay > deadline
+
+
+class CircuitBreaker(object):
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half-open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=1.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self):
+        return self.state == self.OPEN
+
+    def allow(self):
+        """ Whether a call may go out; lets one probe through per reset_timeout. """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            if self.state == self.OPEN and time.time() - self.opened_at >= self.reset_timeout:
+                self.state = self.HALF_OPEN
+                return True
+
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.time()
+
+    def record_error(self):
+        """
+        A call that failed other than by a refused connection, e.g. a
+        read timeout: inconclusive, except that a failed probe reopens
+        the circuit for another reset_timeout.
+        """
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                self.state = self.OPEN
+                self.opened_at = time.time()
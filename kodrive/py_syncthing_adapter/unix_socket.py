@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+HTTP over a unix domain socket.
+
+Syncthing accepts ``unix:///path/to/socket`` as its GUI address. Mounting
+UnixAdapter on a session sends every request through that socket, so a
+local client needs neither a TCP port nor a TCP handshake.
+"""
+
+import errno
+import socket
+
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.connection import HTTPConnection
+from requests.packages.urllib3.connectionpool import HTTPConnectionPool
+from requests.packages.urllib3.exceptions import NewConnectionError
+
+SCHEME = 'unix://'
+
+# placeholder host used in URLs sent over the socket
+SOCKET_HOST = 'localhost'
+
+
+def parse_address(address):
+    """ Return the socket path of a ``unix://`` address, else None. """
+    if address and address.startswith(SCHEME):
+        return address[len(SCHEME):]
+    return None
+
+
+def reachable(path, timeout=0.25):
+    """ Whether something accepts connections on the socket at ``path``. """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(timeout)
+    try:
+        sock.connect(path)
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+class UnixHTTPConnection(HTTPConnection):
+    def __init__(self, socket_path, *args, **kwargs):
+        self.socket_path = socket_path
+        super(UnixHTTPConnection, self).__init__(*args, **kwargs)
+
+    def _new_conn(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if isinstance(self.timeout, (int, float)):
+            sock.settimeout(self.timeout)
+
+        try:
+            sock.connect(self.socket_path)
+        except socket.error as e:
+            sock.close()
+            # a missing or stale socket means the daemon is not up, which
+            # callers expect to see as a failed connection
+            if e.errno in (errno.ENOENT, errno.ECONNREFUSED):
+                raise NewConnectionError(self, 'Failed to establish a new connection: %s' % e)
+            raise
+
+        return sock
+
+
+class UnixHTTPConnectionPool(HTTPConnectionPool):
+    def __init__(self, socket_path, **kwargs):
+        super(UnixHTTPConnectionPool, self).__init__(SOCKET_HOST, **kwargs)
+        self.socket_path = socket_path
+
+    def _new_conn(self):
+        self.num_connections += 1
+        return UnixHTTPConnection(self.socket_path, host=self.host, port=self.port,
+                                  timeout=self.timeout.connect_timeout)
+
+
+class UnixAdapter(HTTPAdapter):
+    """ Transport adapter routing every request to one unix socket. """
+
+    def __init__(self, socket_path, pool_maxsize=10, **kwargs):
+        self.socket_path = socket_path
+        self._pool = UnixHTTPConnectionPool(socket_path, maxsize=pool_maxsize)
+        super(UnixAdapter, self).__init__(pool_maxsize=pool_maxsize, **kwargs)
+
+    def get_connection(self, url, proxies=None):
+        return self._pool
+
+    def get_connection_with_tls_context(self, request, verify, proxies=None, cert=None):
+        return self._pool
+
+    def close(self):
+        super(UnixAdapter, self).close()
+        self._pool.close()
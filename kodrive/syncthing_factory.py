@@ -1,19 +1,114 @@
 import click, pdb
 
-from .py_syncthing_adapter import Syncthing
+from .py_syncthing_adapter import Syncthing, AsyncSyncthing
+from .py_syncthing_adapter import close_shared_sessions
+from .py_syncthing_adapter import async_client
+from .py_syncthing_adapter import retry
+from .py_syncthing_adapter import instrument
+from .py_syncthing_adapter import readiness
+from .py_syncthing_adapter import unix_socket
+from .py_syncthing_adapter import codec
 
 # Self-defined
 from . import platform_adapter
 from .data import custom_errors
 from .data import syncthing_adt
 from utils import st_facade_util as st_util
+from utils import config_index
+from utils import config_transaction
+from utils import config_diff
+from utils import restart_coalescer
+from utils import discovery_cache
+from utils import auth_report
+from utils import copy_engine
+from utils import live_state
 
 # Standard library
 import os, sys, platform
 import time, socket, json
 import base64, hashlib, shutil
+import functools, copy, logging
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# First Syncthing release with /rest/config/folders and /rest/config/devices
+CONFIG_API_VERSION = (1, 12, 0)
+
+# Seconds a CLI run waits for a discovery cache refresh before exiting
+CACHE_REFRESH_TIMEOUT = 2
+
+# Seconds make_server waits for a restarted daemon's GUI certificate
+GUI_CERT_TIMEOUT = 10
+
+# Interface options AsyncSyncthingFacade.from_adapter carries over
+CONNECTION_OPTIONS = ('api_key', 'host', 'port', 'socket_path', 'is_https',
+  'ssl_cert_file', 'fingerprint', 'timeout')
+
+# Folders whose status ls(long=True) asks for concurrently
+LS_BATCH = 64
+
+# Events push_progress follows
+PROGRESS_EVENTS = ('FolderCompletion', 'FolderScanProgress', 'StateChanged')
+
+# Seconds dir push -v follows progress before giving up
+PUSH_TIMEOUT = 300
+
+def summarize_completion(completion):
+  '''
+    Aggregate a device -> percent map: the average percent, how many
+    devices are fully synchronized (device_num) and out of how many
+    (max_devices)
+  '''
+  percents = list(completion.values())
+
+  if not percents:
+    return {
+      'percent' : 100,
+      'device_num' : 0,
+      'max_devices' : 0
+    }
+
+  percent = float(sum(percents)) / len(percents)
+
+  return {
+    'percent' : percent if percent > 0 else 0,
+    'device_num' : len([p for p in percents if p >= 100]),
+    'max_devices' : len(percents)
+  }
+
+def transactional(method):
+  '''
+    Run method inside a config transaction, see SyncthingFacade.transaction
+  '''
+  @functools.wraps(method)
+  def wrapper(self, *args, **kwargs):
+    with self.transaction():
+      return method(self, *args, **kwargs)
+
+  return wrapper
 
 class SyncthingFacade():
+
+  # Set while a transaction() block is running
+  _transaction = None
+
+  # (config, snapshot) of the config last loaded from or stored to the
+  # daemon, and the changes the last set_config made to it
+  _loaded = None
+  last_diff = None
+
+  # Whether the daemon has per-object config endpoints, see has_config_api
+  _config_api = None
+
+  # Discovery cache refresh still running, see finish_cache_refresh
+  _cache_refresh = None
+
+  # Restarts asked for but found unnecessary, see restart_if_needed
+  skipped_restarts = 0
+
+  # This daemon's device id, see get_device_id
+  _device_id = None
     
   def __init__(self, **kwargs):
     if 'sync' in kwargs:
@@ -22,59 +117,401 @@ class SyncthingFacade():
     if 'adapter' in kwargs:
       self.adapter = kwargs['adapter']
 
-  def get_config(self):
-    return self.sync.sys.config()
+  @contextmanager
+  def transaction(self):
+    '''
+      Batch config changes: the Syncthing config and config.json are
+      read once, written once when the block exits, and the daemon is
+      restarted at most once, only if a change needs it. Nothing is
+      written if the block raises. Nested transactions join the
+      outermost one.
+    '''
+    if self._transaction is not None:
+      yield self._transaction
+      return
+
+    txn = config_transaction.Transaction(self)
+    adapter = getattr(self, 'adapter', None)
+
+    self._transaction = txn
+    if txn.adapter:
+      self.adapter = txn.adapter
 
-  def get_device_id(self):
     try:
-      return self.sync.sys.status()['myID']
-    except Exception as e:
-      if self.adapter:
-        return self.adapter.get_device_id()
+      yield txn
+    finally:
+      self._transaction = None
+      if txn.adapter:
+        self.adapter = adapter
+
+    txn.commit()
+
+  def load_config(self):
+    config = self.sync.sys.config()
+    self.remember_config(config)
+    return config
+
+  def store_config(self, config, changes=None):
+    status = None
+
+    if changes is None:
+      changes = self.diff_config(config)
+
+    # Send only the folders and devices that changed when the daemon
+    # can take them one by one
+    if changes and self.has_config_api():
+      status = self.store_config_objects(config, changes)
+
+    if status is None:
+      status = self.sync.sys.set.config(config)
+
+    self.remember_config(config)
+    return status
+
+  def store_config_objects(self, config, changes):
+    '''
+      Apply changes through the per-object config endpoints; None if
+      they touch anything else or the daemon refused one of them
+    '''
+    index = config_index.index_for(config)
+    endpoints = {
+      'folders' : index.folder,
+      'devices' : index.device
+    }
+    # (section, id) -> changed fields, None to replace or delete the object
+    objects = {}
+
+    for c in changes:
+      if c.path[0] not in endpoints or len(c.path) < 2:
+        return None
+
+      key = c.path[:2]
+
+      if len(c.path) == 2:
+        objects[key] = None
+      elif objects.get(key, {}) is not None:
+        objects.setdefault(key, {})[c.path[2]] = None
+
+    commands = {
+      'folders' : (self.sync.config.set.folder, self.sync.config.patch.folder,
+        self.sync.config.delete.folder),
+      'devices' : (self.sync.config.set.device, self.sync.config.patch.device,
+        self.sync.config.delete.device)
+    }
+
+    # Folders may only name devices the daemon knows, or it drops them:
+    # new devices go first, then folders, then field changes; folders
+    # are deleted before the devices they name
+    steps = []
+
+    for (section, object_id), fields in objects.items():
+      obj = endpoints[section](object_id)
+
+      if obj is None:
+        rank = 3 if section == 'folders' else 4
+      elif fields is None:
+        rank = 0 if section == 'devices' else 1
       else:
+        rank = 2
+
+      steps.append((rank, section, object_id, obj, fields))
+
+    for rank, section, object_id, obj, fields in sorted(steps, key=lambda s: s[:3]):
+      put, patch, delete = commands[section]
+
+      if obj is None:
+        result = delete(id=object_id)
+      elif fields is None:
+        result = put(obj, id=object_id)
+      else:
+        result = patch(dict((k, obj[k]) for k in fields if k in obj), id=object_id)
+
+      # Errors come back as the response itself
+      if result is not True:
+        logger.debug('%s %s refused, posting the whole config', section, object_id)
         return None
+
+    return True
+
+  def st_version(self):
+    '''
+      Version of the daemon as a tuple, e.g. (0, 14, 7); None if unknown
+    '''
+    try:
+      return st_util.parse_version(self.sync.sys.version()['version'])
+    except Exception:
+      return None
+
+  def has_config_api(self):
+    '''
+      Whether the daemon has the per-object /rest/config endpoints
+    '''
+    if self._config_api is None:
+      version = self.st_version()
+
+      if version is None:
+        return False
+
+      self._config_api = version >= CONFIG_API_VERSION
+
+    return self._config_api
+
+  def remember_config(self, config):
+    # Snapshot of what the daemon has, to diff set_config against
+    if isinstance(config, dict):
+      self._loaded = (config, copy.deepcopy(config))
+    else:
+      self._loaded = None
+
+  def snapshot_of(self, config):
+    '''
+      The daemon's copy of config as last loaded or stored,
+      None if config did not come from the daemon
+    '''
+    loaded = self._loaded
+
+    if loaded is None or loaded[0] is not config:
+      return None
+
+    return loaded[1]
+
+  def diff_config(self, config):
+    '''
+      What config changes in the daemon's config, None if unknown
+    '''
+    snapshot = self.snapshot_of(config)
+
+    if snapshot is None:
+      return None
+
+    return config_diff.diff(snapshot, config)
+
+  def config_changes(self, config):
+    '''
+      diff_config, kept in last_diff and logged
+    '''
+    self.last_diff = self.diff_config(config)
+
+    if self.last_diff:
+      logger.debug('config changes:\n%s', config_diff.describe(self.last_diff))
+
+    return self.last_diff
+
+  def get_config(self):
+    if self._transaction is not None:
+      return self._transaction.get_config()
+
+    return self.load_config()
+
+  def get_device_id(self):
+    # A daemon's device id never changes, ask for it once
+    if self._device_id is None:
+      try:
+        self._device_id = self.sync.sys.status()['myID']
+      except Exception as e:
+        if self.adapter:
+          return self.adapter.get_device_id()
+        else:
+          return None
+
+    return self._device_id
         
   def set_config(self, config, restart=False):
-    status = self.sync.sys.set.config(config)
+    if self._transaction is not None:
+      return self._transaction.set_config(config, restart)
+
+    changes = self.config_changes(config)
+
+    # Nothing to commit
+    if changes == []:
+      return True
+
+    status = self.store_config(config, changes)
+
     if restart:
-      self.restart()
+      self.restart_if_needed(changes)
+
     return status
     
-  def restart(self):
-    self.sync.sys.set.restart()
+  def restart(self, wait=False):
+    '''
+      Restart the daemon. With a restart delay configured, the restart is
+      coalesced with those of other kodrive processes and performed once
+      things are quiet; wait blocks until it was.
+    '''
+    if self._transaction is not None:
+      return self._transaction.request_restart()
+
+    coalescer = self.get_restart_coalescer()
+
+    if coalescer:
+      ticket = coalescer.request()
+      if wait:
+        coalescer.wait(ticket)
+      return
+
+    self.restart_now()
+
+  def restart_required(self):
+    '''
+      Whether the daemon needs a restart to apply its config; None if it
+      cannot tell
+    '''
+    try:
+      if self.has_config_api():
+        return self.sync.config.restart_required()['requiresRestart']
+
+      # Older daemons report a saved but unapplied config as out of sync
+      return not self.sync.sys.insync()['configInSync']
+    except Exception:
+      return None
+
+  def restart_if_needed(self, changes=None, wait=False):
+    '''
+      Restart if the daemon says so or, when it cannot tell, if changes
+      touch sections applied on restart only. Returns whether it did;
+      skipped restarts are counted in skipped_restarts.
+    '''
+    if self._transaction is not None:
+      return self._transaction.request_restart()
+
+    required = self.restart_required()
+
+    if required is None:
+      required = changes is None or config_diff.requires_restart(changes)
+
+    if not required:
+      self.skipped_restarts += 1
+      logger.debug('config applied without restart')
+      return False
+
+    self.restart(wait=wait)
+    return True
+
+  def restart_now(self):
+    with instrument.span('restart'):
+      return self.sync.sys.set.restart()
+
+  def restart_delay(self):
+    '''
+      Quiet period before a restart, from KODRIVE_RESTART_DELAY or the
+      system section of config.json; 0 restarts right away
+    '''
+    delay = os.environ.get('KODRIVE_RESTART_DELAY')
+
+    if delay is None:
+      kodrive_config = self.adapter.get_config() or {}
+      delay = kodrive_config.get('system', {}).get('restart-delay')
+
+    try:
+      return float(delay or 0)
+    except ValueError:
+      return 0
+
+  def get_restart_coalescer(self):
+    # Remote daemons are restarted directly
+    if not getattr(self, 'adapter', None):
+      return None
+
+    delay = self.restart_delay()
+
+    if delay <= 0:
+      return None
+
+    def restart():
+      # The executor is a forked process, don't share the parent's sockets
+      close_shared_sessions()
+      result = self.restart_now()
+
+      # Refusals come back as the response itself
+      if hasattr(result, 'status_code'):
+        raise IOError('the daemon answered %s' % result.status_code)
+
+    return restart_coalescer.RestartCoalescer(
+      self.adapter.app_conf_dir, delay, restart)
 
   def stat(self, path):
+    '''
+      Return the status of path; 'files_needed' is a lazy iterator of
+      (section, file) pairs fetched page by page, see iter_needed
+    '''
     if not path[len(path) - 1] == '/':
       path += '/'
 
+    config = self.get_config()
     folder = self.find_folder({
       'path' : path
-    }) 
+    }, config) 
     
     if not folder:
       raise IOError(path + ' is not being synchronized.')
     else:
-      files_needed = self.sync.db.need(folder=folder['id'])
-      status = self.sync.db.status(folder=folder['id'])
+      calls = [(self.sync.db.status, {'folder' : folder['id']})]
+
+      # The device id is only asked for once
+      if self._device_id is None:
+        calls.append((self.sync.sys.status, None))
+
+      results = self.sync.batch(calls)
+      status = results[0]
+
+      if status.error:
+        raise status.error
+
+      if len(results) > 1 and not results[1].error:
+        self._device_id = results[1].value['myID']
+
       return {
-        'status' : status, 
-        'files_needed' : files_needed,
-        'auth_ls' : self.auth_ls()
+        'status' : status.value, 
+        'files_needed' : self.sync.iter_need(folder['id']),
+        'auth_report' : self.auth_report(config, self.get_device_id(), folder['id'])
       }
 
+  def iter_needed(self, path, perpage=None):
+    '''
+      Yield (section, file) for every file path still needs
+    '''
+    folder = self.find_folder({
+      'path' : self.to_st_path(path)
+    })
+
+    if not folder:
+      raise IOError(path + ' is not being synchronized.')
+
+    if perpage:
+      return self.sync.iter_need(folder['id'], perpage)
+
+    return self.sync.iter_need(folder['id'])
+
+  def folder_statuses(self, config=None):
+    '''
+      Return {folder id : db status} for every folder, fetched concurrently.
+      Folders whose status could not be fetched map to None.
+    '''
+    if not config:
+      config = self.get_config()
+
+    ids = [f['id'] for f in config['folders']]
+    results = self.sync.batch([
+      (self.sync.db.status, {'folder' : fid}) for fid in ids
+    ])
+
+    return dict((fid, res.value) for fid, res in zip(ids, results))
+
   def set_rescan_interval(self, path, secs, restart=False):
     if type(secs) != int or secs < 0:
       return False
 
+    config = self.get_config()
     folder = self.find_folder({
       'path' : path
-    })
-    folder['rescanIntervalS'] = secs
+    }, config)
 
-    self.set_config(config)
+    if not folder:
+      raise custom_errors.FileNotInConfig(path)
 
-    if restart:
-      self.restart()
+    folder['rescanIntervalS'] = secs
+    self.set_config(config, restart)
 
     return True
 
@@ -83,99 +520,203 @@ class SyncthingFacade():
     if not path[len(path) - 1] == '/':
       path += '/'
 
+    # The folder at path or the one enclosing it
     config = self.get_config()
-    
-    for f in config['folders']:
-      if f['path'] in path:
-        path = f['path']
-        break
-
-    folder = self.find_folder({
-      'path' : path
-    }) 
+    folder = config_index.index_for(config).folder_containing(path)
 
     if not folder:
       raise IOError(path + ' is not being synchronized.')
     else:
       return self.sync.db.set.scan(folder=folder['id'])
 
-  def completion(self, path, device_num=0):
+  def completion(self, path):
+    '''
+      Aggregate completion of path across every remote device.
+
+      All devices are queried at once; the result's device_num is the
+      number of devices that are fully synchronized and max_devices the
+      number of remote devices, so callers can poll until they match.
+    '''
 
     if not path[len(path) - 1] == '/':
       path += '/'
 
+    config = self.get_config()
     folder = self.find_folder({
       'path' : path
-    })
-    max_devices = len(folder['devices']) - 1
-    
-    device_id = folder['devices'][device_num]['deviceID']
+    }, config)
+
+    if not folder:
+      raise IOError(path + ' is not being synchronized.')
+
     # Skip own device
-    if device_id == self.get_device_id():
-      if device_num >= len(folder['devices']): 
-        return {
-          'percent' : 100,
-          'device_num' : device_num + 1,
-          'max_devices' : max_devices
-        }
-      else:
-        device_id = folder['devices'][device_num + 1]['deviceID']
+    own_id = self.get_device_id()
+    devices = [self.get_devid(d) for d in folder['devices']]
+    devices = [d for d in devices if d != own_id]
 
-    res = self.sync.db.completion(device=device_id, folder=folder['id'])
-    percent = res['completion']
-    percent = (device_num  * 100 + percent) / (max_devices * 100) * 100
+    return summarize_completion(self.device_completion(folder['id'], devices))
 
-    if percent == 100:
-      device_num += 1
+  def device_completion(self, folder_id, devices):
+    '''
+      Map each of devices to its completion of folder_id, in one batch
+    '''
+    results = self.sync.batch([
+      (self.sync.db.completion, {'device' : d, 'folder' : folder_id})
+      for d in devices
+    ])
 
-    return {
-      'percent' : percent if percent > 0 else 0,
-      'device_num' : device_num,
-      'max_devices' : max_devices
-    } 
+    return dict(
+      (d, 0 if r.error else r.value['completion'])
+      for d, r in zip(devices, results))
+
+  def push_progress(self, path, timeout=None):
+    '''
+      Scan path once and return an iterator of completion summaries
+      (see completion) updated from the event stream, plus the folder's
+      'state'. It ends once the scan is over and every remote device
+      has caught up, or after timeout seconds.
+    '''
+    path = self.to_st_path(path)
+    folder = self.find_folder({'path' : path})
+
+    if not folder:
+      raise IOError(path + ' is not being synchronized.')
+
+    own_id = self.get_device_id()
+    devices = [self.get_devid(d) for d in folder['devices']]
+    devices = [d for d in devices if d != own_id]
+
+    # Subscribe first so the scan's events cannot be missed
+    stream = self.events(PROGRESS_EVENTS)
+    stream.resync()
+
+    self.sync.db.set.scan(folder=folder['id'])
+
+    deadline = time.time() + timeout if timeout else None
+    return self.iter_progress(stream, folder['id'], devices, deadline)
+
+  def iter_progress(self, stream, folder_id, devices, deadline=None):
+    completion = self.device_completion(folder_id, devices)
+    state = {'state' : 'scanning', 'scanned' : False}
+
+    def progress():
+      summary = summarize_completion(completion)
+      summary['state'] = state['state']
+      return summary
+
+    def done():
+      return state['scanned'] and all(p >= 100 for p in completion.values())
+
+    yield progress()
+
+    for e in stream.iter_events(deadline):
+      data = e.get('data') or {}
+
+      if data.get('folder') != folder_id:
+        continue
+
+      if e['type'] == 'FolderCompletion':
+        if data.get('device') in completion:
+          completion[data['device']] = data['completion']
+
+      elif e['type'] == 'FolderScanProgress':
+        state['state'] = 'scanning'
+
+      elif e['type'] == 'StateChanged':
+        state['state'] = data.get('to')
+
+        # What the scan found is only reflected in completion after it
+        if data.get('from') == 'scanning' and not state['scanned']:
+          state['scanned'] = True
+          completion.update(self.device_completion(folder_id, devices))
+
+      yield progress()
+
+      if done():
+        return
   
   def live_update(self):
-    
+    '''
+      Bring the device lists of shared directories up to date: a
+      server writes its folders' devices to their .kodrive directory,
+      a client applies what its servers wrote there to config.xml.
+      Only directories that changed since the last run are touched,
+      see utils/live_state.py.
+    '''
     kodrive_config = self.adapter.get_config()
     directories = kodrive_config['directories']
+    state = live_state.LiveState(self.adapter.app_conf_dir)
 
     # Behave differently depending on whether if folder was linked
     if kodrive_config['system']['server']:
       if self.ping():
-        config = self.get_config()
-        for key in directories:
-          d = directories[key]
-          
-          # If the folder was self-added
-          if not d['is_shared']:
-            folder = self.adapter.find_folder(d['local_path'])
-            self.adapter.broadcast_folder_info(
-              d['local_path'], 
-              devices=folder['devices']
-            )
+        self.broadcast_devices(directories, state)
     else:
+      self.apply_devices(directories, state)
 
-      for key in directories:
-        d = directories[key]
+    state.save()
 
-        if d['server']:
-          folder = self.adapter.find_folder(d['local_path'])
-          if not folder:
-            raise custom_errors.FileNotInConfig(d['local_path'])
+  def broadcast_devices(self, directories, state):
+    folders = self.adapter.get_folder_map()
 
-          st_util.update_devices(folder)
-          self.adapter.set_folder(folder)
-        
-        # Only continue if folder was from a server
-        #if d['server']:
-        #  for i, f in enumerate(config['folders']):
-        #    if f['path'].strip('/') == d['local_path'].strip('/'):
-        #      st_util.update_devices(config['folders'][i])
+    for d in directories.values():
+
+      # Only folders that were self-added
+      if d['is_shared']:
+        continue
+
+      path = d['local_path']
+      folder = folders.get(path.rstrip('/'))
+
+      if not folder:
+        continue
+
+      digest = live_state.devices_hash(folder['devices'])
+      conf_path = os.path.join(path, '.kodrive', 'config.json')
+
+      if state.get(path, 'broadcast') == digest and os.path.exists(conf_path):
+        continue
+
+      self.adapter.broadcast_folder_info(path, devices=folder['devices'])
+      state.set(path, 'broadcast', digest)
+
+  def apply_devices(self, directories, state):
+    # config.xml is only parsed, and written once, if a folder changed
+    folders = None
+    updates = []
+
+    for d in directories.values():
+
+      # Only folders from a server
+      if not d['server']:
+        continue
+
+      path = d['local_path']
+      signature = live_state.file_signature(os.path.join(path, '.kodrive', 'config.json'))
+
+      if signature is None or state.get(path, 'applied') == signature:
+        continue
+
+      if folders is None:
+        folders = self.adapter.get_folder_map()
+
+      folder = folders.get(path.rstrip('/'))
+      if not folder:
+        raise custom_errors.FileNotInConfig(path)
+
+      if st_util.update_devices(folder):
+        updates.append(folder)
+
+      state.set(path, 'applied', signature)
+
+    if updates:
+      self.adapter.set_folders(updates)
         
   ###
   # 
   # @@port => having syncthing listen to this port
   # @@speed => reconnection speed, 1 = fastest, 2 = medium, 3 = slow
+  # @@unix_socket => serve the local API on this unix socket (client only)
   #
   def start(self, **kwargs):    
     path = self.adapter.get_syncthing_path()
@@ -199,7 +740,8 @@ class SyncthingFacade():
     st_conf = self.adapter.st_conf_file
     app_conf = self.adapter.app_conf_file
 
-    self.adapter.init_configs(st_conf, app_conf, **kwargs)
+    # Options only take effect after a restart
+    restart = self.adapter.init_configs(st_conf, app_conf, **kwargs)
 
     # Initialize kodrive in one of two modes
     if kwargs['server']:
@@ -207,13 +749,20 @@ class SyncthingFacade():
     elif kwargs['client']:
       init_client = self.make_client
 
-    if init_client != None:
+    # A GUI socket only makes sense for a local client
+    socket_path = kwargs.get('unix_socket')
+    if socket_path and not kwargs['server']:
+      init_client = self.make_client
+
+    if init_client == self.make_client and socket_path:
+      init_client(socket_path=socket_path, restart=restart)
+    elif init_client != None:
       if 'port' in kwargs:
-        init_client(kwargs['port'])
+        init_client(kwargs['port'], restart=restart)
       else:
-        init_client()
+        init_client(restart=restart)
 
-    return True if self.wait_start(0.5, 20, verbose=True) else False
+    return True if self.wait_start(0.5, 20, verbose=True, startup=True) else False
   
   def shutdown(self):
     try:
@@ -277,7 +826,18 @@ class SyncthingFacade():
     # if the app is in server or client mode
     if (not client and system['server']) or server:
       api_key = self.adapter.get_api_key()
-      key = "%s@%s@%s" % (devid, path, api_key)
+
+      # Clients reach our API over HTTPS, pinned to this certificate
+      config_path = self.adapter.st_conf_file
+      port = self.adapter.get_gui_address(config_path).split(':')[-1]
+      fingerprint = None
+      if self.adapter.get_gui_tls(config_path):
+        fingerprint = self.adapter.get_gui_fingerprint(config_path)
+
+      if not fingerprint:
+        raise custom_errors.GuiCertMissing()
+
+      key = "%s@%s@%s@%s@%s" % (devid, path, api_key, port, fingerprint)
     else:
       folder_config = self.adapter.find_folder(path) 
 
@@ -300,13 +860,27 @@ class SyncthingFacade():
   def random(self):
     return self.sync.misc.random()['random']
 
+  def events(self, types=None, since=None, **kwargs):
+    '''
+      Subscribe to the daemon's event stream, see EventStream
+    '''
+    return self.sync.events(types=types, since=since, **kwargs)
+
+  def wait_event(self, types, predicate=None, timeout=30, since=None):
+    '''
+      Block until an event of one of types (matching predicate) arrives,
+      returns the event or None if timeout seconds pass first
+    '''
+    stream = self.events(types, since=since)
+    return stream.wait_for(predicate, timeout)
+
 # UTILS (Should be moved to its own class)
   
   def wait_sync(self, t, intervals, callback=None):
     count = 0 
 
     while not self.config_in_sync() and count < intervals:
-      time.sleep(t)
+      instrument.sleep(t, 'wait_sync')
       count += 1
 
     if count < intervals:
@@ -318,6 +892,12 @@ class SyncthingFacade():
       return False
 
   def wait_start(self, t, intervals, **kwargs):
+    '''
+      Wait up to t * intervals seconds for the daemon to be ready, see
+      Readiness; with startup=True also for it to finish starting up.
+      Probes back off exponentially from a few tens of milliseconds up to
+      t, so an already running daemon is detected almost immediately.
+    '''
     
     if 'callback' in kwargs:
       callback = kwargs['callback'] 
@@ -329,54 +909,45 @@ class SyncthingFacade():
     else:
       verbose = False
 
-    # Base case
-    if intervals <= 0:
-      if verbose:  
-        click.echo("", err=True)
-      try:
-        config = self.get_config()
-        return True if config else False
-      except Exception:
-        return False 
-
-    count = 0
-    while count < intervals:
-      if self.ping():
-        break
+    started = time.time()
+    ticks = [0]
 
-      time.sleep(t)
-      count += 1
+    # Print one '~' per t seconds waited, not one per probe
+    def on_retry(attempt, delay):
+      if not verbose:
+        return
 
-      if verbose:
-        if count == 1:
+      tick = int((time.time() - started) / t) + 1
+      while ticks[0] < tick:
+        if ticks[0] == 0:
           click.echo("Attempting to connect ", err=True, nl=False)
         else:
           click.echo("~", err=True, nl=False)
-            
-    c = True
+        ticks[0] += 1
 
-    try:
-      config = self.get_config()
-
-      if not config:
-        c = False
-    except Exception:
-      c = False
+    # Kept for its failed_stage and latency
+    self.last_readiness = readiness.Readiness(
+      getattr(self, 'sync', None), retry.RetryPolicy(cap=t))
+    ok = self.last_readiness.wait(
+      t * intervals, kwargs.get('startup', False), on_retry)
 
-    if not c:
-      self.wait_start(t, intervals - count, **kwargs)
-    else:
+    if ticks[0] > 0:
+      click.echo("", err=True)
 
-      if count < intervals:
-        if count > 0 and verbose:
-            click.echo("", err=True)
+    if ok and callback:
+      callback()
 
-        if callback:
-          callback()
+    return ok
 
-        return True
-      else:
-        return False
+  def probe(self):
+    '''
+      Liveness check used while waiting on the daemon; unlike ping it is
+      not short-circuited by the circuit breaker
+    '''
+    try:
+      return self.sync.probe()
+    except Exception:
+      return False
 
   def decode_key(self, encoded_key):
 
@@ -390,7 +961,8 @@ class SyncthingFacade():
         'devid' : toks[0],
         'remote_path' : toks[1],
         'api_key' : toks[2],
-        'port' : toks[3] if len(toks) > 3 else None
+        'port' : toks[3] if len(toks) > 3 else None,
+        'fingerprint' : toks[4] if len(toks) > 4 and toks[4] else None
       }
     except Exception as e:
       pass
@@ -407,49 +979,118 @@ class SyncthingFacade():
     except Exception as e:
       pass
 
+  def discovery_cache(self):
+    adapter = getattr(self, 'adapter', None)
+
+    if not adapter:
+      return None
+
+    return discovery_cache.DiscoveryCache(adapter.app_conf_dir)
+
   def devid_to_ip(self, devid, wait = True):
+    '''
+      Host of devid: from the discovery cache if it is known, else from
+      the daemon's connections and discovery, waiting up to 10 seconds
+      for it to show up if wait is set
+    '''
+    cache = self.discovery_cache()
+
+    if cache:
+      host = cache.get(devid)
+
+      if host:
+        # Keep the cache current for next time, see finish_cache_refresh
+        self._cache_refresh = cache.refresh_in_background(self.sync)
+        return host
 
     if not wait:
-      try:
-        discovery = self.sync.sys.discovery()
+      return self.discover(devid, cache)
 
-        if not devid in discovery:
-          return None
+    found = []
+    retries = []
 
-        else:
-          address = discovery[devid]['addresses']
-            
-          for e in address:
-            if 'tcp://' in e:
-              href = e
-              break
+    def discovered():
+      host = self.discover(devid, cache)
+      if host:
+        found.append(host)
+      return host is not None
 
-          return href.split('/')[2].split(':')[0]
-      except Exception:
-        return None
-    else:
-      count = 1
-      host = None
+    def on_retry(attempt, delay):
+      retries.append(attempt)
+      if attempt == 1:
+        click.echo("Attempting to discover device ", nl=False)
+      else:
+        click.echo("~", nl=False)
+
+    # Wait for changes to take effect
+    policy = retry.RetryPolicy(base=0.05, cap=1.0)
+    if not policy.wait_until(discovered, 10, on_retry):
+      # An expired address beats none at all
+      return cache.get(devid, stale=True) if cache else None
+
+    if retries:
+      click.echo("\nDevice successfully discovered!")
+
+    return found[0]
+
+  def finish_cache_refresh(self, timeout=CACHE_REFRESH_TIMEOUT):
+    '''
+      Give a background refresh started by devid_to_ip a chance to
+      finish, it would die with the process
+    '''
+    thread, self._cache_refresh = self._cache_refresh, None
+
+    if thread:
+      thread.join(timeout)
+
+  def connect_device(self, device_id, api_key, host=None, wait=True, **kwargs):
+    '''
+      SyncthingProxy for device_id at host, or at its discovered host.
+      A cached host that does not answer is evicted and the device
+      discovered again.
+    '''
+    if host:
+      return SyncthingProxy(device_id, host, api_key, **kwargs)
+
+    cache = self.discovery_cache()
+    cached = cache.get(device_id) if cache else None
+
+    try:
+      host = self.devid_to_ip(device_id, wait)
+
+      if not host:
+        raise custom_errors.DeviceNotFound('remote device')
+
+      try:
+        return SyncthingProxy(device_id, host, api_key, **kwargs)
+      except IOError:
+        if host != cached:
+          raise
 
-      # Wait for changes to take effect
-      while count <= 10:
+        # The refresh could write the address back
+        self.finish_cache_refresh()
+        cache.evict(device_id)
 
-        host = self.devid_to_ip(devid, False)           
+        host = self.devid_to_ip(device_id, wait)
 
         if not host:
-          if count == 1:  
-            click.echo("Attempting to discover device ", nl=False)
-          else:
-            click.echo("~", nl=False)
+          raise custom_errors.DeviceNotFound('remote device')
 
-          time.sleep(1)
-          count += 1
-        else:
-          if count > 1:
-            click.echo("\nDevice successfully discovered!")
-          
-          return host
+        return SyncthingProxy(device_id, host, api_key, **kwargs)
+    finally:
+      self.finish_cache_refresh()
+
+  def discover(self, devid, cache=None):
+    '''
+      Ask the daemon for devid's host once, recording what it knows in cache
+    '''
+    try:
+      if cache:
+        return cache.refresh(self.sync).get(devid)
 
+      discovery = self.sync.sys.discovery()
+      return discovery_cache.hosts_from_discovery(discovery).get(devid)
+    except Exception:
       return None
 
   def new_device(self, **kwargs):
@@ -466,23 +1107,14 @@ class SyncthingFacade():
       'address' : ['dynamic']
     }
     
-    config = kwargs['config']
-
-    if not config['devices']:
-      config['devices'] = []
-    
-    config['devices'].append(record)
+    config_index.index_for(kwargs['config']).add_device(record)
   
   ###
   # 
   # Checks whether device exists in config['devices']
   #
   def device_exists(self, client_devid, config=None):
-
-    if not config:
-      config = self.get_config()       
-
-    return self.find_device(client_devid, config) != None
+    return self.find_device(client_devid, config) is not None
 
   ###
   #
@@ -491,97 +1123,37 @@ class SyncthingFacade():
   def find_device(self, client_devid, config=None):
       
     if not config:
+      # Just the one device rather than the whole config
+      if self._transaction is None and self.has_config_api():
+        device = self.sync.config.device(id=client_devid)
+        return device if isinstance(device, dict) else None
+
       config = self.get_config()
 
-    for d in config['devices']:
-      device_id = self.get_devid(d)
-      
-      if device_id == client_devid:
-        return d
+    return config_index.index_for(config).device(client_devid)
 
   def delete_device(self, devid, config):
-    devices = config['devices']
-
-    for i, d in enumerate(devices):
-      device_id = self.get_devid(d)
-      
-      if device_id == devid:
-        del devices[i]
-        return True
-
-    return False
+    return config_index.index_for(config).delete_device(devid)
 
   def delete_device_from_folder(self, path, devid, config):
-    # list of folders
-    folders = config['folders']
-
-    for i, f in enumerate(folders):
-      if path.rstrip('/') == f['path'].rstrip('/'):
-        for n, d in enumerate(f['devices']):
-          device_id = self.get_devid(d)
-
-          if device_id == devid:
-            del folders[i]['devices'][n]
-            return True
-
-    return False
+    return config_index.index_for(config).delete_device_from_folder(path, devid)
 
   def delete_folder(self, path, config):
-    # list of folders
-    folders = config['folders']
-    
-    for i, f in enumerate(folders):
-      if path.rstrip('/') == f['path'].rstrip('/'):
-        del folders[i]
-        return True
-
-    return False
+    return config_index.index_for(config).delete_folder(path) is not None
 
   def find_folder(self, object, config=None):
     
     if not config:
       config = self.get_config()
     
-    # list of folders
-    folders = config['folders']
-    
-    for f in folders:
-      n = 0
-      d = 0
-
-      for k in object:
-
-        if k == 'path':
-          if object[k].rstrip('/') == f[k].rstrip('/'):
-            n += 1
-        else: 
-          if object[k] == f[k]:
-            n += 1
-
-        d += 1
-
-      if n == d:
-        return f 
+    return config_index.index_for(config).find_folder(object)
 
   def device_exists_in_folder(self, path, devid, config=None):
 
     if not config:
       config = self.get_config()
 
-    folder = self.find_folder({
-      'path' : path
-    }, config)
-
-    if not folder:
-      return False
-
-    for d in folder['devices']:
-      device_id = self.get_devid(d)
-
-      if device_id == devid:
-        return True
-
-    return False
+    return config_index.index_for(config).folder_has_device(path, devid)
 
   def folder_exists(self, object, config = None):
     
@@ -623,13 +1195,12 @@ class SyncthingClient(SyncthingFacade):
     devid = self.get_device_id()
     kodrive_config = self.adapter.get_config()
     config = self.get_config()
-    folders = config['folders']
+    index = config_index.index_for(config)
 
-    for f in folders:
-      if f['path'].rstrip('/') == kwargs['path'].rstrip('/'):
-        raise custom_errors.FileExists(kwargs['path'])
+    if index.folder_at(kwargs['path']):
+      raise custom_errors.FileExists(kwargs['path'])
 
-    folders.append({
+    index.add_folder({
       'rescanIntervalS' : kwargs['interval'] if 'interval' in kwargs else 30,
       'copiers' : 0,
       'pullerPauseS' : 0,
@@ -653,10 +1224,7 @@ class SyncthingClient(SyncthingFacade):
       'order' : 'random',
       'versioning' : {'type': '', 'params': {}}
     })
-    self.set_config(config)
-
-    if 'wait' not in kwargs:
-      self.restart()
+    self.set_config(config, 'wait' not in kwargs)
 
     # Save folder data into kodrive config
     self.adapter.set_dir_config({
@@ -671,7 +1239,11 @@ class SyncthingClient(SyncthingFacade):
 
     return config
 
-  def make_server(self, port=None):
+  def make_server(self, port=None, restart=False):
+    '''
+      Serve the GUI on all interfaces over TLS. The daemon is restarted
+      if that changed anything, or if restart is set.
+    '''
     kodrive_config = self.adapter.get_config()
     kodrive_config['system']['server'] = True
     self.adapter.set_config(kodrive_config)
@@ -679,19 +1251,37 @@ class SyncthingClient(SyncthingFacade):
     config_path = self.adapter.st_conf_file
     address = self.adapter.get_gui_address(config_path)
 
-    if not port:
+    # Remote clients need a TCP port; leaving a unix socket picks a free one
+    if not port and unix_socket.parse_address(address):
+      port = self.adapter.get_available_port('0.0.0.0', 8384)
+    elif not port:
       port = address.split(':')[1]
 
     gui_address = "0.0.0.0:%s" % str(port)
-    self.adapter.set_gui_address(config_path, gui_address)
+    changed = self.adapter.set_gui_address(config_path, gui_address)
 
-    if port or self.ping():
+    # Exposed beyond localhost, so serve the API over TLS only
+    changed = self.adapter.set_gui_tls(config_path, True) or changed
+    changed = changed or restart
+
+    # Already serving there, no restart needed
+    if changed and (port or self.ping()):
       self.wait_start(0.5, 10)
-      self.restart()
+      self.restart(wait=True)
+
+    # The daemon generates its GUI certificate as it starts; the hook is
+    # pinned to it, so wait for it rather than talk plain HTTP meanwhile
+    has_cert = lambda: self.adapter.get_gui_fingerprint(config_path) is not None
+    retry.RetryPolicy(base=0.05, cap=0.5).wait_until(has_cert, GUI_CERT_TIMEOUT)
 
     self.sync = self.adapter.get_gui_hook()
 
-  def make_client(self, port=None):
+  def make_client(self, port=None, socket_path=None, restart=False):
+    '''
+      Bind the GUI to localhost only, or to the unix socket at socket_path.
+      A client already on a socket stays there unless a port is given.
+      The daemon is restarted if that changed anything, or if restart is set.
+    '''
     kodrive_config = self.adapter.get_config()
     kodrive_config['system']['server'] = False
     self.adapter.set_config(kodrive_config)
@@ -699,18 +1289,29 @@ class SyncthingClient(SyncthingFacade):
     config_path = self.adapter.st_conf_file
     address = self.adapter.get_gui_address(config_path)
 
-    if not port:
-      port = address.split(':')[1]
+    if not port and not socket_path:
+      socket_path = unix_socket.parse_address(address)
+
+    if socket_path:
+      gui_address = unix_socket.SCHEME + os.path.abspath(socket_path)
+    else:
+      if not port:
+        port = address.split(':')[1]
 
-    gui_address = "127.0.0.1:%s" % port
-    self.adapter.set_gui_address(config_path, gui_address)
+      gui_address = "127.0.0.1:%s" % port
 
-    self.wait_start(0.5, 10)
-    if self.ping():
-      self.restart()
+    changed = self.adapter.set_gui_address(config_path, gui_address)
+    changed = self.adapter.set_gui_tls(config_path, False) or changed
+    changed = changed or restart
+
+    if changed:
+      self.wait_start(0.5, 10)
+      if self.ping():
+        self.restart(wait=True)
 
     self.sync = self.adapter.get_gui_hook()
 
+  @transactional
   def link(self, **kwargs):
 
     """
@@ -738,6 +1339,10 @@ class SyncthingClient(SyncthingFacade):
     api_key = kwargs['api_key']
     local_path = kwargs['local_path']
     remote_path = kwargs['remote_path']
+
+    # Servers are only ever reached over pinned HTTPS
+    if not kwargs.get('remote_fingerprint'):
+      raise custom_errors.UnpinnedKey()
     
     # Check if the device id is valid
     if 'error' in self.sync.misc.device_id(id=device_id):
@@ -751,40 +1356,43 @@ class SyncthingClient(SyncthingFacade):
     if not self.device_exists(device_id):
       self.new_device(config=config, device_id=device_id)
       self.set_config(config, True)
-    
-    if 'remote_host' in kwargs:
-      host = kwargs['remote_host']
-    else:
-      host = self.devid_to_ip(device_id)
-
-    if not host:
-      raise custom_errors.DeviceNotFound('remote device')
 
+      # Post the device now so it can be discovered below,
+      # the restart waits for the end of the transaction
+      self._transaction.flush()
+    
     # Request remote to share its folder with us
-    remote = SyncthingProxy(
-      device_id, host, api_key, 
-      port=kwargs['remote_port'] if 'remote_port' in kwargs else None)
+    remote = self.connect_device(
+      device_id, api_key, kwargs.get('remote_host'),
+      port=kwargs['remote_port'] if 'remote_port' in kwargs else None,
+      fingerprint=kwargs['remote_fingerprint'] if 'remote_fingerprint' in kwargs else None)
+    host = remote.host
     
     # Request folder will set and restart the remote 
     remote_hostname, remote_folder = remote.request_folder(
       self.hostname(), self.get_device_id(), remote_path)
+
+    # Reached it, so the address is good for next time
+    cache = self.discovery_cache()
+    if cache:
+      cache.update({device_id : host})
      
     # Determine folder label
     label = kwargs['tag'] if 'tag' in kwargs else None
     label = label or remote_folder['label']
     
     # Save the folder data into syncthing config
-    self.wait_start(0.25, 20) # Wait for the self.restart
     self.acknowledge(
       device_id=device_id, api_key = api_key,
       hostname=remote_hostname, 
       folder_obj=remote_folder, label=label,
       local_path=local_path, remote_path=remote_folder['path'],
-      host=remote.host, port=remote.port,
+      host=remote.host, port=remote.port, fingerprint=remote.fingerprint,
       server=True, interval=kwargs['interval'])
     
     return label
 
+  @transactional
   def acknowledge(self, **kwargs):
 
     """
@@ -829,7 +1437,7 @@ class SyncthingClient(SyncthingFacade):
       raise ValueError('This folder has already been added.')
     
     # Modify syncthing config
-    config['folders'].append(remote_folder)
+    config_index.index_for(config).add_folder(remote_folder)
     config['label'] = kwargs['label']
 
     self.new_device(config=config, device_id=device_id)
@@ -850,7 +1458,8 @@ class SyncthingClient(SyncthingFacade):
       'host' : kwargs['host'] if 'host' in kwargs else None,
 
       'remote_path': kwargs['remote_path'] if 'remote_path' in kwargs else '',
-      'port' : kwargs['port'] if 'port' in kwargs else None
+      'port' : kwargs['port'] if 'port' in kwargs else None,
+      'fingerprint' : kwargs['fingerprint'] if 'fingerprint' in kwargs else None
     }) 
     
     self.set_config(config)
@@ -865,37 +1474,40 @@ class SyncthingClient(SyncthingFacade):
     '''
         
     # Process local ~~~
+    # Both configs are committed together when the block exits
 
-    # 1. Syncthing config
-    config = self.get_config()
+    with self.transaction():
 
-    # Check whether folders are still connected to this device 
-    folder = st_util.find_folder_with_path(local_path, config)
-    self.delete_folder(local_path, config)
-    pruned = st_util.prune_devices(folder, config)
-        
-    # Done processing st config, commit :)
-    self.set_config(config)
-    
-    if pruned:
-      self.restart()
+      # 1. Syncthing config
+      config = self.get_config()
 
-    # 2. App config
-    dir_config = self.adapter.get_dir_config(local_path)
+      # Check whether folders are still connected to this device 
+      folder = st_util.find_folder_with_path(local_path, config)
+      self.delete_folder(local_path, config)
+      pruned = st_util.prune_devices(folder, config)
+          
+      # Done processing st config
+      self.set_config(config)
+      
+      if pruned:
+        self.restart()
 
-    if not dir_config:
-      raise custom_errors.FileNotInConfig(local_path)
+      # 2. App config
+      dir_config = self.adapter.get_dir_config(local_path)
 
-    kodrive_config = self.adapter.get_config()
+      if not dir_config:
+        raise custom_errors.FileNotInConfig(local_path)
 
-    for key in kodrive_config['directories']: 
-      d = kodrive_config['directories'][key]
-      if d['local_path'].rstrip('/') == local_path.rstrip('/'):
-        del kodrive_config['directories'][key]
-        break
-    
-    # Done process app config, commit :)
-    self.adapter.set_config(kodrive_config)
+      kodrive_config = self.adapter.get_config()
+
+      for key in kodrive_config['directories']: 
+        d = kodrive_config['directories'][key]
+        if d['local_path'].rstrip('/') == local_path.rstrip('/'):
+          del kodrive_config['directories'][key]
+          break
+      
+      # Done process app config
+      self.adapter.set_config(kodrive_config)
 
     # If the folder was shared, try remove data from remote 
     if dir_config['is_shared'] and dir_config['server']:
@@ -904,16 +1516,12 @@ class SyncthingClient(SyncthingFacade):
       r_api_key = dir_config['api_key']
       r_device_id = dir_config['device_id']
 
-      if dir_config['host']:
-        host = dir_config['host']
-      else:
-        host = self.devid_to_ip(r_device_id, False)
-      
       try:
         # Create remote proxy to interact with remote
-        remote = SyncthingProxy(
-          r_device_id, host, r_api_key,
-          port=dir_config['port'] if 'port' in dir_config else None
+        remote = self.connect_device(
+          r_device_id, r_api_key, dir_config['host'], False,
+          port=dir_config['port'] if 'port' in dir_config else None,
+          fingerprint=dir_config['fingerprint'] if 'fingerprint' in dir_config else None
         )
       except Exception as e:
         return True
@@ -922,16 +1530,18 @@ class SyncthingClient(SyncthingFacade):
       r_folder = st_util.find_folder_with_path(
         dir_config['remote_path'], r_config
       )
+
+      # Devices the folder was shared with before we leave it
+      r_devices = list(r_folder['devices']) if r_folder else []
       
       # Delete device id from folder
-      r_config = remote.get_config()
       self_devid = self.get_device_id()
       del_device = remote.delete_device_from_folder(
         dir_config['remote_path'], self_devid, r_config
       )
 
       # Check to see if no other folder depends has this device
-      pruned = st_util.prune_devices(r_folder, r_config)
+      pruned = st_util.prune_devices({'devices' : r_devices}, r_config)
             
       remote.set_config(r_config)
 
@@ -968,147 +1578,251 @@ class SyncthingClient(SyncthingFacade):
 
     return old_name
   
-  def ls(self): 
-
-    metadata = [
-      {'Tag' : [],},
-      {'Path' : []}
-    ]
-
+  def ls_entries(self):
+    '''
+      [{'tag', 'path'}] for every synchronized directory, sorted by
+      path; the Syncthing config is only fetched, once, if a tag is
+      missing from config.json
+    '''
     config = self.adapter.get_config()
 
     if not config:
-      return None
+      return []
 
-    dirs = config['directories']
+    index = None
+    entries = []
 
-    # For each directory 
-    for key, value in dirs.iteritems(): 
+    for key, value in config['directories'].iteritems():
+      tag = value['label']
 
-      if value['label']:
-        metadata[0]['Tag'].append(value['label'])
+      if not tag:
+        if index is None:
+          index = config_index.index_for(self.get_config())
 
-      else:
-        syncthing_config = self.get_config()
-        folders = syncthing_config['folders']
+        f = index.folder_at(value['local_path'])
+        tag = f['label'] if f else None
+
+      entries.append({
+        'tag' : tag or '',
+        'path' : value['local_path']
+      })
+
+    entries.sort(key=lambda e: e['path'])
+    return entries
+
+  def ls(self, long=False, entries=None):
+    '''
+      Yield ls_entries() as they are ready; with long, each also gets
+      the folder 'id', its 'state', 'need_bytes' and 'last_scan'. The
+      config and folder stats are fetched once, folder states LS_BATCH
+      at a time concurrently.
+    '''
+    if entries is None:
+      entries = self.ls_entries()
+
+    if not long:
+      for e in entries:
+        yield e
+      return
+
+    index = config_index.index_for(self.get_config())
+    stats = self.sync.stats.folder()
+
+    if not isinstance(stats, dict):
+      stats = {}
+
+    for start in range(0, len(entries), LS_BATCH):
+      chunk = entries[start:start + LS_BATCH]
+      folders = [index.folder_at(e['path']) for e in chunk]
 
-        for f in folders:
-          if value['local_path'] + '/' == f['path']:
-            value['label'] = f['label']
-            metadata[0]['Tag'].append(f['label'])
-      # Edge case: fails if label is None, get label from syncthing_config
+      results = self.sync.batch([
+        (self.sync.db.status, {'folder' : f['id']}) for f in folders if f
+      ])
+      results.reverse()
 
-      metadata[1]['Path'].append(value['local_path'])
+      for e, f in zip(chunk, folders):
+        status = results.pop().value if f else None
 
-    return metadata
+        if not isinstance(status, dict):
+          status = {}
 
-  def rename(self, source, target):
+        scanned = stats.get(f['id']) if f else None
+
+        e = dict(e)
+        e.update({
+          'id' : f['id'] if f else None,
+          'state' : status.get('state'),
+          'need_bytes' : status.get('needBytes'),
+          'last_scan' : scanned.get('lastScan') if scanned else None
+        })
+
+        yield e
+
+  def rename(self, source, target, workers=None, progress=None, keep_id=True):
     source = ''.join(source)
 
     if not os.path.exists(source):
       raise custom_errors.NoFileOrDirectory(source, target)
 
-    source_path = os.path.abspath(source)
-    target_path = os.path.abspath(target)
-    syncthing_config = self.get_config()
+    source_path = os.path.abspath(source).rstrip('/')
+    target_path = os.path.abspath(target).rstrip('/')
 
-    folders = syncthing_config['folders']
-    old_key = self.adapter.get_dir_id(source_path)
-    new_key = self.adapter.get_dir_id(target_path)
-    found = False
-    path = None
+    if not self.find_folder({'path' : source_path}, self.get_config()):
+      raise custom_errors.FileNotInConfig(source_path)
 
-    # Modify config.xml
-    for f in folders:
-      if source_path == os.path.abspath(f['path']):
+    return self.relocate([(source_path, target_path)], workers, progress, keep_id)
 
-        f['id'] = new_key
+  def move(self, source, target, workers=None, progress=None, keep_id=True):
+    target_path = os.path.abspath(target)
+    moves = []
 
-        path = source_path[:-len(source)]
-        f['path'] = os.path.join(path, target)
+    # Each item goes into target
+    for item in source:
+      item_path = os.path.abspath(item).rstrip('/')
+      final_path = os.path.join(target_path, os.path.basename(item_path))
 
-        if not f['path'][len(f['path']) - 1] == '/':
-          f['path'] += '/'
+      moves.append((item_path, final_path))
 
-        self.set_config(syncthing_config)
-        found = True
-        break
+    return self.relocate(moves, workers, progress, keep_id)
 
-    if not found and os.path.exists(source_path):
-      raise custom_errors.FileNotInConfig(source_path)
-      # if not found but exists
+  def relocate(self, moves, workers=None, progress=None, keep_id=True):
+    '''
+      Move each (source, target) pair, see copy_engine.place, and point
+      the synchronized folders among them to their new paths in one
+      config commit. Nothing is committed if a move fails; sources that
+      had to be copied are removed once the commit is done.
+      progress(done, total) is called as bytes are copied.
+
+      With keep_id the folders keep their ids, so the daemon and its
+      peers only see a new path and need no re-index; they are paused
+      while their data moves. Otherwise each gets an id derived from
+      its new path, which peers have to accept as a new folder.
+    '''
+    with self.transaction() as txn:
+      paused = []
 
-    #Modify config.json
-    kodrive_config = self.adapter.get_config()
-    
-    try:
-      kodrive_config['directories'][new_key] = kodrive_config['directories'][old_key]
-      del kodrive_config['directories'][old_key]
-    except:
-      raise custom_errors.InvalidKey(old_key)
-      
-    if kodrive_config['directories'][new_key]['local_path'] == source_path:
+      if keep_id:
+        paused = self.pause_folders([source for source, target in moves])
 
-      kodrive_config['directories'][new_key]['local_path'] = target_path
-      shutil.move(source_path, os.path.join(path, target))
-      shutil.rmtree(source_path, ignore_errors=True)
-      # renames directories in client's local environment
+        # Paused before their data moves; a restart, if any is needed,
+        # still waits for the commit
+        txn.flush()
 
-      self.adapter.set_config(kodrive_config)
-    
-    # self.restart()
-    return
+      try:
+        self.stage_relocation(moves, keep_id, paused)
+        copies = self.place_moves(moves, workers or copy_engine.DEFAULT_WORKERS, progress)
+      except Exception:
+        txn.discard()
+        self.resume_folders(paused)
+        txn.flush()
+        raise
 
-  def move(self, source, target):
-    target_path = os.path.abspath(target)
+    for tree in copies:
+      tree.finish()
+
+  def stage_relocation(self, moves, keep_id, paused):
+    '''
+      Point the folders among moves to their new paths in config.xml
+      and config.json, resuming those in paused
+    '''
     syncthing_config = self.get_config()
-    folders = syncthing_config['folders']
+    index = config_index.index_for(syncthing_config)
     kodrive_config = self.adapter.get_config()
-    found = False
+    directories = kodrive_config['directories']
 
-    # Modify config.xml
-    for item in source:
-      item_path = os.path.abspath(item)
-      item_path.rstrip('/')
-      found = False
+    for source, target in moves:
+      f = index.folder_at(source)
 
-      for f in folders:
-        if f['path'] == item_path + '/':
+      if not f:
+        continue
 
-          old_key = self.adapter.get_dir_id(item_path)
-          reduced_item = item.rstrip('/')
-          reduced_item = os.path.basename(reduced_item)
-          final_path = os.path.join(target_path, reduced_item)
-          f['path'] = final_path
+      old_key = self.adapter.get_dir_id(source)
+      new_key = self.adapter.get_dir_id(target)
 
-          new_key = self.adapter.get_dir_id(final_path)
-          f['id'] = new_key
+      if keep_id:
+        index.relocate_folder(f, path=target + '/')
+      else:
+        index.relocate_folder(f, path=target + '/', folder_id=new_key)
 
-          if not f['path'][len(f['path']) - 1] == '/':
-            f['path'] += '/'
+      # Resumed by the same commit that moves it
+      if f['id'] in paused:
+        f['paused'] = False
 
-          self.set_config(syncthing_config)
+      try:
+        directories[new_key] = directories.pop(old_key)
+      except KeyError:
+        raise custom_errors.InvalidKey(old_key)
 
-          # Modify config.json
-          try:
-            kodrive_config['directories'][new_key] = kodrive_config['directories'][old_key]
-            del kodrive_config['directories'][old_key]
-          except:
-            raise custom_errors.InvalidKey(old_key)
+      if directories[new_key]['local_path'] == source:
+        directories[new_key]['local_path'] = target
 
-          if kodrive_config['directories'][new_key]['local_path'] == item_path:
-            kodrive_config['directories'][new_key]['local_path'] = final_path
-            self.adapter.set_config(kodrive_config)
+    self.set_config(syncthing_config, True)
+    self.adapter.set_config(kodrive_config)
 
-          found = True
-          break
+  def pause_folders(self, paths):
+    '''
+      Pause the running folders at paths, return their ids
+    '''
+    config = self.get_config()
+    index = config_index.index_for(config)
+    paused = []
 
-      shutil.move(item_path, final_path)
-      # move into target
+    for path in paths:
+      f = index.folder_at(path)
+
+      if f and not f.get('paused'):
+        f['paused'] = True
+        paused.append(f['id'])
+
+    if paused:
+      self.set_config(config, True)
+
+    return paused
+
+  def resume_folders(self, folder_ids):
+    if not folder_ids:
+      return
+
+    config = self.get_config()
+    index = config_index.index_for(config)
+
+    for folder_id in folder_ids:
+      f = index.folder(folder_id)
+
+      if f:
+        f['paused'] = False
+
+    self.set_config(config, True)
+
+  def place_moves(self, moves, workers, progress=None):
+    '''
+      Rename or copy every move's data, return the copies still to be
+      finished. Renames are undone if a later move fails.
+    '''
+    placed = []
+
+    try:
+      for source, target in moves:
+        placed.append((source, target, copy_engine.place(source, target, workers)))
+
+      copies = [tree for source, target, tree in placed if tree]
+      total = sum(tree.total for tree in copies)
+      done = [0]
+
+      def report(n):
+        done[0] += n
+        progress(done[0], total)
+
+      for tree in copies:
+        tree.run(report if progress else None)
+
+      return copies
+    except Exception:
+      for source, target, tree in reversed(placed):
+        if tree is None and os.path.lexists(target) and not os.path.lexists(source):
+          shutil.move(target, source)
+      raise
 
-    # self.restart()
-    return
-  
   # Should not be its own method
   def mv_edge_case(self, source, target):
     os.remove(target)
@@ -1131,6 +1845,7 @@ class SyncthingClient(SyncthingFacade):
 
     return True
 
+  @transactional
   def auth(self, key, path):
     
     # This logic doesn't really make sense,
@@ -1162,8 +1877,6 @@ class SyncthingClient(SyncthingFacade):
     path = os.path.abspath(path)
     kodrive_config = self.adapter.get_config()
     directories = kodrive_config['directories']
-    devices = config['devices']
-    folders = config['folders']
     
     if not path[len(path) - 1] == '/':
       path += '/'
@@ -1186,20 +1899,14 @@ class SyncthingClient(SyncthingFacade):
     if not self.valid_device_id(device_id):
       raise custom_errors.InvalidKey(key)
 
-    client_devid = {
-      u'deviceID' : device_id
-    }
+    index = config_index.index_for(config)
+    folder = index.folder_at(path)
 
-    for f in folders:
-      if f['path'].rstrip('/') == path.rstrip('/'):
-        if client_devid not in f['devices']:
-          f['devices'].append(client_devid)
-        else:
-          raise custom_errors.AuthAlready(name)
-        break
+    if folder and not index.add_device_to_folder(folder, device_id):
+      raise custom_errors.AuthAlready(name)
     # add devid to folder if not already there
 
-    if not self.device_exists(key):
+    if not index.has_device(device_id):
       try:
         self.new_device(config=config, device_id=device_id, hostname=name)
       except:
@@ -1231,8 +1938,6 @@ class SyncthingClient(SyncthingFacade):
     kodrive_config = self.adapter.get_config()
     directories = kodrive_config['directories']
     config = self.get_config()
-    devices = config['devices']
-    folders = config['folders']
 
     if not path[len(path) - 1] == '/':
       path += '/'
@@ -1261,30 +1966,15 @@ class SyncthingClient(SyncthingFacade):
     if not self.valid_device_id(device_id):
       raise custom_errors.InvalidKey(key)
 
-    r_devid = {
-      u'deviceID' : device_id
-    }
-
-    for f in folders:
-      if f['path'] == path:
+    index = config_index.index_for(config)
 
-        if r_devid in f['devices']:
-          f['devices'].remove(r_devid)
-
-        else:
-          raise custom_errors.AuthAlready(name)
-
-        break
+    if not index.delete_device_from_folder(path, device_id):
+      raise custom_errors.AuthAlready(name)
     # remove devid from folder if there
 
-    in_other_folders = False
-
-    for f in folders:
-      if r_devid in f['devices'] and path != f['path']:
-        in_other_folders = True
-        break
+    in_other_folders = len(index.folders_of(device_id)) > 0
 
-    if self.device_exists(device_id) and not in_other_folders:
+    if index.has_device(device_id) and not in_other_folders:
       try:
         self.delete_device(devid=device_id, config=config)
       except:
@@ -1298,69 +1988,28 @@ class SyncthingClient(SyncthingFacade):
 
   # Returns a list of devices authorized to a folder
   # NOTE: This is used in `dir info`
-  def auth_ls(self):
-
-    kodrive_config = self.adapter.get_config()
-    directories = kodrive_config['directories']
-    config = self.get_config()
-    folders = config['folders']
-    body = {}
-    header = str()
-
-    # Length of longest device name
-    max_len = 0
-
-    for f in folders:
-      shared = False  
-       
-      # Check if you own the folder
-      for k, v in directories.iteritems():
-        if f['path'] ==  v['local_path']:
-          shared = v['is_shared']
-
-      # If not your folder, don't display
-      if len(f['devices']) > 1 and not shared:
-
-        for i, val in enumerate(f['devices']):
-
-          if not val['deviceID'] == self.get_device_id():
-
-            r_devid = self.find_device(val['deviceID'], config)
-
-            if not r_devid:
-              raise custom_errors.DeviceNotFound(val['deviceID'])
-
-            # Get encoded remote device keys
-            key = "%s#%s" % (r_devid['name'], val['deviceID'])
-            key = key.encode('base64')
-            key = "".join(key.split())
-
-            # Add remote device's name and key
-            body.update({
-              r_devid['name'] : key
-            })
+  def auth_report(self, config=None, device_id=None, folder_id=None):
+    '''
+      Remote devices authorized on this device's folders, see
+      auth_report.build; only folder_id's if given
+    '''
+    directories = self.adapter.get_config()['directories']
 
-            if r_devid['name'] > max_len:
-              max_len = len(r_devid['name'])
+    if not config:
+      config = self.get_config()
 
-    # This format method allows easy specification of fill length
-    header += '{message: <{fill}}'.format(message='Name', fill=max_len + 5)
-    header += 'Key\n'
+    if not device_id:
+      device_id = self.get_device_id()
 
-    result = header
+    return auth_report.build(config, directories, device_id, folder_id)
 
-    # Append body to header, assign to result
-    if body:
-      for name, key in body.items():
-        result +='{message: <{fill}}'.format(message=name, fill=max_len + 5)
-        result += key + '\n'
+  def auth_ls(self, config=None, device_id=None, folder_id=None, as_json=False):
+    report = self.auth_report(config, device_id, folder_id)
 
-      return result.strip('\n')
+    if as_json:
+      return codec.dumps(report)
 
-    # if body is empty, than no devices have been authorized.
-    else:
-      return 'No devices have been authorized.'
-    
+    return auth_report.format_table(report)
 
   # Sets autostart depending on platform
   def autostart(self):
@@ -1373,8 +2022,15 @@ class SyncthingClient(SyncthingFacade):
 class SyncthingProxy(SyncthingFacade):
 
   port = 8384
+  fingerprint = None
 
   def __init__(self, device_id, host, api_key, **kwargs):
+    '''
+      The remote is reached over HTTPS and must present the certificate
+      fingerprint pins, UnpinnedKey without one; connections are kept
+      alive across calls, so a link or free pays for one handshake rather
+      than one per request
+    '''
     SyncthingFacade.__init__(self)
     
     if not host:
@@ -1382,6 +2038,13 @@ class SyncthingProxy(SyncthingFacade):
 
     if 'port' in kwargs and kwargs['port']:
       self.port = kwargs['port']   
+
+    if 'fingerprint' in kwargs and kwargs['fingerprint']:
+      self.fingerprint = kwargs['fingerprint']
+
+    # Without a pin there is no telling who answers, never fall back to HTTP
+    if not self.fingerprint:
+      raise custom_errors.UnpinnedKey()
     
     self.device_id = device_id
     self.host = host
@@ -1390,7 +2053,10 @@ class SyncthingProxy(SyncthingFacade):
     self.sync = Syncthing(
       api_key=api_key, 
       host=host,
-      port=int(self.port)
+      port=int(self.port),
+      is_https=True,
+      fingerprint=self.fingerprint,
+      share_pool=True
     )
 
     # If remote host can't be detected, throw a tantrum >:/
@@ -1449,6 +2115,87 @@ class SyncthingProxy(SyncthingFacade):
   def disconnect(self):
     return
 
+class AsyncSyncthingFacade(object):
+  '''
+    Non-blocking counterpart of SyncthingFacade for supervising many
+    daemons from one process. Every method returns a future immediately;
+    waits are rescheduled on a shared timer instead of sleeping.
+  '''
+
+  def __init__(self, sync=None, **kwargs):
+    if sync is None:
+      sync = AsyncSyncthing(**kwargs)
+
+    self.sync = sync
+
+  @classmethod
+  def from_adapter(cls, adapter, **kwargs):
+    '''
+      Build a facade for the daemon configured by a platform adapter
+    '''
+    options = adapter.get_gui_hook()._interface.options
+
+    # Same address, transport and pinning as the blocking client
+    settings = dict((name, getattr(options, name)) for name in CONNECTION_OPTIONS)
+    settings['share_pool'] = True
+    settings.update(kwargs)
+
+    return cls(**settings)
+
+  def get_config(self):
+    return self.sync.sys.config()
+
+  def set_config(self, config, restart=False):
+    def commit():
+      status = self.sync.sync.sys.set.config(config)
+      if restart:
+        self.sync.sync.sys.set.restart()
+      return status
+
+    return self.sync.submit(commit)
+
+  def restart(self):
+    return self.sync.sys.set.restart()
+
+  def shutdown(self):
+    return self.sync.sys.set.shutdown()
+
+  def get_device_id(self):
+    return async_client.chain(self.sync.sys.status(), lambda s: s['myID'])
+
+  def ping(self):
+    def alive():
+      try:
+        return type(self.sync.sync.sys.ping()) == dict
+      except Exception:
+        return False
+
+    return self.sync.submit(alive)
+
+  def config_in_sync(self):
+    def in_sync():
+      try:
+        return self.sync.sync.sys.insync()['configInSync']
+      except Exception:
+        return False
+
+    return self.sync.submit(in_sync)
+
+  def wait_start(self, t, intervals):
+    '''
+      Resolves to True once the daemon answers pings, False after
+      t * intervals seconds
+    '''
+    return async_client.poll_until(
+      self.ping, bool, t, time.time() + t * intervals, self.sync.scheduler)
+
+  def wait_sync(self, t, intervals):
+    return async_client.poll_until(
+      self.config_in_sync, bool, t, time.time() + t * intervals, self.sync.scheduler)
+
+  def close(self):
+    self.sync.close()
+
 def get_handler(home=None):
   
   system = platform.system()
@@ -0,0 +1,99 @@
+###
+#
+# Which remote devices are authorized on which folders
+#
+# Built in one pass over the folders, with devices looked up through a
+# ConfigIndex and the folders kodrive was linked into (shared with us,
+# not ours to authorize) kept in a set of paths, so a report is
+# O(folders + folder devices) instead of a scan of every device and
+# every kodrive directory per folder device.
+#
+
+from . import config_index
+from ..data import custom_errors
+
+# "name#devid" -> base64 key, device keys never change
+_keys = {}
+
+def device_key(name, devid):
+  '''
+    The key `kodrive auth` accepts for a device
+  '''
+  plain = "%s#%s" % (name, devid)
+
+  if plain not in _keys:
+    _keys[plain] = "".join(plain.encode('base64').split())
+
+  return _keys[plain]
+
+def linked_paths(directories):
+  '''
+    Normalized local paths of the directories shared with this device
+  '''
+  return set(
+    config_index.normalize_path(d['local_path'])
+    for d in directories.values() if d.get('is_shared')
+  )
+
+def build(config, directories, device_id, folder_id=None):
+  '''
+    Return [{'name', 'device_id', 'key', 'folders'}] for every remote
+    device authorized on a folder this device owns, sorted by name;
+    only folder_id's devices if given
+  '''
+  index = config_index.index_for(config)
+  linked = linked_paths(directories)
+
+  if folder_id is not None:
+    folder = index.folder(folder_id)
+    folders = [folder] if folder else []
+  else:
+    folders = config.get('folders') or []
+
+  report = {}
+
+  for f in folders:
+    devices = f.get('devices') or []
+
+    # Folders with only ourselves, or that were shared with us
+    if len(devices) < 2 or config_index.normalize_path(f['path']) in linked:
+      continue
+
+    for d in devices:
+      devid = config_index.get_devid(d)
+
+      if devid == device_id:
+        continue
+
+      if devid not in report:
+        device = index.device(devid)
+
+        if not device:
+          raise custom_errors.DeviceNotFound(devid)
+
+        report[devid] = {
+          'name' : device['name'],
+          'device_id' : devid,
+          'key' : device_key(device['name'], devid),
+          'folders' : []
+        }
+
+      report[devid]['folders'].append(f['id'])
+
+  return sorted(report.values(), key=lambda r: (r['name'], r['device_id']))
+
+def format_table(report):
+  '''
+    Name and key columns, one row per device
+  '''
+  if not report:
+    return 'No devices have been authorized.'
+
+  # This format method allows easy specification of fill length
+  fill = max(len(r['name']) for r in report) + 5
+
+  rows = ['{message: <{fill}}Key'.format(message='Name', fill=fill)]
+  for r in report:
+    rows.append('{message: <{fill}}{key}'.format(message=r['name'], fill=fill, key=r['key']))
+
+  return '\n'.join(rows)
@@ -0,0 +1,107 @@
+###
+#
+# Structural diff of config snapshots
+#
+# Compares two Syncthing configs (or two kodrive config.json objects) and
+# lists what changed, so a commit can be skipped when nothing did and a
+# restart when only live-applied sections did.
+#
+# Lists of folders and devices are matched by id rather than position,
+# so reordering them is not a change and a changed folder is reported
+# once under its id instead of shifting every entry after it.
+#
+
+from collections import namedtuple
+
+# op is 'add', 'remove' or 'change'; path is a tuple of keys from the
+# config root, list items are keyed by their id
+Change = namedtuple('Change', ['op', 'path', 'old', 'new'])
+
+# Keys identifying the items of a list
+ITEM_KEYS = ('id', 'deviceID', 'deviceId')
+
+# Top-level sections Syncthing only applies on restart; devices are
+# applied live
+RESTART_SECTIONS = ('folders', 'gui', 'options')
+
+def diff(old, new, path=()):
+  '''
+    List the changes that turn old into new
+  '''
+  if isinstance(old, dict) and isinstance(new, dict):
+    return _diff_dicts(old, new, path)
+
+  if isinstance(old, list) and isinstance(new, list):
+    old_items = _keyed(old)
+    new_items = _keyed(new)
+
+    if old_items is not None and new_items is not None:
+      return _diff_dicts(old_items, new_items, path)
+
+  if old != new:
+    return [Change('change', path, old, new)]
+
+  return []
+
+def _diff_dicts(old, new, path):
+  changes = []
+
+  for key in old:
+    if key not in new:
+      changes.append(Change('remove', path + (key,), old[key], None))
+    elif old[key] != new[key]:
+      changes.extend(diff(old[key], new[key], path + (key,)))
+
+  for key in new:
+    if key not in old:
+      changes.append(Change('add', path + (key,), None, new[key]))
+
+  return changes
+
+def _item_key(item):
+  if isinstance(item, dict):
+    for k in ITEM_KEYS:
+      if k in item:
+        return item[k]
+
+  return None
+
+def _keyed(items):
+  '''
+    Map list items by id; None if they are not all uniquely keyed
+  '''
+  keyed = {}
+
+  for item in items:
+    key = _item_key(item)
+
+    if key is None or key in keyed:
+      return None
+
+    keyed[key] = item
+
+  return keyed
+
+def requires_restart(changes):
+  '''
+    True if Syncthing needs a restart to apply changes
+  '''
+  return any(c.path and c.path[0] in RESTART_SECTIONS for c in changes)
+
+def describe(changes):
+  '''
+    One line per change, for logs
+  '''
+  lines = []
+
+  for c in changes:
+    key = '.'.join(str(p) for p in c.path)
+
+    if c.op == 'add':
+      lines.append('+ %s' % key)
+    elif c.op == 'remove':
+      lines.append('- %s' % key)
+    else:
+      lines.append('~ %s: %r -> %r' % (key, c.old, c.new))
+
+  return '\n'.join(lines)
@@ -0,0 +1,241 @@
+###
+#
+# Indexed view over a Syncthing config
+#
+# Lookups on the raw config are linear scans over config['folders'] and
+# config['devices']. ConfigIndex maps folder ids and normalized paths to
+# folders, device ids to devices, and device ids to the ids of the
+# folders that share with them, so lookups are O(1) and pruning is O(k)
+# in the number of devices touched.
+#
+# Changes made through the index are applied to the config itself, which
+# stays the plain dict that is posted back to Syncthing.
+#
+
+def normalize_path(path):
+  return path.rstrip('/')
+
+def get_devid(dev_obj):
+  if 'deviceID' in dev_obj:
+    return dev_obj['deviceID']
+  else:
+    return dev_obj['deviceId']
+
+class ConfigIndex(object):
+
+  def __init__(self, config):
+    self.config = config
+    self.rebuild()
+
+  def rebuild(self):
+    self.folders_by_id = {}
+    self.folders_by_path = {}
+    self.devices = {}
+    self.device_folders = {}
+
+    for f in self.config.get('folders') or []:
+      self._index_folder(f)
+
+    for d in self.config.get('devices') or []:
+      self.devices[get_devid(d)] = d
+
+  def _index_folder(self, f):
+    self.folders_by_id[f['id']] = f
+    self.folders_by_path[normalize_path(f['path'])] = f
+
+    for d in f.get('devices') or []:
+      self.device_folders.setdefault(get_devid(d), set()).add(f['id'])
+
+  def _unindex_folder(self, f):
+    self.folders_by_id.pop(f['id'], None)
+    self.folders_by_path.pop(normalize_path(f['path']), None)
+
+    for d in f.get('devices') or []:
+      ids = self.device_folders.get(get_devid(d))
+      if ids:
+        ids.discard(f['id'])
+
+  # Lookups
+
+  def folder(self, folder_id):
+    return self.folders_by_id.get(folder_id)
+
+  def folder_at(self, path):
+    return self.folders_by_path.get(normalize_path(path))
+
+  def folder_containing(self, path):
+    '''
+      Return the folder at path or the closest one above it
+    '''
+    path = normalize_path(path)
+
+    while path:
+      f = self.folders_by_path.get(path)
+      if f:
+        return f
+
+      parent = path.rsplit('/', 1)[0]
+      if parent == path:
+        break
+      path = parent
+
+    return None
+
+  def find_folder(self, object):
+    '''
+      Return the folder matching every key of object, e.g.
+      {'path' : path} or {'id' : id, 'label' : label}
+    '''
+    if 'id' in object:
+      candidates = [self.folder(object['id'])]
+    elif 'path' in object:
+      candidates = [self.folder_at(object['path'])]
+    else:
+      candidates = self.config.get('folders') or []
+
+    for f in candidates:
+      if f and self._matches(f, object):
+        return f
+
+  def _matches(self, f, object):
+    for k in object:
+      if k == 'path':
+        if normalize_path(object[k]) != normalize_path(f[k]):
+          return False
+      elif object[k] != f[k]:
+        return False
+
+    return True
+
+  def device(self, devid):
+    return self.devices.get(devid)
+
+  def has_device(self, devid):
+    return devid in self.devices
+
+  def folders_of(self, devid):
+    '''
+      Ids of the folders shared with devid
+    '''
+    return self.device_folders.get(devid) or set()
+
+  def folder_has_device(self, path, devid):
+    f = self.folder_at(path)
+    return f is not None and f['id'] in self.folders_of(devid)
+
+  # Changes
+
+  def add_folder(self, folder):
+    if self.config.get('folders') is None:
+      self.config['folders'] = []
+
+    self.config['folders'].append(folder)
+    self._index_folder(folder)
+
+  def relocate_folder(self, folder, path=None, folder_id=None):
+    '''
+      Change a folder's path and/or id, keeping the index current
+    '''
+    self._unindex_folder(folder)
+
+    if path is not None:
+      folder['path'] = path
+    if folder_id is not None:
+      folder['id'] = folder_id
+
+    self._index_folder(folder)
+
+  def delete_folder(self, path):
+    '''
+      Remove and return the folder at path, None if there is none
+    '''
+    f = self.folder_at(path)
+
+    if f is None:
+      return None
+
+    folders = self.config['folders']
+    for i, other in enumerate(folders):
+      if other is f:
+        del folders[i]
+        break
+
+    self._unindex_folder(f)
+    return f
+
+  def add_device(self, record):
+    if self.config.get('devices') is None:
+      self.config['devices'] = []
+
+    self.config['devices'].append(record)
+    self.devices[get_devid(record)] = record
+
+  def delete_device(self, devid):
+    return self.delete_devices([devid]) > 0
+
+  def delete_devices(self, devids):
+    '''
+      Remove every device in devids from config['devices'] in one pass,
+      return how many were removed
+    '''
+    devids = set(d for d in devids if d in self.devices)
+
+    if not devids:
+      return 0
+
+    devices = self.config['devices']
+    devices[:] = [d for d in devices if get_devid(d) not in devids]
+
+    for devid in devids:
+      del self.devices[devid]
+
+    return len(devids)
+
+  def add_device_to_folder(self, folder, devid):
+    '''
+      Share folder with devid; False if it already was
+    '''
+    if folder['id'] in self.folders_of(devid):
+      return False
+
+    if not folder.get('devices'):
+      folder['devices'] = []
+
+    folder['devices'].append({
+      'deviceID' : devid
+    })
+    self.device_folders.setdefault(devid, set()).add(folder['id'])
+    return True
+
+  def delete_device_from_folder(self, path, devid):
+    '''
+      Stop sharing the folder at path with devid; False if it was not
+    '''
+    f = self.folder_at(path)
+
+    if f is None or f['id'] not in self.folders_of(devid):
+      return False
+
+    f['devices'] = [d for d in f['devices'] if get_devid(d) != devid]
+    self.device_folders[devid].discard(f['id'])
+    return True
+
+  def prune_devices(self, folder):
+    '''
+      Delete the devices of folder that no folder in the config shares
+      with anymore; True if any were deleted
+    '''
+    if not folder:
+      return False
+
+    unused = [get_devid(d) for d in folder.get('devices') or []
+      if not self.folders_of(get_devid(d))]
+
+    return self.delete_devices(unused) > 0
+
+def index_for(config):
+  '''
+    Index of config as it is now; built afresh on every call, so changes
+    made to config behind an earlier index's back are always seen
+  '''
+  return ConfigIndex(config)
@@ -13,8 +13,10 @@ class AppRollbacker(RollbackerBase):
     self.app_handler.wait_start(0.5, 10)
     self.app_handler.adapter.set_config(self.app_config)
 
+    # config.json is kodrive's own, Syncthing only restarts
+    # if something else left it out of sync
     if self.app_handler.ping():
-      self.app_handler.restart()
+      self.app_handler.restart_if_needed([])
 
     self.app_handler.wait_start(0.5, 15)
 
@@ -29,7 +31,7 @@ class SyncthingRollbacker(RollbackerBase):
     self.app_handler.set_config(self.syncthing_config)
 
     if self.app_handler.ping():
-      self.app_handler.restart()
+      self.app_handler.restart_if_needed(self.app_handler.last_diff)
 
     self.app_handler.wait_start(0.5, 15)
     
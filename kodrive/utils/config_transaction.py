@@ -0,0 +1,167 @@
+###
+#
+# Batched config changes
+#
+# A command such as link or free used to fetch, post and restart once per
+# step. Inside a Transaction the Syncthing config is fetched once and the
+# same object is handed to every step; posting it and restarting the
+# daemon are deferred until the transaction commits, and kodrive's
+# config.json is likewise read once and written once.
+#
+# Nothing is written if the transaction is abandoned, and the daemon is
+# only restarted if a restart was asked for and the daemon needs one
+# (see SyncthingFacade.restart_if_needed).
+#
+
+from . import config_diff
+
+import copy, logging
+
+logger = logging.getLogger(__name__)
+
+class TransactionalAdapter(object):
+  '''
+    Stands in for the platform adapter during a transaction, keeping
+    config.json in memory until commit
+  '''
+
+  def __init__(self, adapter):
+    self.adapter = adapter
+    self.config = None
+    self.loaded = False
+    self.dirty = False
+
+  def __getattr__(self, name):
+    return getattr(self.adapter, name)
+
+  def get_config(self):
+    if not self.loaded:
+      self.config = self.adapter.get_config()
+      self.loaded = True
+
+    return self.config
+
+  def set_config(self, config):
+    self.config = config
+    self.loaded = True
+    self.dirty = True
+
+  def get_dir_config(self, local_path):
+    config = self.get_config()
+
+    if not config:
+      return None
+
+    dir_id = self.adapter.get_dir_id(local_path)
+    return config['directories'].get(dir_id)
+
+  def set_dir_config(self, object):
+    config = self.get_config()
+
+    # No config.json yet, let the adapter create it
+    if not config:
+      self.adapter.set_dir_config(object)
+      self.loaded = False
+      return
+
+    dir_id = self.adapter.get_dir_id(object['local_path'])
+    config['directories'][dir_id] = self.adapter.create_dir_metadata(object)
+    self.dirty = True
+
+  def commit(self):
+    if self.dirty:
+      self.adapter.set_config(self.config)
+      self.dirty = False
+
+class Transaction(object):
+
+  def __init__(self, facade):
+    self.facade = facade
+    self.config = None
+    self.committed = None
+    self.restart_requested = False
+
+    # Changes already posted by flush()
+    self.flushed = []
+
+    adapter = getattr(facade, 'adapter', None)
+    self.adapter = TransactionalAdapter(adapter) if adapter else None
+
+  def get_config(self):
+    if self.config is None:
+      self.config = self.facade.load_config()
+      self.committed = self.facade.snapshot_of(self.config)
+
+      if self.committed is None:
+        self.committed = copy.deepcopy(self.config)
+
+    return self.config
+
+  def set_config(self, config, restart=False):
+    self.config = config
+
+    if restart:
+      self.request_restart()
+
+  def request_restart(self):
+    self.restart_requested = True
+
+  def changes(self):
+    '''
+      Changes not posted yet, None if the config was not loaded here
+    '''
+    if self.config is None:
+      return []
+
+    if self.committed is None:
+      return None
+
+    return config_diff.diff(self.committed, self.config)
+
+  def flush(self):
+    '''
+      Post the Syncthing config now, e.g. so that a device added in
+      this transaction can be discovered. A pending restart still waits
+      for the commit.
+    '''
+    changes = self.changes()
+
+    if changes == []:
+      return False
+
+    self.facade.store_config(self.config, changes)
+    self.committed = copy.deepcopy(self.config)
+    self.flushed.extend(changes or [])
+    return True
+
+  def discard(self):
+    '''
+      Drop the Syncthing config changes that were not flushed
+    '''
+    if self.config is not None:
+      self.config = copy.deepcopy(self.committed)
+
+  def commit(self):
+    '''
+      Write each store once and restart at most once, only if needed;
+      True if the daemon was restarted
+    '''
+    if self.adapter:
+      self.adapter.commit()
+
+    changes = self.changes()
+
+    if changes != []:
+      self.facade.store_config(self.config, changes)
+
+    self.facade.last_diff = None if changes is None else self.flushed + changes
+
+    if self.facade.last_diff:
+      logger.debug('config changes:\n%s',
+        config_diff.describe(self.facade.last_diff))
+
+    # Nothing was written, nothing to apply
+    if not self.restart_requested or self.facade.last_diff == []:
+      return False
+
+    return self.facade.restart_if_needed(self.facade.last_diff)
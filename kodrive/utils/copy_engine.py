@@ -0,0 +1,370 @@
+###
+#
+# Moving directory trees
+#
+# Within one filesystem a move is a rename. Across filesystems the tree
+# is copied by parallel workers, each file with the cheapest method the
+# kernel offers: a reflink (FICLONE) where the filesystem can share
+# extents, else copy_file_range or sendfile so data never passes through
+# user space, else plain reads and writes.
+#
+# Every copied file is recorded in a journal next to the destination,
+# so running an interrupted move again skips what was already copied.
+# The source is only removed once the copy is complete.
+#
+
+import os, errno, shutil, threading
+import ctypes, ctypes.util
+
+try:
+  from Queue import Queue
+except ImportError:
+  from queue import Queue
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+DEFAULT_WORKERS = 4
+
+# Largest span handed to one copy_file_range / sendfile / read call
+CHUNK = 8 * 1024 * 1024
+
+JOURNAL_SUFFIX = '.kodrive-move'
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+# Errors meaning a method is not available for these two files
+UNSUPPORTED = set(getattr(errno, name) for name in (
+  'ENOSYS', 'EXDEV', 'EINVAL', 'EOPNOTSUPP', 'ENOTSUP', 'ENOTTY', 'EBADF'
+) if hasattr(errno, name))
+
+try:
+  _libc = ctypes.CDLL(ctypes.util.find_library('c') or None, use_errno=True)
+except OSError:
+  _libc = None
+
+def _libc_call(name, restype, argtypes):
+  fn = getattr(_libc, name, None) if _libc else None
+
+  if fn is None:
+    return None
+
+  fn.restype = restype
+  fn.argtypes = argtypes
+
+  def call(*args):
+    n = fn(*args)
+    if n < 0:
+      err = ctypes.get_errno()
+      raise OSError(err, os.strerror(err))
+    return n
+
+  return call
+
+if hasattr(os, 'copy_file_range'):
+  def _copy_file_range(src_fd, dst_fd, count):
+    return os.copy_file_range(src_fd, dst_fd, count)
+else:
+  _cfr = _libc_call('copy_file_range', ctypes.c_ssize_t, [
+    ctypes.c_int, ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p,
+    ctypes.c_size_t, ctypes.c_uint
+  ])
+  _copy_file_range = _cfr and (lambda src_fd, dst_fd, count:
+    _cfr(src_fd, None, dst_fd, None, count, 0))
+
+if hasattr(os, 'sendfile'):
+  def _sendfile(src_fd, dst_fd, count):
+    return os.sendfile(dst_fd, src_fd, None, count)
+else:
+  _sf = _libc_call('sendfile', ctypes.c_ssize_t, [
+    ctypes.c_int, ctypes.c_int, ctypes.c_void_p, ctypes.c_size_t
+  ])
+  _sendfile = _sf and (lambda src_fd, dst_fd, count:
+    _sf(dst_fd, src_fd, None, count))
+
+def _reflink(src_fd, dst_fd):
+  '''
+    Share src's extents with dst, False if the filesystem cannot
+  '''
+  if fcntl is None:
+    return False
+
+  try:
+    fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    return True
+  except (IOError, OSError) as e:
+    if e.errno in UNSUPPORTED:
+      return False
+    raise
+
+def _read_write(src_fd, dst_fd, count):
+  data = os.read(src_fd, count)
+  n = len(data)
+
+  while data:
+    data = data[os.write(dst_fd, data):]
+
+  return n
+
+def same_filesystem(path, other):
+  '''
+    Whether path and the existing directory other are on one filesystem
+  '''
+  return os.lstat(path).st_dev == os.stat(other).st_dev
+
+def copy_file(src, dst, progress=None):
+  '''
+    Copy src's data, mode and times to dst; progress(nbytes) is called
+    as data is copied
+  '''
+  with open(src, 'rb') as fsrc:
+    with open(dst, 'wb') as fdst:
+      src_fd, dst_fd = fsrc.fileno(), fdst.fileno()
+      size = os.fstat(src_fd).st_size
+
+      if size and _reflink(src_fd, dst_fd):
+        if progress:
+          progress(size)
+      else:
+        _copy_data(src_fd, dst_fd, progress)
+
+  shutil.copystat(src, dst)
+
+def _copy_data(src_fd, dst_fd, progress):
+  copied = 0
+
+  for method in (_copy_file_range, _sendfile, _read_write):
+    if method is None:
+      continue
+
+    try:
+      while True:
+        n = method(src_fd, dst_fd, CHUNK)
+        if not n:
+          return
+
+        copied += n
+        if progress:
+          progress(n)
+    except (IOError, OSError) as e:
+      # Only fall back to the next method before anything was written
+      if copied or e.errno not in UNSUPPORTED:
+        raise
+
+class Journal(object):
+  '''
+    The absolute path of the source, then the relative paths of the
+    files a move already copied, one per line
+  '''
+
+  def __init__(self, target, source=None):
+    self.path = target.rstrip('/') + JOURNAL_SUFFIX
+    self.source = source
+    self.lock = threading.Lock()
+    self.handle = None
+
+  def lines(self):
+    try:
+      with open(self.path) as f:
+        return [line.rstrip('\n') for line in f if line.endswith('\n')]
+    except IOError:
+      return []
+
+  def load(self):
+    # Relative paths never start with '/', unlike the source line
+    return set(line for line in self.lines() if not line.startswith('/'))
+
+  def source_of(self):
+    '''
+      Source of the move this journal belongs to, None if there is none
+    '''
+    lines = self.lines()
+    return lines[0] if lines and lines[0].startswith('/') else None
+
+  def begin(self):
+    '''
+      Create the journal, source line first, before anything is copied
+      so even a move interrupted during its first file is recognized
+    '''
+    with self.lock:
+      self._open()
+
+  def _open(self):
+    if self.handle is None:
+      fresh = not os.path.exists(self.path)
+      self.handle = open(self.path, 'a')
+
+      if fresh and self.source:
+        self.handle.write(self.source + '\n')
+        self.handle.flush()
+
+  def record(self, rel):
+    with self.lock:
+      self._open()
+      self.handle.write(rel + '\n')
+      self.handle.flush()
+
+  def close(self):
+    if self.handle is not None:
+      self.handle.close()
+      self.handle = None
+
+  def remove(self):
+    self.close()
+
+    try:
+      os.remove(self.path)
+    except OSError:
+      pass
+
+class TreeCopy(object):
+  '''
+    Copy the tree at source to target with workers threads, skipping
+    files the journal says were already copied
+  '''
+
+  def __init__(self, source, target, workers=DEFAULT_WORKERS):
+    self.source = source.rstrip('/')
+    self.target = target.rstrip('/')
+    self.workers = max(1, workers)
+    self.journal = Journal(self.target, os.path.abspath(self.source))
+
+    self.files = []
+    self.total = 0
+    self.plan()
+
+  def plan(self):
+    '''
+      Find the files left to copy and how many bytes they hold
+    '''
+    done = self.journal.load()
+
+    for root, dirs, files in os.walk(self.source):
+      for name in files + [d for d in dirs if os.path.islink(os.path.join(root, d))]:
+        path = os.path.join(root, name)
+        rel = os.path.relpath(path, self.source)
+
+        if rel in done:
+          continue
+
+        size = 0 if os.path.islink(path) else os.lstat(path).st_size
+        self.files.append((rel, size))
+        self.total += size
+
+  def run(self, progress=None):
+    '''
+      Copy the planned files; progress(nbytes) is called, from one
+      thread at a time, as data is copied
+    '''
+    lock = threading.Lock()
+    errors = []
+    queue = Queue(self.workers * 4)
+
+    def report(n):
+      if progress:
+        with lock:
+          progress(n)
+
+    def worker():
+      while True:
+        item = queue.get()
+
+        if item is None:
+          return
+
+        # After a failure the queue is only drained
+        if errors:
+          continue
+
+        try:
+          self.copy(item[0], report)
+          self.journal.record(item[0])
+        except Exception as e:
+          errors.append(e)
+
+    self.journal.begin()
+
+    # Directories first, so workers never race to create them
+    for root, dirs, files in os.walk(self.source):
+      rel = os.path.relpath(root, self.source)
+      path = os.path.normpath(os.path.join(self.target, rel))
+
+      if not os.path.isdir(path):
+        os.makedirs(path)
+
+    threads = [threading.Thread(target=worker) for n in range(self.workers)]
+
+    for t in threads:
+      t.daemon = True
+      t.start()
+
+    try:
+      for item in self.files:
+        if errors:
+          break
+        queue.put(item)
+    finally:
+      for t in threads:
+        queue.put(None)
+      for t in threads:
+        t.join()
+
+      self.journal.close()
+
+    if errors:
+      raise errors[0]
+
+    # Directory modes and times, now that their contents are in place
+    for root, dirs, files in os.walk(self.source):
+      rel = os.path.relpath(root, self.source)
+      shutil.copystat(root, os.path.normpath(os.path.join(self.target, rel)))
+
+  def copy(self, rel, progress):
+    src = os.path.join(self.source, rel)
+    dst = os.path.join(self.target, rel)
+
+    if os.path.islink(src):
+      if os.path.lexists(dst):
+        os.remove(dst)
+      os.symlink(os.readlink(src), dst)
+    else:
+      copy_file(src, dst, progress)
+
+  def finish(self):
+    '''
+      Remove the source once the copy is in use
+    '''
+    shutil.rmtree(self.source)
+    self.journal.remove()
+
+def place(source, target, workers=DEFAULT_WORKERS):
+  '''
+    Rename source to target if they share a filesystem (returns None),
+    else return a TreeCopy to run, and finish() once target is in use
+  '''
+  parent = os.path.dirname(target.rstrip('/')) or '.'
+
+  # Single files and links are cheap enough to move as they are
+  if os.path.islink(source) or not os.path.isdir(source):
+    shutil.move(source, target)
+    return None
+
+  if same_filesystem(source, parent) and not os.path.exists(target + JOURNAL_SUFFIX):
+    try:
+      os.rename(source, target)
+      return None
+    except OSError as e:
+      if e.errno != errno.EXDEV:
+        raise
+
+  return TreeCopy(source, target, workers)
+
+def interrupted(source, target):
+  '''
+    Whether target is what is left of an interrupted move of source
+  '''
+  source = os.path.abspath(source).rstrip('/')
+  return Journal(os.path.abspath(target)).source_of() == source
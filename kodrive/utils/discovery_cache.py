@@ -0,0 +1,159 @@
+###
+#
+# Device addresses remembered between kodrive runs
+#
+# Finding a device through /rest/system/discovery can take seconds after
+# a device was added. The addresses learned from discovery and from live
+# connections are kept in discovery.json next to config.json, so looking
+# up a device kodrive has seen before is a file read.
+#
+# Entries expire after a TTL; lookups keep the file current by refreshing
+# it from the daemon in a background thread, and addresses that stop
+# answering are evicted.
+#
+
+from ..py_syncthing_adapter import codec
+
+import os, time, threading
+
+CACHE_FILE = 'discovery.json'
+
+# Seconds an address is trusted without seeing it again
+DEFAULT_TTL = 24 * 60 * 60
+
+def host_of(address):
+  '''
+    'tcp://1.2.3.4:22000' or '[::1]:22000' => '1.2.3.4' or '::1';
+    None for addresses that do not name a host
+  '''
+  if '://' in address:
+    scheme, address = address.split('://', 1)
+    if scheme not in ('tcp', 'tcp4', 'tcp6'):
+      return None
+
+  host = address.rsplit(':', 1)[0].strip('[]')
+
+  if not host or host in ('0.0.0.0', '::', 'dynamic'):
+    return None
+
+  return host
+
+def hosts_from_discovery(discovery):
+  '''
+    devid -> host from a /rest/system/discovery response
+  '''
+  hosts = {}
+
+  for devid, entry in (discovery or {}).items():
+    for address in entry.get('addresses') or []:
+      host = host_of(address)
+      if host:
+        hosts[devid] = host
+        break
+
+  return hosts
+
+def hosts_from_connections(connections):
+  '''
+    devid -> host of every connected device in a
+    /rest/system/connections response
+  '''
+  hosts = {}
+
+  for devid, c in ((connections or {}).get('connections') or {}).items():
+    if c.get('connected') and c.get('address'):
+      host = host_of(c['address'])
+      if host:
+        hosts[devid] = host
+
+  return hosts
+
+class DiscoveryCache(object):
+
+  def __init__(self, config_dir, ttl=DEFAULT_TTL):
+    self.path = os.path.join(config_dir, CACHE_FILE)
+    self.ttl = ttl
+
+  def load(self):
+    try:
+      with open(self.path) as f:
+        return codec.loads(f.read())
+    except (IOError, ValueError):
+      return {}
+
+  def get(self, devid, stale=False):
+    '''
+      Host of devid, None if unknown or expired (unless stale is set)
+    '''
+    entry = self.load().get(devid)
+
+    if not entry:
+      return None
+
+    if not stale and time.time() - entry['seen'] > self.ttl:
+      return None
+
+    return entry['host']
+
+  def update(self, hosts):
+    '''
+      Record devid -> host pairs as seen now
+    '''
+    if not hosts:
+      return
+
+    entries = self.load()
+    now = time.time()
+
+    for devid, host in hosts.items():
+      entries[devid] = {'host' : host, 'seen' : now}
+
+    self.save(entries)
+
+  def evict(self, devid):
+    '''
+      Forget devid's address, e.g. once it stopped answering
+    '''
+    entries = self.load()
+
+    if entries.pop(devid, None) is not None:
+      self.save(entries)
+
+  def save(self, entries):
+    # Written aside and renamed, so readers never see half a file
+    tmp = '%s.%d' % (self.path, os.getpid())
+    with open(tmp, 'w') as f:
+      codec.dump(entries, f)
+    os.rename(tmp, self.path)
+
+  def refresh(self, sync):
+    '''
+      Learn every address the daemon knows; returns them
+    '''
+    results = sync.batch([
+      (sync.sys.discovery, None),
+      (sync.sys.connections, None)
+    ])
+    hosts = {}
+
+    if not results[0].error:
+      hosts.update(hosts_from_discovery(results[0].value))
+
+    # Live connections win over announced addresses
+    if not results[1].error:
+      hosts.update(hosts_from_connections(results[1].value))
+
+    self.update(hosts)
+    return hosts
+
+  def refresh_in_background(self, sync):
+    def run():
+      try:
+        self.refresh(sync)
+      except Exception:
+        pass
+
+    thread = threading.Thread(target=run)
+    thread.daemon = True
+    thread.start()
+    return thread
@@ -0,0 +1,71 @@
+###
+#
+# What live_update last saw of each directory
+#
+# live_update keeps the device lists in config.xml and in the .kodrive
+# folders of shared directories in step. live-update.json, next to
+# config.json, remembers per local path a hash of the device list a
+# server last broadcast, and the size and mtime of the .kodrive
+# config.json a client last applied, so a start only touches the
+# directories that changed since the previous one.
+#
+
+from ..py_syncthing_adapter import codec
+
+import os, json, hashlib
+
+STATE_FILE = 'live-update.json'
+
+def devices_hash(devices):
+  '''
+    Hash of a device list, independent of its order
+  '''
+  canonical = json.dumps(sorted(devices, key=lambda d: d.get('id')), sort_keys=True)
+  return hashlib.sha1(canonical).hexdigest()
+
+def file_signature(path):
+  '''
+    [size, mtime] of path, None if it does not exist
+  '''
+  try:
+    st = os.stat(path)
+  except OSError:
+    return None
+
+  return [st.st_size, st.st_mtime]
+
+class LiveState(object):
+
+  def __init__(self, config_dir):
+    self.path = os.path.join(config_dir, STATE_FILE)
+    self.entries = self.load()
+    self.changed = False
+
+  def load(self):
+    try:
+      with open(self.path) as f:
+        return codec.loads(f.read())
+    except (IOError, ValueError):
+      return {}
+
+  def get(self, local_path, key):
+    return self.entries.get(local_path, {}).get(key)
+
+  def set(self, local_path, key, value):
+    entry = self.entries.setdefault(local_path, {})
+
+    if entry.get(key) != value:
+      entry[key] = value
+      self.changed = True
+
+  def save(self):
+    if not self.changed:
+      return
+
+    # Written aside and renamed, so readers never see half a file
+    tmp = '%s.%d' % (self.path, os.getpid())
+    with open(tmp, 'w') as f:
+      codec.dump(self.entries, f)
+    os.rename(tmp, self.path)
+
+    self.changed = False
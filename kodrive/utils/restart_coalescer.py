@@ -0,0 +1,174 @@
+###
+#
+# Restarts shared between kodrive processes
+#
+# Every CLI invocation used to restart the daemon on its own, so a script
+# running 50 commands restarted it 50 times. With a quiet period set, a
+# restart is only recorded in a state file next to config.json; a
+# detached executor process performs a single restart once no request
+# has come in for the quiet period, however many processes asked.
+#
+# Requests and completed restarts are numbered, so a caller that needs
+# the restart done can wait until the executor has caught up with its
+# request.
+#
+
+from ..py_syncthing_adapter import codec
+from ..py_syncthing_adapter import instrument
+from ..data import custom_errors
+
+import os, time, fcntl
+from contextlib import contextmanager
+
+STATE_FILE = 'restart.json'
+LOCK_FILE = 'restart.lock'
+EXECUTOR_LOCK_FILE = 'restart.executor.lock'
+
+# How often waiters look at the state file
+POLL_INTERVAL = 0.1
+
+class RestartCoalescer(object):
+
+  def __init__(self, state_dir, delay, restart):
+    '''
+      delay: quiet period in seconds
+      restart: performs the actual restart (in the executor process)
+    '''
+    self.state_path = os.path.join(state_dir, STATE_FILE)
+    self.lock_path = os.path.join(state_dir, LOCK_FILE)
+    self.executor_lock_path = os.path.join(state_dir, EXECUTOR_LOCK_FILE)
+    self.delay = delay
+    self.restart = restart
+
+  @contextmanager
+  def state(self):
+    '''
+      Read-modify-write the state file under an exclusive lock
+    '''
+    with open(self.lock_path, 'a') as lock:
+      fcntl.flock(lock, fcntl.LOCK_EX)
+
+      try:
+        with open(self.state_path) as f:
+          state = codec.loads(f.read())
+      except (IOError, ValueError):
+        state = {}
+
+      state.setdefault('requested', 0)
+      state.setdefault('done', 0)
+      before = dict(state)
+
+      yield state
+
+      if state != before:
+        with open(self.state_path, 'w') as f:
+          codec.dump(state, f)
+
+  def request(self):
+    '''
+      Record a restart request and make sure an executor will handle it;
+      return the request's number for wait()
+    '''
+    with self.state() as state:
+      state['requested'] += 1
+      state['last'] = time.time()
+      ticket = state['requested']
+
+    self.spawn()
+    return ticket
+
+  def wait(self, ticket, timeout=None):
+    '''
+      Block until the restart for ticket was performed; False on
+      timeout, RestartFailed if the restart did not succeed
+    '''
+    deadline = None if timeout is None else time.time() + timeout
+
+    while True:
+      with self.state() as state:
+        if state['done'] >= ticket:
+          failed = state.get('failed')
+
+          if failed and failed['first'] <= ticket <= failed['last']:
+            raise custom_errors.RestartFailed(failed['error'])
+
+          return True
+
+        # Not due before the quiet period is over
+        due = state.get('last', 0) + self.delay
+
+      if deadline is not None and time.time() >= deadline:
+        return False
+
+      pause = max(POLL_INTERVAL, due - time.time())
+      if deadline is not None:
+        pause = min(pause, max(0, deadline - time.time()))
+
+      instrument.sleep(pause, 'restart_wait')
+
+  def spawn(self):
+    '''
+      Fork a detached executor; it exits at once if another one runs
+    '''
+    pid = os.fork()
+
+    if pid:
+      # Reap the intermediate child, the executor is reparented
+      os.waitpid(pid, 0)
+      return
+
+    try:
+      os.setsid()
+
+      if os.fork() == 0:
+        # Let go of the caller's terminal and pipes, or a caller
+        # reading our output would wait for the restart
+        null = os.open(os.devnull, os.O_RDWR)
+        for fd in (0, 1, 2):
+          os.dup2(null, fd)
+        os.close(null)
+
+        self.execute()
+    finally:
+      os._exit(0)
+
+  def execute(self):
+    '''
+      Executor loop: restart once the quiet period has passed, until
+      every request is done
+    '''
+    with open(self.executor_lock_path, 'a') as lock:
+      try:
+        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+      except IOError:
+        # The running executor will see our request
+        return
+
+      while True:
+        with self.state() as state:
+          if state['done'] >= state['requested']:
+            # Released while the state is locked, so a request made
+            # after this check finds the executor lock free
+            fcntl.flock(lock, fcntl.LOCK_UN)
+            return
+
+          quiet = time.time() - state.get('last', 0)
+          first = state['done'] + 1
+          target = state['requested']
+
+        if quiet < self.delay:
+          time.sleep(self.delay - quiet)
+          continue
+
+        try:
+          self.restart()
+          error = None
+        except Exception as e:
+          error = str(e) or e.__class__.__name__
+
+        with self.state() as state:
+          state['done'] = max(state['done'], target)
+
+          # Reported to whoever waits on a ticket in first..target
+          if error:
+            state['failed'] = {'first' : first, 'last' : target, 'error' : error}
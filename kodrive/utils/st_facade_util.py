@@ -1,95 +1,43 @@
 import os
 import json
 
+from .config_index import index_for, get_devid  # noqa: F401
+
 # Delete all devices that no longer have
 # a folder as a dependency
 def prune_devices(folder, config):
-  
-  if not folder:
-    return False;
-
-  pruned = False
-
-  # For each device in the folder
-  for d in folder['devices']:
-    exists = False
-    
-    # Check if that device id exists in other folders
-    for f in config['folders']:
-      if device_exists(d['deviceID'], f):
-        exists = True
-        break
-    
-    # If no instance can be found, delete the device
-    if not exists:
-      pruned = True
-      delete_device(d['deviceID'], config)
-
-  return pruned
+  return index_for(config).prune_devices(folder)
 
 def find_folder_with_path(path, config):
-  return find_folder({
-    'path' : path
-  }, config)
+  return index_for(config).folder_at(path)
 
 def find_folder(object, config):
-  
-  # list of folders
-  folders = config['folders']
-  
-  for f in folders:
-    n = 0
-    d = 0
-
-    for k in object:
-
-      if k == 'path':
-        if object[k].rstrip('/') == f[k].rstrip('/'):
-          n += 1
-      else: 
-        if object[k] == f[k]:
-          n += 1
-
-      d += 1
-
-    if n == d:
-      return f
+  return index_for(config).find_folder(object)
 
 ###
 # 
 # Checks whether device exists in config['devices']
 #
 def device_exists(client_devid, config):
-  return find_device(client_devid, config) != None
+  return index_for(config).has_device(client_devid)
 
 def delete_device(devid, config):
-  devices = config['devices']
-
-  for i, d in enumerate(devices):
-    device_id = get_devid(d)
-    
-    if device_id == devid:
-      del devices[i]
-      return True
-
-  return False
+  return index_for(config).delete_device(devid)
 
 ###
 #
 # Return the device object in config['devices']
 #
 def find_device(client_devid, config=None):
-    
-  for d in config['devices']:
-    device_id = get_devid(d)
-    if device_id == client_devid:
-      return d
-
-def get_devid(dev_obj):
-  if 'deviceID' in dev_obj:
-    return dev_obj['deviceID']
-  else:
-    return dev_obj['deviceId']
+  return index_for(config).device(client_devid)
+
+###
+#
+# 'v0.14.7' or 'v1.27.2-rc.1' => (0, 14, 7), (1, 27, 2)
+#
+def parse_version(version):
+  numbers = version.lstrip('v').split('-')[0].split('.')
+  return tuple(int(n) for n in numbers[:3])
 
 def update_devices(folder_conf):
 
@@ -102,22 +50,19 @@ def update_devices(folder_conf):
   else:
     
     # Backup folder devices
-    if os.path.exists(backup):
+    data = {}
 
+    if os.path.exists(backup):
       try:
-        fp = open(backup, 'r+')
-        data = json.loads(fp.read())
-        data['devices'] = folder_conf['devices']
+        with open(backup, 'r') as f:
+          data = json.loads(f.read())
       except Exception as e:
-      	data = {}
-      	data['devices'] = folder_conf['devices']
-      	pass
-      	
-      fp.write(json.dumps(data))
-      fp.close()
-    else:
-      with open(backup, "w") as f:
-        f.write(json.dumps({'devices' : folder_conf['devices']}))
+        pass
+
+    data['devices'] = folder_conf['devices']
+
+    with open(backup, 'w') as f:
+      f.write(json.dumps(data))
 
     # Update folder devices
     try:
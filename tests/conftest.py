@@ -0,0 +1,10 @@
+import pytest
+
+from .fakes import FakeFacade
+
+@pytest.fixture
+def facade():
+  '''
+    Facade over an empty in-memory daemon and config.json
+  '''
+  return FakeFacade()
@@ -0,0 +1,99 @@
+###
+#
+# In-memory stand-ins for the daemon and config.json shared by the tests
+#
+
+import copy
+
+from kodrive.syncthing_factory import SyncthingFacade, SyncthingClient
+
+def make_config():
+  return {
+    'folders' : [
+      {'id' : 'a', 'path' : '/a', 'label' : 'A', 'devices' : [{'deviceID' : 'D1'}]},
+      {'id' : 'b', 'path' : '/b', 'label' : 'B', 'devices' : [{'deviceID' : 'D1'}]}
+    ],
+    'devices' : [{'deviceID' : 'D1', 'name' : 'one'}],
+    'gui' : {'address' : '127.0.0.1:8384'},
+    'options' : {'listenAddresses' : ['default']}
+  }
+
+class Commands(object):
+  '''
+    Attribute namespace standing in for a Commands group, e.g. sync.db
+  '''
+
+  def __init__(self, **commands):
+    self.__dict__.update(commands)
+
+class FakeStream(object):
+  '''
+    Event stream that hands out a fixed list of events
+  '''
+
+  def __init__(self, events):
+    self.events = events
+
+  def iter_events(self, deadline=None):
+    return iter(self.events)
+
+  def poll(self, timeout=None):
+    return self.events
+
+class FakeAdapter(object):
+  '''
+    config.json in memory, counting writes
+  '''
+
+  def __init__(self, directories=None):
+    self.config = {'directories' : directories or {}}
+    self.writes = 0
+
+  def get_config(self):
+    return copy.deepcopy(self.config)
+
+  def set_config(self, config):
+    self.config = copy.deepcopy(config)
+    self.writes += 1
+
+  def get_dir_id(self, local_path):
+    return local_path.rstrip('/')
+
+  def create_dir_metadata(self, object):
+    return dict(object)
+
+class MemoryDaemon(object):
+  '''
+    Keeps the Syncthing config in self.config, recording each GET,
+    POST and RESTART in self.calls
+  '''
+
+  def load_config(self):
+    self.calls.append('GET')
+    config = copy.deepcopy(self.config)
+    self.remember_config(config)
+    return config
+
+  def store_config(self, config, changes=None):
+    self.calls.append('POST')
+    self.config = copy.deepcopy(config)
+    self.remember_config(config)
+
+  def restart(self, wait=False):
+    if self._transaction is not None:
+      return self._transaction.request_restart()
+    self.calls.append('RESTART')
+
+class FakeFacade(MemoryDaemon, SyncthingFacade):
+
+  def __init__(self, config=None, adapter=None):
+    SyncthingFacade.__init__(self, adapter=adapter or FakeAdapter())
+    self.config = config or {'folders' : [], 'devices' : []}
+    self.calls = []
+
+class FakeClient(MemoryDaemon, SyncthingClient):
+
+  def __init__(self, config=None, adapter=None):
+    SyncthingClient.__init__(self, adapter or FakeAdapter())
+    self.config = config or {'folders' : [], 'devices' : []}
+    self.calls = []
@@ -0,0 +1,80 @@
+import time
+
+from requests.exceptions import ConnectionError
+
+from kodrive.py_syncthing_adapter import Syncthing, async_client
+from kodrive.syncthing_factory import AsyncSyncthingFacade
+
+from .fakes import Commands
+
+FINGERPRINT = 'AB' * 32
+
+class FakeAdapter(object):
+
+  def __init__(self, **options):
+    self.options = options
+
+  def get_gui_hook(self):
+    return Syncthing(api_key='key', **self.options)
+
+def options_of(facade):
+  return facade.sync.sync._interface.options
+
+def test_from_adapter_keeps_unix_socket():
+  facade = AsyncSyncthingFacade.from_adapter(FakeAdapter(socket_path='/run/st.sock'))
+  assert options_of(facade).socket_path == '/run/st.sock'
+
+def test_from_adapter_keeps_pinning():
+  facade = AsyncSyncthingFacade.from_adapter(FakeAdapter(
+    host='10.0.0.1', port=8443, is_https=True, fingerprint=FINGERPRINT))
+  options = options_of(facade)
+
+  assert (options.host, options.port) == ('10.0.0.1', 8443)
+  assert options.is_https and options.fingerprint == FINGERPRINT
+
+class Daemon(object):
+  '''
+    Blocking client of a daemon that answers pings once it is up
+  '''
+
+  def __init__(self, up_after=0):
+    self.pings = 0
+    self.up_after = up_after
+    self.sys = Commands(ping=self.ping, status=lambda: {'myID' : 'ME'})
+
+  def ping(self):
+    self.pings += 1
+    if self.pings <= self.up_after:
+      raise ConnectionError()
+    return {'ping' : 'pong'}
+
+class FakeAsync(object):
+
+  def __init__(self, daemon):
+    self.sync = daemon
+    self.scheduler = async_client.Scheduler()
+    self.sys = Commands(status=lambda: self.submit(daemon.sys.status))
+
+  def submit(self, fn, *args, **kwargs):
+    return async_client.default_executor().submit(fn, *args, **kwargs)
+
+def test_calls_return_futures():
+  facade = AsyncSyncthingFacade(FakeAsync(Daemon()))
+
+  assert facade.get_device_id().result(5) == 'ME'
+  assert facade.ping().result(5) is True
+
+def test_wait_start_polls_on_the_scheduler():
+  daemon = Daemon(up_after=3)
+  facade = AsyncSyncthingFacade(FakeAsync(daemon))
+
+  waiting = facade.wait_start(0.01, 100)
+  assert waiting.result(5) is True
+  assert daemon.pings == 4
+
+def test_wait_start_gives_up():
+  facade = AsyncSyncthingFacade(FakeAsync(Daemon(up_after=1000)))
+  start = time.time()
+
+  assert facade.wait_start(0.01, 5).result(5) is False
+  assert time.time() - start < 1
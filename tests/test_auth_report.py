@@ -0,0 +1,57 @@
+import pytest
+
+from kodrive.utils import auth_report
+from kodrive.data import custom_errors
+
+def make_config():
+  return {
+    'folders' : [
+      {'id' : 'mine', 'path' : '/m/', 'devices' : [
+        {'deviceID' : 'ME'}, {'deviceID' : 'B'}, {'deviceID' : 'A'}]},
+      {'id' : 'other', 'path' : '/o/', 'devices' : [
+        {'deviceID' : 'ME'}, {'deviceID' : 'A'}]},
+      {'id' : 'linked', 'path' : '/l/', 'devices' : [
+        {'deviceID' : 'ME'}, {'deviceID' : 'C'}]},
+      {'id' : 'alone', 'path' : '/a/', 'devices' : [{'deviceID' : 'ME'}]}
+    ],
+    'devices' : [
+      {'deviceID' : 'ME', 'name' : 'me'},
+      {'deviceID' : 'A', 'name' : 'alpha'},
+      {'deviceID' : 'B', 'name' : 'beta'},
+      {'deviceID' : 'C', 'name' : 'gamma'}
+    ]
+  }
+
+DIRECTORIES = {
+  'linked' : {'local_path' : '/l', 'is_shared' : True},
+  'mine' : {'local_path' : '/m', 'is_shared' : False}
+}
+
+def test_report():
+  report = auth_report.build(make_config(), DIRECTORIES, 'ME')
+
+  assert [(r['name'], r['folders']) for r in report] == [
+    ('alpha', ['mine', 'other']), ('beta', ['mine'])]
+  assert report[0]['key'] == "".join('alpha#A'.encode('base64').split())
+
+def test_single_folder():
+  report = auth_report.build(make_config(), DIRECTORIES, 'ME', 'other')
+  assert [r['device_id'] for r in report] == ['A']
+
+  assert auth_report.build(make_config(), DIRECTORIES, 'ME', 'missing') == []
+
+def test_unknown_device():
+  config = make_config()
+  del config['devices'][1]
+
+  with pytest.raises(custom_errors.DeviceNotFound):
+    auth_report.build(config, DIRECTORIES, 'ME')
+
+def test_table():
+  assert auth_report.format_table([]) == 'No devices have been authorized.'
+
+  table = auth_report.format_table(auth_report.build(make_config(), DIRECTORIES, 'ME'))
+  lines = table.split('\n')
+
+  assert lines[0] == 'Name' + ' ' * 6 + 'Key'
+  assert lines[1].startswith('alpha' + ' ' * 5)
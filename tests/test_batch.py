@@ -0,0 +1,47 @@
+import time
+import threading
+
+import requests
+
+from kodrive.py_syncthing_adapter.batch import run_batch
+
+def test_results_in_call_order():
+  def call(n):
+    # Later calls finish first
+    time.sleep(0.01 * (5 - n))
+    return n
+
+  results = run_batch([(call, {'n' : n}) for n in range(5)], 5)
+
+  assert [r.value for r in results] == [0, 1, 2, 3, 4]
+  assert all(r.error is None for r in results)
+
+def test_errors_are_collected():
+  response = requests.Response()
+  response.status_code = 404
+  response.reason = 'Not Found'
+
+  def fail():
+    raise ValueError('bad folder')
+
+  results = run_batch([lambda: 1, fail, lambda: response, lambda: 4], 2)
+
+  assert [r.value for r in results] == [1, None, None, 4]
+  assert isinstance(results[1].error, ValueError)
+  assert isinstance(results[2].error, requests.HTTPError)
+  assert results[2].error.response is response
+
+def test_bounded_workers():
+  lock = threading.Lock()
+  running = [0, 0]
+
+  def call():
+    with lock:
+      running[0] += 1
+      running[1] = max(running)
+    time.sleep(0.01)
+    with lock:
+      running[0] -= 1
+
+  run_batch([call] * 12, 3)
+  assert running[1] <= 3
@@ -0,0 +1,24 @@
+import json
+
+from kodrive.py_syncthing_adapter import codec
+
+CONFIG = {'folders' : [{'id' : 'f%d' % n, 'label' : u'\xe9t\xe9'} for n in range(2000)]}
+
+def test_backends_roundtrip():
+  for name in codec.BACKENDS:
+    if codec._load(name) is None:
+      continue
+
+    c = codec.Codec(name)
+    assert c.loads(c.dumps(CONFIG)) == CONFIG
+    assert json.loads(b''.join(c.iterencode(CONFIG, 1024)).decode('utf-8')) == CONFIG
+
+def test_dump_stream(tmpdir):
+  path = str(tmpdir.join('config.json'))
+
+  for stream in (False, True):
+    with open(path, 'w') as f:
+      codec.dump(CONFIG, f, stream=stream)
+
+    with open(path) as f:
+      assert json.load(f) == CONFIG
@@ -0,0 +1,114 @@
+from kodrive.py_syncthing_adapter import C, Commands
+from kodrive.syncthing_factory import SyncthingFacade
+from kodrive.utils import st_facade_util as st_util
+
+from .fakes import make_config
+
+class FakeInterface(object):
+
+  def __init__(self, version='v1.27.2', requires_restart=False):
+    self.version = version
+    self.requires_restart = requires_restart
+    self.requests = []
+
+  def do_req(self, verb, endpoint, data=None, **params):
+    self.requests.append((verb, endpoint, data))
+
+    if endpoint == '/rest/system/version':
+      return {'version' : self.version}
+    if endpoint == '/rest/config/restart-required':
+      return {'requiresRestart' : self.requires_restart}
+    if endpoint == '/rest/system/config/insync':
+      return {'configInSync' : not self.requires_restart}
+
+    return True
+
+class FakeSync(object):
+
+  def __init__(self, iface):
+    commands = Commands(iface)
+    self.sys = commands.sys
+    self.config = commands.config
+
+def make_facade(version='v1.27.2'):
+  iface = FakeInterface(version)
+  facade = SyncthingFacade(sync=FakeSync(iface))
+  facade.remember_config(make_config())
+  return facade, iface
+
+def test_templated_endpoint():
+  iface = FakeInterface()
+  C(iface, 'PATCH', '/config/devices/{id}')({'name' : 'x'}, id='AB/CD')
+
+  assert iface.requests == [('PATCH', '/rest/config/devices/AB%2FCD', {'name' : 'x'})]
+
+def test_parse_version():
+  assert st_util.parse_version('v0.14.7') == (0, 14, 7)
+  assert st_util.parse_version('v1.27.2-rc.1') == (1, 27, 2)
+
+def test_store_per_object():
+  facade, iface = make_facade()
+  config = facade._loaded[0]
+
+  config['folders'][0]['label'] = 'B'
+  config['folders'][0]['devices'].append({'deviceID' : 'D2'})
+  config['folders'].append({'id' : 'c', 'path' : '/c', 'devices' : [{'deviceID' : 'D2'}]})
+  config['devices'].append({'deviceID' : 'D2', 'name' : 'two'})
+  facade.store_config(config)
+
+  # The new device exists before any folder names it
+  writes = [r for r in iface.requests if r[0] != 'GET']
+  assert writes == [
+    ('PUT', '/rest/config/devices/D2', {'deviceID' : 'D2', 'name' : 'two'}),
+    ('PUT', '/rest/config/folders/c', config['folders'][2]),
+    ('PATCH', '/rest/config/folders/a', {
+      'label' : 'B', 'devices' : [{'deviceID' : 'D1'}, {'deviceID' : 'D2'}]})
+  ]
+
+def test_store_deletes_folders_first():
+  facade, iface = make_facade()
+  config = facade._loaded[0]
+
+  del config['folders'][0]
+  del config['devices'][0]
+  facade.store_config(config)
+
+  writes = [r for r in iface.requests if r[0] != 'GET']
+  assert writes == [
+    ('DELETE', '/rest/config/folders/a', None),
+    ('DELETE', '/rest/config/devices/D1', None)
+  ]
+
+def test_store_falls_back():
+  # Options have no per-object endpoint
+  facade, iface = make_facade()
+  config = facade._loaded[0]
+  config['options']['x'] = 1
+  facade.store_config(config)
+
+  assert iface.requests[-1] == ('POST', '/rest/system/config', config)
+
+  # Daemons before 1.12 only take the whole config
+  facade, iface = make_facade('v0.14.7')
+  config = facade._loaded[0]
+  del config['devices'][0]
+  facade.store_config(config)
+
+  assert iface.requests[-1] == ('POST', '/rest/system/config', config)
+
+def restarts(iface):
+  return [r for r in iface.requests if r[1] == '/rest/system/restart']
+
+def test_restart_only_when_required():
+  for version in ('v1.27.2', 'v0.14.7'):
+    facade, iface = make_facade(version)
+    config = facade._loaded[0]
+    config['folders'][0]['label'] = 'B'
+    facade.set_config(config, True)
+
+    assert not restarts(iface)
+    assert facade.skipped_restarts == 1
+
+    iface.requires_restart = True
+    assert facade.restart_if_needed()
+    assert len(restarts(iface)) == 1
@@ -0,0 +1,51 @@
+import copy
+
+from kodrive.utils import config_diff
+from kodrive.utils.config_diff import Change
+
+from .fakes import FakeFacade, make_config
+
+def test_no_changes():
+  old = make_config()
+  new = copy.deepcopy(old)
+  new['folders'].reverse()
+
+  assert config_diff.diff(old, new) == []
+
+def test_keyed_changes():
+  old = make_config()
+  new = copy.deepcopy(old)
+  new['folders'][1]['label'] = 'b'
+  new['devices'].append({'deviceID' : 'D2', 'name' : 'two'})
+
+  changes = config_diff.diff(old, new)
+
+  assert Change('change', ('folders', 'b', 'label'), 'B', 'b') in changes
+  assert Change('add', ('devices', 'D2'), None, new['devices'][1]) in changes
+  assert len(changes) == 2
+  assert config_diff.requires_restart(changes)
+  assert '~ folders.b.label' in config_diff.describe(changes)
+
+def test_devices_apply_live():
+  old = make_config()
+  new = copy.deepcopy(old)
+  new['devices'][0]['name'] = 'uno'
+
+  assert not config_diff.requires_restart(config_diff.diff(old, new))
+
+def test_set_config_skips_noops():
+  facade = FakeFacade(make_config())
+
+  facade.set_config(facade.get_config(), True)
+  assert facade.calls == ['GET']
+  assert facade.last_diff == []
+
+  config = facade.get_config()
+  config['devices'][0]['name'] = 'uno'
+  facade.set_config(config, True)
+  assert facade.calls == ['GET', 'GET', 'POST']
+
+  config = facade.get_config()
+  config['folders'][0]['label'] = 'a'
+  facade.set_config(config, True)
+  assert facade.calls == ['GET', 'GET', 'POST', 'GET', 'POST', 'RESTART']
@@ -0,0 +1,58 @@
+from kodrive.utils import config_index
+from kodrive.utils.config_index import ConfigIndex
+
+def make_config(folders=2000, devices=5000):
+  return {
+    'devices' : [{'deviceID' : 'D%d' % n, 'name' : 'd%d' % n} for n in range(devices)],
+    'folders' : [{
+      'id' : 'f%d' % n,
+      'label' : 'l%d' % n,
+      'path' : '/sync/%d/' % n,
+      'devices' : [{'deviceID' : 'D%d' % ((n + k) % devices)} for k in range(3)]
+    } for n in range(folders)]
+  }
+
+def test_lookups():
+  index = ConfigIndex(make_config())
+
+  assert index.folder_at('/sync/7')['id'] == 'f7'
+  assert index.folder_at('/sync/7/') is index.folder('f7')
+  assert index.folder_containing('/sync/7/a/b')['id'] == 'f7'
+  assert index.find_folder({'path' : '/sync/7', 'label' : 'l7'})['id'] == 'f7'
+  assert index.find_folder({'path' : '/sync/7', 'label' : 'other'}) is None
+  assert index.device('D42')['name'] == 'd42'
+  assert index.folders_of('D9') == set(['f7', 'f8', 'f9'])
+  assert index.folder_has_device('/sync/7', 'D9')
+
+def test_delete_and_prune():
+  config = make_config(folders=3, devices=10)
+  index = ConfigIndex(config)
+
+  # D0 is only shared through f0, D1 also through f1
+  folder = index.delete_folder('/sync/0')
+  assert index.prune_devices(folder)
+  assert not index.has_device('D0')
+  assert index.has_device('D1')
+  assert len(config['folders']) == 2
+  assert len(config['devices']) == 9
+
+  assert index.delete_device_from_folder('/sync/1', 'D2')
+  assert not index.delete_device_from_folder('/sync/1', 'D2')
+  assert 'f1' not in index.folders_of('D2')
+
+def test_index_for_sees_outside_changes():
+  config = make_config(folders=3, devices=10)
+  config_index.index_for(config)
+
+  config['devices'].append({'deviceID' : 'NEW'})
+  assert config_index.index_for(config).has_device('NEW')
+
+  # Same-length edits made in place, e.g. SyncthingProxy.request_folder
+  folder = config['folders'][0]
+  folder['devices'].append({'deviceID' : 'NEW'})
+  folder['path'] = '/moved/'
+
+  index = config_index.index_for(config)
+  assert folder['id'] in index.folders_of('NEW')
+  assert index.folder_at('/moved') is folder
+  assert index.folder_at('/sync/0') is None
@@ -0,0 +1,52 @@
+import pytest
+
+def add_folder(facade, path):
+  config = facade.get_config()
+  config['folders'].append({'id' : path, 'path' : path})
+  facade.set_config(config, True)
+  facade.adapter.set_dir_config({'local_path' : path})
+
+def test_single_commit(facade):
+  adapter = facade.adapter
+
+  with facade.transaction():
+    add_folder(facade, '/a')
+    with facade.transaction():
+      add_folder(facade, '/b')
+    facade.restart()
+
+    assert facade.adapter.get_dir_config('/a') == {'local_path' : '/a'}
+    assert adapter.writes == 0
+
+  assert facade.calls == ['GET', 'POST', 'RESTART']
+  assert len(facade.config['folders']) == 2
+  assert adapter.writes == 1
+  assert sorted(adapter.config['directories']) == ['/a', '/b']
+  assert facade.adapter is adapter
+
+def test_no_change_no_restart(facade):
+
+  with facade.transaction():
+    facade.set_config(facade.get_config(), True)
+
+  assert facade.calls == ['GET']
+
+def test_flush_keeps_restart_pending(facade):
+
+  with facade.transaction() as txn:
+    add_folder(facade, '/a')
+    assert txn.flush()
+    assert facade.calls == ['GET', 'POST']
+
+  assert facade.calls == ['GET', 'POST', 'RESTART']
+
+def test_abort_discards(facade):
+
+  with pytest.raises(ValueError):
+    with facade.transaction():
+      add_folder(facade, '/a')
+      raise ValueError()
+
+  assert facade.calls == ['GET']
+  assert facade.config['folders'] == []
+  assert facade.adapter.writes == 0
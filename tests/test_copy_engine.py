@@ -0,0 +1,198 @@
+import os, errno
+import pytest
+
+from kodrive.utils import copy_engine
+
+from .fakes import FakeAdapter, FakeClient
+
+def make_tree(root):
+  os.makedirs(os.path.join(root, 'sub', 'deep'))
+  files = {
+    'a.txt' : b'alpha',
+    'sub/b.bin' : os.urandom(3 * 1024),
+    'sub/deep/c' : b''
+  }
+
+  for rel, data in files.items():
+    with open(os.path.join(root, rel), 'wb') as f:
+      f.write(data)
+
+  os.symlink('a.txt', os.path.join(root, 'link'))
+  return files
+
+def assert_copied(target, files):
+  for rel, data in files.items():
+    with open(os.path.join(target, rel), 'rb') as f:
+      assert f.read() == data
+
+  assert os.readlink(os.path.join(target, 'link')) == 'a.txt'
+
+def test_tree_copy(tmpdir):
+  source, target = str(tmpdir.join('src')), str(tmpdir.join('dst'))
+  files = make_tree(source)
+  seen = []
+
+  copy = copy_engine.TreeCopy(source, target, workers=3)
+  assert copy.total == sum(len(d) for d in files.values())
+
+  copy.run(seen.append)
+  assert sum(seen) == copy.total
+  assert_copied(target, files)
+  assert os.path.exists(target + copy_engine.JOURNAL_SUFFIX)
+
+  copy.finish()
+  assert not os.path.exists(source)
+  assert not os.path.exists(target + copy_engine.JOURNAL_SUFFIX)
+
+def test_resume_skips_journaled(tmpdir):
+  source, target = str(tmpdir.join('src')), str(tmpdir.join('dst'))
+  make_tree(source)
+
+  with open(target + copy_engine.JOURNAL_SUFFIX, 'w') as f:
+    f.write('sub/b.bin\n')
+
+  copy = copy_engine.TreeCopy(source, target)
+  assert sorted(rel for rel, size in copy.files) == ['a.txt', 'link', 'sub/deep/c']
+  assert copy.total == len('alpha')
+
+def test_fallback_before_first_byte(tmpdir, monkeypatch):
+  def unsupported(src_fd, dst_fd, count):
+    raise OSError(errno.EXDEV, 'cross-device')
+
+  monkeypatch.setattr(copy_engine, '_copy_file_range', unsupported)
+  monkeypatch.setattr(copy_engine, '_sendfile', None)
+
+  src, dst = str(tmpdir.join('f')), str(tmpdir.join('g'))
+  with open(src, 'wb') as f:
+    f.write(b'x' * (copy_engine.CHUNK + 10))
+
+  copy_engine.copy_file(src, dst)
+  assert os.path.getsize(dst) == copy_engine.CHUNK + 10
+
+def test_place_renames_on_one_filesystem(tmpdir):
+  source, target = str(tmpdir.join('src')), str(tmpdir.join('dst'))
+  files = make_tree(source)
+
+  assert copy_engine.place(source, target) is None
+  assert not os.path.exists(source)
+  assert_copied(target, files)
+
+class MovingClient(FakeClient):
+  '''
+    Client over the folders at paths, recording in calls each time a
+    commit checks whether the daemon needs a restart
+  '''
+
+  def __init__(self, paths):
+    FakeClient.__init__(self, {'folders' : [
+      {'id' : p, 'path' : p + '/', 'devices' : []} for p in paths
+    ], 'devices' : []}, FakeAdapter(dict((p, {'local_path' : p}) for p in paths)))
+
+  def restart_if_needed(self, changes=None, wait=False):
+    self.calls.append('CHECK')
+
+def test_move_commits_once(tmpdir):
+  a, b = str(tmpdir.join('a')), str(tmpdir.join('b'))
+  target = str(tmpdir.mkdir('target'))
+  make_tree(a)
+  make_tree(b)
+
+  client = MovingClient([a, b])
+  client.move([a, b + '/'], target)
+
+  # One write pauses the folders, one moves and resumes them; the
+  # daemon is restarted, if at all, only after the second
+  assert client.calls == ['GET', 'POST', 'POST', 'CHECK']
+  assert client.adapter.writes == 1
+  assert sorted((f['id'], f['path'], f['paused']) for f in client.config['folders']) == [
+    (a, os.path.join(target, 'a/'), False), (b, os.path.join(target, 'b/'), False)]
+  assert sorted(client.adapter.config['directories']) == [
+    os.path.join(target, 'a'), os.path.join(target, 'b')]
+  assert os.path.isdir(os.path.join(target, 'b', 'sub'))
+  assert not os.path.exists(a)
+
+def test_move_with_new_id(tmpdir):
+  a = str(tmpdir.join('a'))
+  target = str(tmpdir.mkdir('target'))
+  make_tree(a)
+
+  client = MovingClient([a])
+  client.move([a], target, keep_id=False)
+
+  assert client.calls == ['GET', 'POST', 'CHECK']
+  assert client.config['folders'][0]['id'] == os.path.join(target, 'a')
+  assert 'paused' not in client.config['folders'][0]
+
+def test_failed_move_commits_nothing(tmpdir):
+  a = str(tmpdir.join('a'))
+  target = str(tmpdir.mkdir('target'))
+  make_tree(a)
+
+  client = MovingClient([a])
+
+  with pytest.raises(EnvironmentError):
+    client.move([a, str(tmpdir.join('missing'))], target)
+
+  # Paused and resumed, the move itself never committed
+  assert client.calls == ['GET', 'POST', 'POST']
+  assert client.adapter.writes == 0
+  assert client.config['folders'][0]['path'] == a + '/'
+  assert client.config['folders'][0]['paused'] is False
+  assert os.path.isdir(a)
+
+def test_interrupted_move_is_recognized(tmpdir):
+  source, target = str(tmpdir.join('src')), str(tmpdir.join('dst'))
+  files = make_tree(source)
+  copied = []
+
+  def copy_one(rel, progress):
+    if copied:
+      raise IOError('disk full')
+    copied.append(rel)
+    real_copy(rel, progress)
+
+  copy = copy_engine.TreeCopy(source, target, workers=1)
+  real_copy, copy.copy = copy.copy, copy_one
+
+  with pytest.raises(IOError):
+    copy.run()
+
+  # target is left behind, and belongs to this move only
+  assert copy_engine.interrupted(source + '/', target)
+  assert not copy_engine.interrupted(str(tmpdir.join('other')), target)
+
+  # Running it again resumes instead of starting over
+  resumed = copy_engine.place(source, target)
+  assert copied[0] not in [rel for rel, size in resumed.files]
+  assert len(resumed.files) == 3
+
+  resumed.run()
+  resumed.finish()
+  assert_copied(target, files)
+  assert not copy_engine.interrupted(source, target)
+
+def test_move_interrupted_in_first_file(tmpdir):
+  source, target = str(tmpdir.join('src')), str(tmpdir.join('dst'))
+  files = make_tree(source)
+
+  def copy_one(rel, progress):
+    # Part of the first file is written, then the move dies
+    open(os.path.join(target, rel), 'wb').close()
+    raise IOError('disk full')
+
+  copy = copy_engine.TreeCopy(source, target, workers=1)
+  copy.copy = copy_one
+
+  with pytest.raises(IOError):
+    copy.run()
+
+  # Nothing was recorded as copied, yet target is known to be this move's
+  assert os.path.isdir(target)
+  assert copy_engine.interrupted(source, target)
+
+  resumed = copy_engine.place(source, target)
+  assert len(resumed.files) == 4
+
+  resumed.run()
+  resumed.finish()
+  assert_copied(target, files)
@@ -0,0 +1,82 @@
+from kodrive import syncthing_factory
+from kodrive.syncthing_factory import SyncthingFacade
+from kodrive.utils import discovery_cache
+from kodrive.utils.discovery_cache import DiscoveryCache
+from kodrive.py_syncthing_adapter.batch import BatchResult
+
+class FakeSync(object):
+
+  def __init__(self, discovery, connections):
+    self.answers = {'discovery' : discovery, 'connections' : connections}
+    self.sys = self
+
+  def discovery(self):
+    return self.answers['discovery']
+
+  def connections(self):
+    return self.answers['connections']
+
+  def batch(self, calls):
+    return [BatchResult(fn(), None) for fn, params in calls]
+
+def test_host_of():
+  assert discovery_cache.host_of('tcp://1.2.3.4:22000') == '1.2.3.4'
+  assert discovery_cache.host_of('tcp://[fe80::1]:22000') == 'fe80::1'
+  assert discovery_cache.host_of('10.0.0.1:22000') == '10.0.0.1'
+  assert discovery_cache.host_of('relay://1.2.3.4:22067') is None
+  assert discovery_cache.host_of('tcp://0.0.0.0:22000') is None
+
+def test_refresh_and_expiry(tmpdir):
+  cache = DiscoveryCache(str(tmpdir), ttl=60)
+  sync = FakeSync(
+    {'A' : {'addresses' : ['relay://9.9.9.9:1', 'tcp://1.1.1.1:22000']},
+     'B' : {'addresses' : ['tcp://2.2.2.2:22000']}},
+    {'connections' : {
+      'B' : {'connected' : True, 'address' : '3.3.3.3:22000'},
+      'C' : {'connected' : False, 'address' : ''}}})
+
+  assert cache.get('A') is None
+  assert cache.refresh(sync) == {'A' : '1.1.1.1', 'B' : '3.3.3.3'}
+
+  # Read back from disk by another instance
+  assert DiscoveryCache(str(tmpdir)).get('B') == '3.3.3.3'
+
+  expired = DiscoveryCache(str(tmpdir), ttl=-1)
+  assert expired.get('A') is None
+  assert expired.get('A', stale=True) == '1.1.1.1'
+
+class FakeProxy(object):
+
+  def __init__(self, device_id, host, api_key, **kwargs):
+    if host != '5.5.5.5':
+      raise IOError('Could not connect to %s.' % host)
+    self.host = host
+
+class FakeFacade(SyncthingFacade):
+
+  def __init__(self, cache):
+    SyncthingFacade.__init__(self, sync=FakeSync(
+      {'A' : {'addresses' : ['tcp://5.5.5.5:22000']}}, {}))
+    self.cache = cache
+
+  def discovery_cache(self):
+    return self.cache
+
+def test_unreachable_cached_host_is_rediscovered(tmpdir, monkeypatch):
+  monkeypatch.setattr(syncthing_factory, 'SyncthingProxy', FakeProxy)
+
+  cache = DiscoveryCache(str(tmpdir))
+  cache.update({'A' : '1.1.1.1'})
+
+  remote = FakeFacade(cache).connect_device('A', 'key')
+
+  assert remote.host == '5.5.5.5'
+  assert cache.get('A') == '5.5.5.5'
+
+def test_evict(tmpdir):
+  cache = DiscoveryCache(str(tmpdir))
+  cache.update({'A' : '1.1.1.1', 'B' : '2.2.2.2'})
+  cache.evict('A')
+
+  assert cache.get('A', stale=True) is None
+  assert cache.get('B') == '2.2.2.2'
@@ -0,0 +1,59 @@
+from requests.exceptions import ConnectionError, ReadTimeout
+
+from kodrive.py_syncthing_adapter.events import EventStream
+
+class FakeInterface(object):
+  '''
+    /rest/events over a list of buffered events; each poll first plays
+    the next scripted outcome, if any
+  '''
+
+  def __init__(self, events, script=()):
+    self.events = events
+    self.script = list(script)
+    self.polls = []
+
+  def long_poll(self, endpoint, read_timeout, since=0, limit=None, timeout=None, **params):
+    self.polls.append(since)
+
+    if self.script:
+      outcome = self.script.pop(0)
+      if isinstance(outcome, Exception):
+        raise outcome
+
+    events = [e for e in self.events if e['id'] > since]
+    return events[-limit:] if limit else events
+
+def event(id, type='StateChanged'):
+  return {'id' : id, 'type' : type}
+
+def test_cursor_survives_timeout():
+  iface = FakeInterface([event(1), event(2)], [None, ReadTimeout()])
+  stream = EventStream(iface, since=0)
+
+  assert [e['id'] for e in stream.poll()] == [1, 2]
+
+  # A timed out poll returns nothing and keeps the cursor
+  assert stream.poll() == []
+  assert stream.since == 2
+
+  iface.events.append(event(3))
+  assert [e['id'] for e in stream.poll()] == [3]
+  assert iface.polls[-1] == 2
+
+def test_cursor_resets_after_restart():
+  iface = FakeInterface([event(n) for n in range(1, 6)])
+  stream = EventStream(iface, since=0)
+  stream.poll()
+
+  # The restarted daemon numbers its events from 1 again
+  iface.events = [event(1, 'StartupComplete')]
+  assert stream.poll() == []
+  assert stream.since == 0
+  assert [e['type'] for e in stream.poll()] == ['StartupComplete']
+
+def test_reconnects_and_filters():
+  iface = FakeInterface([event(1), event(2, 'FolderSummary')], [ConnectionError()])
+  stream = EventStream(iface, types=['FolderSummary'], since=0, retry_interval=0)
+
+  assert stream.wait_for(timeout=5)['id'] == 2
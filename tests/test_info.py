@@ -0,0 +1,47 @@
+import json
+
+from click.testing import CliRunner
+
+from kodrive import cli
+from kodrive import cli_syncthing_adapter
+
+def fake_info(pulled, count):
+  def needed():
+    for n in range(count):
+      pulled.append(n)
+      yield 'queued', {'name' : 'f%d' % n}
+
+  def info(folder):
+    return {
+      'status' : {'state' : 'syncing', 'needFiles' : count},
+      'files_needed' : needed(),
+      'auth_report' : []
+    }, False
+
+  return info
+
+def run_info(monkeypatch, count, *args):
+  pulled = []
+  monkeypatch.setattr(cli_syncthing_adapter, 'info', fake_info(pulled, count))
+
+  result = CliRunner().invoke(cli.dir, ['info', '--json'] + list(args) + ['.'])
+  assert result.exit_code == 0, result.output
+  return json.loads(result.output), pulled
+
+def test_info_json(monkeypatch):
+  output, pulled = run_info(monkeypatch, 3)
+
+  assert output['files_needed'] == ['f0', 'f1', 'f2']
+  assert output['status']['state'] == 'syncing'
+  assert output['devices'] == []
+
+def test_info_json_limit(monkeypatch):
+  output, pulled = run_info(monkeypatch, 1000, '--limit', '2')
+
+  # Pages past the limit are never fetched
+  assert output['files_needed'] == ['f0', 'f1']
+  assert pulled == [0, 1]
+
+  output, pulled = run_info(monkeypatch, 3, '--summary')
+  assert output['files_needed'] == []
+  assert pulled == []
@@ -0,0 +1,35 @@
+import json
+
+from kodrive.py_syncthing_adapter import instrument
+
+def record(elapsed, status=200, error=None):
+  return instrument.CallRecord('GET', '/rest/system/ping', status, elapsed, 2, 10, 0, error)
+
+def test_aggregator_percentiles():
+  agg = instrument.Aggregator()
+
+  for n in range(1, 101):
+    agg(record(n / 1000.0))
+  agg(record(0.5, status=None, error='ConnectionError'))
+
+  row = json.loads(agg.dump())['GET /rest/system/ping']
+  assert row['count'] == 101
+  assert row['errors'] == 1
+  assert row['resp_bytes'] == 1010
+  assert row['p50'] == 0.051
+  assert row['p99'] == 0.1
+
+def test_span_hooks():
+  seen = []
+  instrument.add_hook(seen.append)
+
+  try:
+    with instrument.span('restart'):
+      pass
+  finally:
+    instrument.remove_hook(seen.append)
+
+  with instrument.span('restart'):
+    pass
+
+  assert [(r.verb, r.endpoint) for r in seen] == [('SPAN', 'restart')]
@@ -0,0 +1,125 @@
+import os, json
+
+from kodrive import platform_adapter
+from kodrive.syncthing_factory import SyncthingClient
+
+CONFIG_XML = """<configuration>
+  <folder id="a" path="%(a)s/"><device id="ME"></device></folder>
+  <folder id="b" path="%(b)s/"><device id="ME"></device></folder>
+  <gui><address>127.0.0.1:8384</address><apikey>k</apikey></gui>
+</configuration>"""
+
+class Client(SyncthingClient):
+
+  def __init__(self, adapter):
+    SyncthingClient.__init__(self, adapter)
+    self.parses = 0
+    self.writes = 0
+
+  def ping(self):
+    return True
+
+def make_client(tmpdir, server):
+  adapter = platform_adapter.SyncthingLinux64(str(tmpdir))
+  paths = {'a' : str(tmpdir.mkdir('a')), 'b' : str(tmpdir.mkdir('b'))}
+
+  os.makedirs(adapter.st_conf_dir)
+  with open(adapter.st_conf_file, 'w') as f:
+    f.write(CONFIG_XML % paths)
+
+  config = adapter.get_config()
+  config['system']['server'] = server
+  for name, path in paths.items():
+    config['directories'][name] = {
+      'local_path' : path, 'is_shared' : not server, 'server' : not server}
+  adapter.set_config(config)
+
+  client = Client(adapter)
+
+  def count(method, counter):
+    def wrapper(*args):
+      setattr(client, counter, getattr(client, counter) + 1)
+      return method(*args)
+    return wrapper
+
+  adapter.get_folder_map = count(adapter.get_folder_map, 'parses')
+  adapter.set_folders = count(adapter.set_folders, 'writes')
+
+  return client, paths
+
+def read_devices(path):
+  with open(os.path.join(path, '.kodrive', 'config.json')) as f:
+    return json.loads(f.read())['devices']
+
+def write_devices(path, ids):
+  os.makedirs(os.path.join(path, '.kodrive'))
+  with open(os.path.join(path, '.kodrive', 'config.json'), 'w') as f:
+    f.write(json.dumps({'devices' : [{'id' : i} for i in ids]}))
+
+def test_server_broadcasts_changes_only(tmpdir):
+  client, paths = make_client(tmpdir, server=True)
+
+  client.live_update()
+  assert read_devices(paths['a']) == [{'id' : 'ME'}]
+
+  # Left alone while the device list is unchanged
+  with open(os.path.join(paths['a'], '.kodrive', 'config.json'), 'w') as f:
+    f.write('{"devices": [], "marker": 1}')
+
+  client.live_update()
+  assert read_devices(paths['a']) == []
+  assert client.parses == 2
+
+def test_client_applies_in_one_write(tmpdir):
+  client, paths = make_client(tmpdir, server=False)
+
+  client.live_update()
+  assert (client.parses, client.writes) == (0, 0)
+
+  write_devices(paths['a'], ['ME', 'SERVER'])
+  write_devices(paths['b'], ['ME', 'OTHER'])
+
+  client.live_update()
+  assert (client.parses, client.writes) == (1, 1)
+
+  folders = client.adapter.platform_get_folder_map(client.adapter.st_conf_file)
+  assert sorted(d['id'] for d in folders[paths['a']]['devices']) == ['ME', 'SERVER']
+  assert sorted(d['id'] for d in folders[paths['b']]['devices']) == ['ME', 'OTHER']
+
+  # Nothing changed since, config.xml is not even parsed
+  client.live_update()
+  assert (client.parses, client.writes) == (1, 1)
+
+def test_config_writes_skip_unchanged(tmpdir, monkeypatch):
+  adapter = platform_adapter.SyncthingLinux64(str(tmpdir))
+  config = adapter.get_config()
+
+  # The file is neither read nor parsed again to find the write is a no-op
+  monkeypatch.setattr(platform_adapter.codec, 'loads', None)
+  assert not adapter.set_config(config)
+
+  config['directories']['/x'] = {'local_path' : '/x'}
+  assert adapter.set_config(config)
+  assert not adapter.set_config(config)
+
+  # Written behind our back: the next write goes through
+  monkeypatch.undo()
+  with open(adapter.app_conf_file, 'w') as f:
+    f.write('{}')
+  assert adapter.set_config(config)
+  assert adapter.get_config() == config
+
+def test_large_config_is_streamed(tmpdir, monkeypatch):
+  adapter = platform_adapter.SyncthingLinux64(str(tmpdir))
+  config = adapter.get_config()
+  monkeypatch.setattr(platform_adapter, 'STREAM_THRESHOLD', 10)
+
+  streamed = []
+  dump = platform_adapter.codec.dump
+  monkeypatch.setattr(platform_adapter.codec, 'dump',
+    lambda obj, fp, stream=False: streamed.append(stream) or dump(obj, fp, stream))
+
+  config['system']['sync-speed'] = 5
+  assert adapter.set_config(config)
+  assert streamed == [True]
+  assert adapter.get_config() == config
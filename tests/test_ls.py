@@ -0,0 +1,87 @@
+import json
+
+from click.testing import CliRunner
+
+from kodrive import cli
+from kodrive import cli_syncthing_adapter
+from kodrive import syncthing_factory
+from kodrive.py_syncthing_adapter.batch import run_batch
+
+from .fakes import Commands, FakeAdapter, FakeClient
+
+class FakeSync(object):
+
+  def __init__(self):
+    self.calls = []
+    self.stats = Commands(folder=self.folder_stats)
+    self.db = Commands(status=self.status)
+    self.sys = Commands(ping=lambda: {'ping' : 'pong'})
+
+  def folder_stats(self):
+    self.calls.append('stats')
+    return {'fa' : {'lastScan' : '2020-01-02T03:04:05.678+01:00'}}
+
+  def status(self, folder):
+    self.calls.append(folder)
+    return {'state' : 'idle', 'needBytes' : 0 if folder == 'fa' else 12}
+
+  def batch(self, calls):
+    return run_batch(calls, 4)
+
+class ListingClient(FakeClient):
+
+  def __init__(self):
+    FakeClient.__init__(self, {'folders' : [
+      {'id' : 'fa', 'path' : '/a/', 'label' : 'alpha'},
+      {'id' : 'fb', 'path' : '/b/', 'label' : 'docs'}
+    ], 'devices' : []}, FakeAdapter({
+      'b' : {'label' : 'docs', 'local_path' : '/b'},
+      'a' : {'label' : None, 'local_path' : '/a'},
+      'c' : {'label' : None, 'local_path' : '/c'}
+    }))
+    self.sync = FakeSync()
+
+def test_entries_fetch_config_once():
+  client = ListingClient()
+
+  assert client.ls_entries() == [
+    {'tag' : 'alpha', 'path' : '/a'},
+    {'tag' : 'docs', 'path' : '/b'},
+    {'tag' : '', 'path' : '/c'}
+  ]
+  assert client.calls == ['GET']
+
+def test_long(monkeypatch):
+  client = ListingClient()
+  monkeypatch.setattr(syncthing_factory, 'LS_BATCH', 2)
+
+  rows = list(client.ls(long=True))
+
+  assert [(r['id'], r['need_bytes']) for r in rows] == [('fa', 0), ('fb', 12), (None, None)]
+  assert rows[0]['last_scan'].startswith('2020')
+  assert client.sync.calls.count('stats') == 1
+
+def test_output(monkeypatch):
+  monkeypatch.setattr(syncthing_factory, 'get_handler', ListingClient)
+
+  lines = list(cli_syncthing_adapter.ls())
+  assert lines[0].split() == ['Tag', 'Path']
+  assert lines[1].split() == ['alpha', '/a']
+  assert lines[3] == '{:<10}/c'.format('')
+
+  lines = list(cli_syncthing_adapter.ls(long=True))
+  assert lines[1].split() == ['alpha', '/a', 'idle', '0', '2020-01-02', '03:04:05']
+  assert lines[3].split() == ['/c', '-', '-', '-']
+
+  assert json.loads('\n'.join(cli_syncthing_adapter.ls(fmt='json')))[2]['path'] == '/c'
+  assert [json.loads(l)['tag'] for l in cli_syncthing_adapter.ls(fmt='ndjson')] == ['alpha', 'docs', '']
+
+def test_long_without_daemon(monkeypatch):
+  client = ListingClient()
+  client.sync.sys = Commands()
+  monkeypatch.setattr(syncthing_factory, 'get_handler', lambda: client)
+
+  result = CliRunner().invoke(cli.ls, ['--long'])
+
+  assert result.exception is None
+  assert 'Cannot connect to KodeDrive' in result.output
@@ -0,0 +1,70 @@
+import itertools
+
+from kodrive.py_syncthing_adapter.paging import iter_need, iter_browse
+
+class FakeNeed(object):
+  '''
+    Paginated db.need over total files, split across the sections
+  '''
+
+  def __init__(self, total, paged=True):
+    self.files = [{'name' : 'f%d' % n} for n in range(total)]
+    self.paged = paged
+    self.pages = []
+
+  def __call__(self, folder, page, perpage):
+    self.pages.append(page)
+
+    if not self.paged:
+      return {'progress' : [], 'queued' : [], 'rest' : self.files}
+
+    files = self.files[(page - 1) * perpage:page * perpage]
+    return {
+      'progress' : files[:1], 'queued' : files[1:2], 'rest' : files[2:],
+      'page' : page, 'perpage' : perpage
+    }
+
+def names(need, perpage):
+  return [f['name'] for section, f in iter_need(need, 'a', perpage)]
+
+def test_need_pages():
+  need = FakeNeed(7)
+  assert names(need, 3) == ['f%d' % n for n in range(7)]
+  assert need.pages == [1, 2, 3]
+
+def test_need_exact_pages():
+  # A full last page costs one more, empty, request
+  need = FakeNeed(6)
+  assert names(need, 3) == ['f%d' % n for n in range(6)]
+  assert need.pages == [1, 2, 3]
+
+def test_need_sections():
+  sections = [s for s, f in iter_need(FakeNeed(3), 'a', 10)]
+  assert sections == ['progress', 'queued', 'rest']
+
+def test_need_limit_stops_paging():
+  need = FakeNeed(1000)
+  first = list(itertools.islice(iter_need(need, 'a', 10), 15))
+
+  assert [f['name'] for s, f in first] == ['f%d' % n for n in range(15)]
+  assert need.pages == [1, 2]
+
+def test_need_unpaged_daemon():
+  need = FakeNeed(7, paged=False)
+  assert names(need, 3) == ['f%d' % n for n in range(7)]
+  assert need.pages == [1]
+
+def test_browse_levels():
+  tree = {
+    '' : [
+      {'name' : 'd', 'type' : 'FILE_INFO_TYPE_DIRECTORY'},
+      {'name' : 'x', 'type' : 'FILE_INFO_TYPE_FILE', 'size' : 1}
+    ],
+    'd' : {'y' : ['2020-01-01', 2], 'e' : {}},
+    'd/e' : {}
+  }
+
+  def browse(folder, levels, prefix=''):
+    return tree[prefix]
+
+  assert sorted(path for path, entry in iter_browse(browse, 'a')) == ['d', 'd/e', 'd/y', 'x']
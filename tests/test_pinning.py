@@ -0,0 +1,95 @@
+import ssl
+import threading
+import subprocess
+
+import pytest
+import requests
+
+try:
+  from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+except ImportError:
+  from http.server import HTTPServer, BaseHTTPRequestHandler
+
+from kodrive.py_syncthing_adapter import make_session
+from kodrive.py_syncthing_adapter import pinning
+from kodrive import platform_adapter, syncthing_factory
+from kodrive.data import custom_errors
+
+class Server(HTTPServer):
+
+  served = 0
+
+  def handle_error(self, request, client_address):
+    # Clients that reject the certificate hang up mid-connection
+    pass
+
+class Handler(BaseHTTPRequestHandler):
+
+  def do_GET(self):
+    self.server.served += 1
+    self.send_response(200)
+    self.send_header('Content-Length', '2')
+    self.end_headers()
+    self.wfile.write(b'{}')
+
+  def log_message(self, *args):
+    pass
+
+@pytest.fixture
+def server(tmpdir):
+  cert = str(tmpdir.join('cert.pem'))
+  key = str(tmpdir.join('key.pem'))
+
+  try:
+    subprocess.check_call([
+      'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+      '-subj', '/CN=syncthing', '-keyout', key, '-out', cert
+    ], stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+  except (OSError, subprocess.CalledProcessError):
+    pytest.skip('openssl is not available')
+
+  httpd = Server(('127.0.0.1', 0), Handler)
+  httpd.socket = ssl.wrap_socket(httpd.socket, keyfile=key, certfile=cert, server_side=True)
+
+  t = threading.Thread(target=httpd.serve_forever)
+  t.daemon = True
+  t.start()
+
+  yield 'https://127.0.0.1:%d/' % httpd.server_address[1], pinning.file_fingerprint(cert), httpd
+
+  httpd.shutdown()
+  httpd.server_close()
+
+def test_normalize():
+  assert pinning.normalize('AB:cd EF') == 'abcdef'
+
+def test_pinned_certificate_is_accepted(server):
+  url, fingerprint, httpd = server
+  pinned = ':'.join(fingerprint[n:n + 2] for n in range(0, len(fingerprint), 2)).upper()
+
+  assert make_session(fingerprint=pinned).get(url, timeout=5).json() == {}
+  assert httpd.served == 1
+
+def test_pin_mismatch_is_rejected(server):
+  url, fingerprint, httpd = server
+
+  with pytest.raises(requests.exceptions.SSLError):
+    make_session(fingerprint='00' * 32).get(url, timeout=5)
+
+  # The request itself was never sent
+  assert httpd.served == 0
+
+def test_tls_gui_without_cert_fails_closed(tmpdir):
+  config_path = tmpdir.join('config.xml')
+  config_path.write(
+    '<configuration><gui tls="true"><address>127.0.0.1:8384</address>'
+    '<apikey>key</apikey></gui></configuration>'
+  )
+  adapter = platform_adapter.SyncthingLinux64(str(tmpdir))
+
+  with pytest.raises(custom_errors.GuiCertMissing):
+    adapter.get_platform_gui_hook(str(config_path))
+
+def test_proxy_without_fingerprint_fails_closed():
+  with pytest.raises(custom_errors.UnpinnedKey):
+    syncthing_factory.SyncthingProxy('DEVICE', '127.0.0.1', 'key', port=8384)
@@ -0,0 +1,73 @@
+from kodrive import cli_syncthing_adapter, syncthing_factory
+from kodrive.syncthing_factory import SyncthingFacade, summarize_completion
+
+from . import fakes
+from .fakes import FakeStream
+
+class FakeFacade(SyncthingFacade):
+
+  def __init__(self, *answers):
+    SyncthingFacade.__init__(self)
+    self.answers = list(answers)
+    self.queries = 0
+
+  def device_completion(self, folder_id, devices):
+    self.queries += 1
+    return dict(self.answers.pop(0))
+
+def event(type, **data):
+  return {'type' : type, 'data' : data}
+
+def test_summarize():
+  assert summarize_completion({}) == {'percent' : 100, 'device_num' : 0, 'max_devices' : 0}
+  assert summarize_completion({'A' : 100, 'B' : 50}) == {
+    'percent' : 75.0, 'device_num' : 1, 'max_devices' : 2}
+
+def test_completion_covers_remote_devices():
+  config = fakes.make_config()
+  config['folders'][0]['devices'].append({'deviceID' : 'OWN'})
+  facade = fakes.FakeFacade(config)
+  facade.get_device_id = lambda: 'OWN'
+  facade.device_completion = lambda folder_id, devices: dict((d, 50) for d in devices)
+
+  assert facade.completion('/a') == {'percent' : 50.0, 'device_num' : 0, 'max_devices' : 1}
+
+def test_progress_follows_events():
+  # Before the scan everything looks synchronized; after it, B is
+  # missing what the scan found
+  facade = FakeFacade({'A' : 100, 'B' : 100}, {'A' : 100, 'B' : 40})
+  stream = FakeStream([
+    event('StateChanged', folder='f', to='scanning', **{'from' : 'idle'}),
+    event('FolderScanProgress', folder='f', current=1, total=2),
+    event('StateChanged', folder='other', to='idle', **{'from' : 'scanning'}),
+    event('StateChanged', folder='f', to='idle', **{'from' : 'scanning'}),
+    event('FolderCompletion', folder='f', device='B', completion=80),
+    event('FolderCompletion', folder='f', device='B', completion=100),
+    event('FolderCompletion', folder='f', device='B', completion=100)
+  ])
+
+  updates = list(facade.iter_progress(stream, 'f', ['A', 'B']))
+
+  # Not done before the scan is over, even though completion looked full
+  assert updates[0]['state'] == 'scanning'
+  assert [u['percent'] for u in updates] == [100.0, 100.0, 100.0, 70.0, 90.0, 100.0]
+  assert updates[-1]['device_num'] == 2
+  assert facade.queries == 2
+
+def test_cli_push_is_bounded(monkeypatch):
+  class Handler(object):
+
+    def wait_start(self, *args, **kwargs):
+      return True
+
+    def push_progress(self, path, timeout=None):
+      self.timeout = timeout
+      return iter([])
+
+  handler = Handler()
+  monkeypatch.setattr(syncthing_factory, 'get_handler', lambda: handler)
+
+  progress, err = cli_syncthing_adapter.push_progress('/a')
+
+  assert not err
+  assert handler.timeout == syncthing_factory.PUSH_TIMEOUT
@@ -0,0 +1,53 @@
+from kodrive.py_syncthing_adapter import readiness
+from kodrive.py_syncthing_adapter.readiness import Readiness
+from kodrive.py_syncthing_adapter.retry import RetryPolicy
+
+from .fakes import FakeStream
+
+class FakeSync(object):
+
+  def __init__(self, up_after=0, uptime=0, started=False):
+    self.checks = 0
+    self.up_after = up_after
+    self.pings = 0
+    self.uptime = uptime
+    self.started = started
+    self.sys = self
+
+  def reachable(self):
+    self.checks += 1
+    return self.checks > self.up_after
+
+  def probe(self):
+    self.pings += 1
+    return True
+
+  def status(self):
+    return {'uptime' : self.uptime}
+
+  def events(self, **kwargs):
+    return FakeStream([{'type' : 'StartupComplete'}] if self.started else [])
+
+def test_ready_daemon_costs_one_ping():
+  sync = FakeSync()
+  ready = Readiness(sync)
+
+  assert ready.wait(1)
+  assert sync.pings == 1
+  assert ready.failed_stage is None
+
+def test_down_daemon_never_pinged():
+  sync = FakeSync(up_after=1000)
+  ready = Readiness(sync, RetryPolicy(base=0.01, cap=0.02))
+
+  assert not ready.wait(0.1)
+  assert sync.pings == 0
+  assert ready.failed_stage == 'socket'
+
+def test_startup_stage():
+  assert Readiness(FakeSync()).check(startup=True) == 'startup'
+  assert Readiness(FakeSync(started=True)).check(startup=True) is None
+  assert Readiness(FakeSync(uptime=readiness.STARTUP_GRACE)).check(startup=True) is None
+
+def test_unset_client():
+  assert Readiness(None).check() == 'socket'
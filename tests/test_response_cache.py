@@ -0,0 +1,60 @@
+import threading, time
+
+from kodrive.py_syncthing_adapter.cache import ResponseCache
+
+CONFIG = '/rest/system/config'
+PING = '/rest/system/ping'
+
+def test_cache_ttl():
+  cache = ResponseCache({CONFIG : 60})
+  calls = []
+
+  def loader():
+    calls.append(1)
+    return {'folders' : []}
+
+  cache.get(CONFIG, {}, loader)
+  cache.get(CONFIG, {}, loader)
+  assert len(calls) == 1
+
+  # Uncached endpoints always hit the loader
+  cache.get(PING, {}, loader)
+  cache.get(PING, {}, loader)
+  assert len(calls) == 3
+
+def test_cache_returns_copies():
+  cache = ResponseCache({CONFIG : 60})
+  config = cache.get(CONFIG, {}, lambda: {'folders' : []})
+  config['folders'].append('mutated')
+
+  assert cache.get(CONFIG, {}, lambda: None) == {'folders' : []}
+
+def test_cache_invalidate():
+  cache = ResponseCache({CONFIG : 60})
+  cache.get(CONFIG, {}, lambda: {'n' : 1})
+  cache.invalidate()
+
+  assert cache.get(CONFIG, {}, lambda: {'n' : 2}) == {'n' : 2}
+
+def test_cache_single_flight():
+  cache = ResponseCache({CONFIG : 60})
+  calls = []
+
+  def loader():
+    calls.append(1)
+    time.sleep(0.2)
+    return {'n' : len(calls)}
+
+  results = []
+  threads = [
+    threading.Thread(target=lambda: results.append(cache.get(CONFIG, {}, loader)))
+    for i in range(8)
+  ]
+
+  for t in threads:
+    t.start()
+  for t in threads:
+    t.join()
+
+  assert len(calls) == 1
+  assert results == [{'n' : 1}] * 8
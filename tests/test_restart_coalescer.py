@@ -0,0 +1,62 @@
+import os, sys, time, subprocess
+import pytest
+
+from kodrive.data import custom_errors
+
+from kodrive.utils.restart_coalescer import RestartCoalescer
+
+def make_coalescer(tmpdir, delay=0.2):
+  log = str(tmpdir.join('restarts'))
+
+  def restart():
+    with open(log, 'a') as f:
+      f.write('restart\n')
+
+  return RestartCoalescer(str(tmpdir), delay, restart), log
+
+def test_burst_restarts_once(tmpdir):
+  coalescer, log = make_coalescer(tmpdir)
+
+  tickets = [coalescer.request() for n in range(10)]
+  assert coalescer.wait(tickets[-1], timeout=10)
+
+  with open(log) as f:
+    assert f.read() == 'restart\n'
+
+  # Earlier tickets are covered by the same restart
+  assert coalescer.wait(tickets[0], timeout=0)
+
+def test_later_request_restarts_again(tmpdir):
+  coalescer, log = make_coalescer(tmpdir, delay=0.05)
+
+  assert coalescer.wait(coalescer.request(), timeout=10)
+  assert coalescer.wait(coalescer.request(), timeout=10)
+
+  with open(log) as f:
+    assert f.read().count('restart') == 2
+
+def test_wait_times_out(tmpdir):
+  coalescer, log = make_coalescer(tmpdir, delay=5)
+
+  assert not coalescer.wait(coalescer.request(), timeout=0.2)
+  assert not os.path.exists(log)
+
+def test_failed_restart_is_reported(tmpdir):
+  def restart():
+    raise IOError('refused')
+
+  coalescer = RestartCoalescer(str(tmpdir), 0.05, restart)
+  ticket = coalescer.request()
+
+  with pytest.raises(custom_errors.RestartFailed):
+    coalescer.wait(ticket, timeout=10)
+
+def test_executor_releases_output(tmpdir):
+  # A caller capturing our output must not wait for the quiet period
+  script = (
+    "from kodrive.utils.restart_coalescer import RestartCoalescer\n"
+    "RestartCoalescer(%r, 5, lambda: None).request()\n" % str(tmpdir))
+
+  started = time.time()
+  subprocess.check_output([sys.executable, '-c', script])
+  assert time.time() - started < 4
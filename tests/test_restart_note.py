@@ -0,0 +1,30 @@
+from kodrive import cli_syncthing_adapter
+from kodrive import syncthing_factory
+
+class FakeHandler(object):
+  '''
+    Handler whose add skips a restart only when asked to consider one
+  '''
+
+  def __init__(self):
+    self.skipped_restarts = 0
+    self.added = None
+
+  def wait_start(self, *args, **kwargs):
+    return True
+
+  def add(self, **kwargs):
+    self.added = kwargs
+    if 'wait' not in kwargs:
+      self.skipped_restarts += 1
+
+def test_add_never_restarts(tmpdir, monkeypatch):
+  handler = FakeHandler()
+  monkeypatch.setattr(syncthing_factory, 'get_handler', lambda: handler)
+
+  output, err = cli_syncthing_adapter.add(path=str(tmpdir), tag='t')
+
+  assert not err
+  assert handler.added['wait'] is True
+  # No restart was considered, so none is reported as avoided
+  assert output == 'You can now share %s' % tmpdir
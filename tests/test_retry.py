@@ -0,0 +1,83 @@
+import time
+
+import pytest
+import requests
+
+from requests.exceptions import ConnectionError, ReadTimeout
+from kodrive.py_syncthing_adapter import Interface
+from kodrive.py_syncthing_adapter.retry import RetryPolicy, CircuitBreaker, CircuitOpen
+
+def test_backoff_delays():
+  policy = RetryPolicy(base=0.01, cap=0.08, jitter=0, max_attempts=6)
+  assert list(policy.delays()) == [0.01, 0.02, 0.04, 0.08, 0.08]
+
+def test_retry_call():
+  policy = RetryPolicy(base=0.001, max_attempts=3)
+  calls = []
+
+  def flaky():
+    calls.append(1)
+    if len(calls) < 3:
+      raise ConnectionError()
+    return 'pong'
+
+  assert policy.call(flaky) == 'pong'
+  assert len(calls) == 3
+
+def test_wait_until_timeout():
+  policy = RetryPolicy(base=0.01, cap=0.05)
+  start = time.time()
+
+  assert not policy.wait_until(lambda: False, 0.2)
+  assert time.time() - start < 0.5
+
+def test_circuit_breaker():
+  breaker = CircuitBreaker(failure_threshold=2, reset_timeout=0.05)
+
+  breaker.record_failure()
+  assert breaker.allow()
+
+  breaker.record_failure()
+  assert breaker.is_open
+  assert not breaker.allow()
+
+  # One probe is let through after reset_timeout
+  time.sleep(0.06)
+  assert breaker.allow()
+  assert not breaker.allow()
+
+  breaker.record_success()
+  assert breaker.state == CircuitBreaker.CLOSED
+
+def test_failed_probe_reopens_circuit():
+  iface = Interface('key', cache=False, breaker_threshold=1, breaker_reset=0.05)
+  outcomes = [ConnectionError(), ReadTimeout()]
+
+  def send(*args, **kwargs):
+    if outcomes:
+      raise outcomes.pop(0)
+
+    resp = requests.Response()
+    resp.status_code = 200
+    resp.headers['Content-Type'] = 'application/json'
+    resp._content = b'{}'
+    return resp
+
+  iface._send = send
+
+  with pytest.raises(ConnectionError):
+    iface.do_req('GET', '/rest/system/status')
+  assert iface.breaker.is_open
+
+  # The half-open probe times out: the circuit opens again, for a while
+  time.sleep(0.06)
+  with pytest.raises(ReadTimeout):
+    iface.do_req('GET', '/rest/system/status')
+  assert iface.breaker.is_open
+
+  with pytest.raises(CircuitOpen):
+    iface.do_req('GET', '/rest/system/status')
+
+  time.sleep(0.06)
+  assert iface.do_req('GET', '/rest/system/status') == {}
+  assert iface.breaker.state == CircuitBreaker.CLOSED
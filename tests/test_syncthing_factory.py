@@ -222,6 +222,7 @@ def test_link_server():
     tag='my-sync',
     remote_host='0.0.0.0',
     remote_port=mock.server_conf['port'],
+    remote_fingerprint=md['fingerprint'],
     interval=5
   )
 
@@ -233,7 +234,8 @@ def test_link_server():
     md['devid'],
     '0.0.0.0',
     md['api_key'],
-    port=mock.server_conf['port']
+    port=mock.server_conf['port'],
+    fingerprint=md['fingerprint']
   )
   
   # Check Remote ~~~
@@ -329,7 +331,8 @@ def test_free_server():
     md['devid'],
     '0.0.0.0',
     md['api_key'],
-    port=mock.server_conf['port']
+    port=mock.server_conf['port'],
+    fingerprint=md['fingerprint']
   )
 
   # Check device metadata was deleted
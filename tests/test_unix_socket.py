@@ -0,0 +1,23 @@
+import socket
+
+from kodrive.py_syncthing_adapter import Syncthing, unix_socket
+
+def test_parse_address():
+  assert unix_socket.parse_address('unix:///tmp/st.sock') == '/tmp/st.sock'
+  assert unix_socket.parse_address('127.0.0.1:8384') is None
+
+def test_reachable(tmpdir):
+  path = str(tmpdir.join('st.sock'))
+  sync = Syncthing(api_key='test', socket_path=path)
+
+  assert not sync.reachable()
+  assert not sync.probe()
+
+  server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  server.bind(path)
+  server.listen(1)
+
+  try:
+    assert sync.reachable()
+  finally:
+    server.close()